@@ -1,16 +1,13 @@
 import os
-from multiprocessing import Pool
-from gc_parser import parse
 from nilang_interpreter import *
 from nilang_ir import *
+from gc_build import build
+import gc_trace
 import sys
 
-def print_parse(arg):
-    print('Process:' + arg)
-    return parse(open(arg,'r'))
-
 if __name__ == '__main__':
     runInVM = False
+    rebuild = False
     module = 'gc_cache/main.gc.nimo'
     files = []
     for i, arg in enumerate(sys.argv):
@@ -18,26 +15,28 @@ if __name__ == '__main__':
             files.append(arg)
         elif arg == 'run':
             runInVM = True
+        elif arg == 'rebuild':
+            rebuild = True
+        elif arg == 'trace':
+            gc_trace.enable()
+        elif arg == 'trace-time':
+            gc_trace.enable('time')
     if len(files) == 0:
         files = os.listdir()
-    pool = Pool(5)
     input = []
-    units = []
     os.makedirs('gc_cache', exist_ok=True)
     for f in files:
         if f.endswith('.gc'):
             input.append(f)
-    print('Process units')
-    processed = pool.map(print_parse, input)
+    processed = build(input, rebuild = rebuild)
 
-    if not all(processed):
+    if not all(processed.values()):
         print('skip compiling')
         exit(1)
 
     if runInVM:
-        bytes = open(module,'rb').read()
         vm = VM()
-        vm.AddMainModule(bytes)
+        vm.LoadMainModule(module)
         vm.Run()
 
 #    irModule = IRModule()
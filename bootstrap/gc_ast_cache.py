@@ -0,0 +1,129 @@
+import os
+import struct
+import marshal
+import hashlib
+from lark import Tree, Token
+import gc_parser_nodes
+from gc_parser_nodes import AstNode, nodeFields
+
+# Binary cache of the AST, the next build of an unchanged unit starts right
+# after the cached stage instead of parsing the source again.
+# GC_AST_CACHE selects the stage which is cached: nodes (after TokensToNodes,
+# default), decorated (after Decorate), optimized (after PostProcessor) or off.
+#
+# File layout: MAGIC, "<HB32s32s" header (format version, stage, source hash,
+# compiler hash) and the marshalled AST. A node is a tuple of its class index
+# and its fields, tokens and lark trees get a negative tag, lists and values
+# are stored as they are.
+
+MAGIC = b'GAST'
+VERSION = 1
+header = struct.Struct('<HB32s32s')
+
+NODES = 1
+DECORATED = 2
+OPTIMIZED = 3
+stages = {'off': 0, 'nodes': NODES, 'decorated': DECORATED, 'optimized': OPTIMIZED}
+
+TOKEN = -1
+TREE = -2
+
+compilerHash = None
+
+def cacheStage():
+    return stages.get(os.environ.get('GC_AST_CACHE','nodes'), NODES)
+
+def compilerDigest():
+    # The AST depends on the grammar and on all passes, any change of the compiler invalidates the cache.
+    global compilerHash
+    if compilerHash == None:
+        import gc_build
+        compilerHash = bytes.fromhex(gc_build.compilerVersion())
+    return compilerHash
+
+def sourceDigest(source):
+    return hashlib.sha256(source.encode('utf-8')).digest()
+
+def cacheFile(name):
+    return 'gc_cache/'+name+'.ast'
+
+class Encoder:
+    def __init__(self):
+        self.classes = {}
+        self.fields = {}
+
+    def encode(self, value):
+        t = type(value)
+        if t is list:
+            return [self.encode(e) for e in value]
+        index = self.classes.get(t)
+        if index != None:
+            return (index,)+tuple([self.encode(getattr(value, f)) for f in self.fields[t]])
+        if isinstance(value, AstNode):
+            self.classes[t] = len(self.classes)
+            self.fields[t] = nodeFields(t)
+            return self.encode(value)
+        if isinstance(value, Token):
+            return (TOKEN, value.type, str(value))
+        if isinstance(value, Tree):
+            return (TREE, self.encode(value.data), self.encode(value.children))
+        if isinstance(value, list):
+            return [self.encode(e) for e in value]
+        return value
+
+def encodeTree(node):
+    # Returns the names of the node classes and the encoded tree.
+    encoder = Encoder()
+    body = encoder.encode(node)
+    return tuple(cls.__name__ for cls in encoder.classes), body
+
+def decodeTree(names, body):
+    classes = [getattr(gc_parser_nodes, name) for name in names]
+    def decode(value):
+        t = type(value)
+        if t is tuple:
+            kind = value[0]
+            if kind >= 0:
+                return classes[kind](*[decode(e) for e in value[1:]])
+            if kind == TOKEN:
+                return Token(value[1], value[2])
+            return Tree(decode(value[1]), decode(value[2]))
+        if t is list:
+            return [decode(e) for e in value]
+        return value
+    return decode(body)
+
+def digest(encoded):
+    # Equal values have the same hash, marshal version 2 doesn't write references.
+    return hashlib.sha256(marshal.dumps(encoded, 2)).hexdigest()
+
+def structuralHash(*nodes):
+    return digest(tuple(encodeTree(node) for node in nodes))
+
+def dumps(ast, stage, sourceHash):
+    return MAGIC+header.pack(VERSION, stage, sourceHash, compilerDigest())+marshal.dumps(encodeTree(ast))
+
+def loads(data, sourceHash):
+    # Returns the AST and its stage, None if the cache doesn't belong to the source.
+    if data[:4] != MAGIC or len(data) < 4+header.size:
+        return None, 0
+    version, stage, cachedSourceHash, cachedCompilerHash = header.unpack_from(data, 4)
+    if version != VERSION or cachedSourceHash != sourceHash or cachedCompilerHash != compilerDigest():
+        return None, 0
+    names, body = marshal.loads(memoryview(data)[4+header.size:])
+    return decodeTree(names, body), stage
+
+def load(name, sourceHash):
+    path = cacheFile(name)
+    if cacheStage() == 0 or not os.path.exists(path):
+        return None, 0
+    with open(path,'rb') as f:
+        return loads(f.read(), sourceHash)
+
+def store(name, ast, stage, sourceHash):
+    if cacheStage() != stage:
+        return
+    temp = cacheFile(name)+'.'+str(os.getpid())+'.tmp'
+    with open(temp,'wb') as f:
+        f.write(dumps(ast, stage, sourceHash))
+    os.replace(temp, cacheFile(name))
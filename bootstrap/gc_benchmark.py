@@ -0,0 +1,1881 @@
+import os
+import sys
+import time
+import struct
+import inspect
+import dataclasses
+import tempfile
+import numpy as np
+from lark import Lark
+import gc_parser
+import gc_build
+import gc_ast_cache
+import gc_parser_nodes
+import nilang_ir
+from gc_parser_decorator import PrepareProcessing, Decorate
+from gc_parser_index import AstIndex
+from gc_parser_postprocessor import PostProcessor
+from gc_parser_nodes import TokensToNodes
+
+# Benchmarks of the compiler pipeline.
+# Usage: python gc_benchmark.py <benchmark> [units]
+
+def generateUnit(index, dependency = 'lib'):
+    # A small unit which touches the common constructs of the language.
+    return '''module unit{0}
+use "{2}"
+
+alias HANDLE{0} = ptr<void>
+
+[[lib:"Kernel32.dll"]]
+ExitProcess(u32 code);
+
+const u32 VALUE{0} = 1 << {1};
+const i32 OTHER{0} = {0};
+
+struct Point{0} {{
+    i32 x;
+    i32 y;
+    static u32 count;
+}}
+
+show{0}(u32 code) {{
+    ExitProcess(code)
+}}
+
+run( ) {{
+    if (VALUE{0} == OTHER{0}) {{
+        show{0}(VALUE{0})
+    }} else {{
+        show{0}({0})
+    }}
+    ExitProcess(0)
+}}
+'''.format(index, index % 16, dependency)
+
+def generateCorpus(units):
+    return [generateUnit(i) for i in range(units)]
+
+# Statements, each one is compiled inside of a function body.
+statementCorpus = [
+    'f(x)',
+    'a.f(x)',
+    'f()',
+    'a.f()',
+    'f(x).g(y)',
+    'x = 1',
+    'x += 1',
+    'a.b = c',
+    'return x',
+    'return a + b',
+    'u32 v = 1 << 3;',
+    'u32 v = "str";',
+    'u32 v = -1;',
+    'u32 v = (u32) x;',
+    'u32 v = a.b;',
+    'u32 v = a::b;',
+    'u32 v = f(1, 2);',
+    'u32 v = a == b && c != d || e;',
+    'const u32 v = 1 + 2 * 3 - 4 / 2 % 3;',
+    'if (a == b) { f(x) } else { g(y) }',
+    'if (a == b) f(x)',
+    'if (a) f(x) else g(y)',
+    'for i in xs { f(i) }',
+    'a ? b : c',
+    'a ? { return b } : c',
+    'match (x as y) -> u32 { 1: a 2: b default: c }',
+    'switch (x) { 1: a, 2: b break, default: c }',
+    '(u32 a) { return a }',
+    '[[inline]] (u32 a) -> u32 { return a }',
+    'return f(x)',
+    'return f()',
+    'return a.f(x)',
+    'u32 v = a.f(x);',
+    'u32 v = f();',
+    'u32 v = a.f();',
+    'u32 v = f(x).g;',
+    'u32 v = a.f(x).b;',
+    'g(f(x))',
+    'g(a.f(x), b.c, "s", -1, 2)',
+    'g(f())',
+    'x = f(y)',
+    'x = a.b(c)',
+    'u32 v = a::b.c;',
+    'u32 v = a.b::c;',
+    'u32 v = a::b(x);',
+    'f(x) + g(y)',
+    'f(x) - "s"',
+    'f(x) + g(y) - h(z)',
+    'return 1',
+    'return "s"',
+    'return a ? b : c',
+    'return a ? b',
+    'u32 v = (a + b) * c;',
+    'u32 v = +a;',
+    'u32 v = - - a;',
+    'u32 v = (u32)(u8) a;',
+    'u32 v = (a);',
+    'u32 v = a <= b >= c;',
+    'u32 v = a | b ^ c & d;',
+    'u32 v = 1.5;',
+    'u32 v = .5;',
+    'u32 v = 0;',
+    'u32 v = f(x)(y);',
+    'x = a == b',
+    'x = a ? b : c',
+    'x = "s"',
+    'x = match (a) { 1: b }',
+    'return match (a) { 1: b }',
+    'auto x = a;',
+    'static const u32 x = 1;',
+    '[[a, b: 1, c: "s"]] u32 x;',
+    'ptr<const u8, u32> x;',
+    'if (a) { }',
+    'if (a) { f(x) g(y) } else h(z)',
+    'for i in a.b { x = 1 }',
+    'match (x) { 1: { f(y) return a } "s": b c: d default: { return e } }',
+    'match (x) { }',
+    'return a::b',
+    'return a',
+    'return a.f(x).g(y)',
+    'u32 v = a.f(x).g(y);',
+    'u32 v = f(x).g();',
+    'u32 v = f( );',
+    'return f( )',
+    'f( )',
+    'return f(a) + b',
+    'x = f(y) + 1',
+    'return a[1]',
+    'return a[b]',
+    'x = a[f(y)]',
+    'u32 v = a[b = 1];',
+    'return (a)',
+    'return (a.f(x))',
+    'return -a',
+    'return a == b',
+    'return "a" + b',
+    'x = a',
+    'x = a::b',
+    'return a ? f(x) : g(y)',
+    'return f(x) ? a : b',
+    'f(x) ? a : b',
+    'a.b.c = f(x).g',
+    'a::b = 1',
+    'if (f(x)) g(y)',
+    'if (a.f(x) == 1) g(y)',
+    'if (f()) g(y)',
+    'for i in f(x) { g(i) }',
+    'for i in a::b { g(i) }',
+    'switch (a::b) { a::c: d, e: f::g }',
+    'switch (a) { "s": b }',
+    'match (f(x)) { a: b }',
+    'match (a) { 1: a ? b : c }',
+    'return (u32) a',
+    'x = (u32) f(a)',
+    'u32 v = (u32) f(a);',
+    'u32 v = (a.b)(c);',
+    'g(f(x), a.f(x), f())',
+    'u32 v = (a) - b;',
+    'u32 v = (a) + 1;',
+    'u32 v = (a)(b);',
+    'u32 v = (a) b;',
+    'u32 v = (u32) -1;',
+    'u32 v = (u32) (a);',
+    'u32 v = (u32) a.b;',
+    'u32 v = (a) - (b);',
+    'u32 v = (const u8) a;',
+    'u32 v = (ptr<u8>) a;',
+    'u32 v = (ptr<u8>)(b);',
+    'u32 v = (a) "s";',
+    'u32 v = (a) 1 + 2;',
+    'u32 v = (a) - 1 * 2;',
+    'u32 v = (a) * 2;',
+    'u32 v = (auto) a;',
+    'u32 v = (const ptr<u8>) a;',
+    'x = y\nf(x)',
+    'u32 v = a >= b;',
+    'return a.b[c]',
+]
+
+# Complete units.
+unitCorpus = [
+    'module m',
+    'module m use "a", "b"',
+    'module m use "a", match (x) { 1: a }',
+    'module m\ndecorator d(__AST__ s, __AST__ r, __AST__ t) { print(s.key) }',
+    'module m\n[[deterministic]] decorator d(__AST__ s, __AST__ r, __AST__ t) { print(s.key) }',
+    'module m\ninterface I { }',
+    'module m\ninterface I { f(u32 a) -> u32; }',
+    'module m\nnamespace n { f(u32 a); u32 x; struct S { } enum E { A } alias B = u8 namespace m { } interface I { } }',
+    'module m\n[[d: 1]] namespace n { }',
+    'module m\nenum E { A, B, C }',
+    'module m\nstruct S<T, const U> { u32 x; static u32 y; Base; f(u32 a); g(u32 a) { return a } operator [](u32 i) -> u32 { return i } }',
+    'module m\nalias A = const ptr<u8>',
+    'module m\n[[lib:"User32.dll"]]\nMessageBoxA(HANDLE hwnd, LPCSTR text, LPCSTR caption, u32 type) -> i32;',
+    'module m\nconst u32 X = 1 << 3;\n[[d]] static u32 Y;',
+    'module m\nrun( ) { f(x) }',
+    'module m\nrun(u32 a) -> u32 { return a }\n',
+]
+
+def grammarCorpus():
+    result = []
+    for statement in statementCorpus:
+        result.append('module m\nf(u32 a) {\n'+statement+'\n}\n')
+    return result+unitCorpus
+
+def report(name, seconds, count, unit = 'file'):
+    print('%-32s %10.3f ms/%s %10.1f %s/s' % (name, seconds*1000/count, unit, count/seconds, unit))
+
+def benchmarkParse(units = 300):
+    corpus = generateCorpus(units)
+    # Before: every file builds its own parser.
+    start = time.perf_counter()
+    for source in corpus:
+        Lark(gc_parser.gamecode_grammar_lalr, **gc_parser.parserOptions).parse(source)
+    report('parser per file', time.perf_counter()-start, units)
+    # After: the first file builds the parser, all other files reuse it.
+    gc_parser._parser = None
+    start = time.perf_counter()
+    for source in corpus:
+        gc_parser.getParser().parse(source)
+    report('process wide parser', time.perf_counter()-start, units)
+    # Startup of a fresh worker with and without the table cache.
+    start = time.perf_counter()
+    gc_parser.buildParser(cache = False)
+    report('build parser', time.perf_counter()-start, 1, 'build')
+    gc_parser.buildParser()
+    start = time.perf_counter()
+    gc_parser.buildParser()
+    report('load cached parser', time.perf_counter()-start, 1, 'build')
+
+def benchmarkGrammar(repeat = 20):
+    earley = Lark(gc_parser.gamecode_grammar, **gc_parser.earleyParserOptions)
+    lalr = gc_parser.buildParser(cache = False)
+    corpus = grammarCorpus()
+    # Both parsers must build the same AST.
+    mismatches = 0
+    for source in corpus:
+        if TokensToNodes(earley.parse(source)) != TokensToNodes(lalr.parse(source)):
+            print('AST mismatch:\n'+source)
+            mismatches += 1
+    print(str(len(corpus)-mismatches)+'/'+str(len(corpus))+' sources build the same AST')
+    # Throughput on the corpus and on bigger units.
+    for name, sources in (('corpus', corpus), ('units', generateCorpus(20))):
+        tokens = sum(len(list(earley.lex(source))) for source in sources)*repeat
+        for parserName, parser in (('earley', earley), ('lalr', lalr)):
+            start = time.perf_counter()
+            for i in range(repeat):
+                for source in sources:
+                    parser.parse(source)
+            report(parserName+' '+name, time.perf_counter()-start, tokens, 'token')
+    if mismatches > 0:
+        exit(1)
+
+def benchmarkBuild(units = 200):
+    # The units form a tree, every unit uses its parent.
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            files = []
+            for i in range(units):
+                files.append('unit'+str(i)+'.gc')
+                with open(files[-1],'w') as f:
+                    f.write(generateUnit(i, 'unit'+str((i-1)//2) if i > 0 else 'lib'))
+            os.makedirs(gc_build.cacheDirectory, exist_ok=True)
+            def build():
+                manifest = gc_build.Manifest()
+                dirty = manifest.outdated(files)
+                for path in dirty:
+                    with open(path,'r') as f:
+                        gc_parser.parse(f)
+                    manifest.record(path)
+                manifest.save()
+                return len(dirty)
+            gc_parser.getParser()
+            for name, change in (('full build', None), ('no-op build', None), ('touch leaf', files[-1]), ('edit leaf', files[-1]), ('edit root', files[0])):
+                if change != None:
+                    if name.startswith('edit'):
+                        with open(change,'a') as f:
+                            f.write('\n')
+                    else:
+                        os.utime(change)
+                start = time.perf_counter()
+                built = build()
+                report(name+' ('+str(built)+' units)', time.perf_counter()-start, 1, 'build')
+        finally:
+            os.chdir(cwd)
+
+def benchmarkSchedule(units = 200, workers = 0):
+    from multiprocessing import Pool
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            # A tree of units, every tenth unit is ten times bigger.
+            files = []
+            for i in range(units):
+                files.append('unit'+str(i)+'.gc')
+                with open(files[-1],'w') as f:
+                    f.write(generateUnit(i, 'unit'+str((i-1)//2) if i > 0 else 'lib'))
+                    if i % 10 == 0:
+                        for j in range(9):
+                            f.write(generateUnit(i*100+j+1).split('\n',2)[2])
+            os.makedirs(gc_build.cacheDirectory, exist_ok=True)
+            scheduler = gc_build.Scheduler(files, workers or None)
+            with Pool(5) as pool:
+                pool.map(gc_build.compileUnit, files[:5])
+                start = time.perf_counter()
+                pool.map(gc_build.compileUnit, files)
+                report('Pool(5).map', time.perf_counter()-start, units, 'unit')
+            with Pool(scheduler.workers) as pool:
+                pool.map(gc_build.compileUnit, files[:scheduler.workers])
+                start = time.perf_counter()
+                for f, result in scheduler.run(pool, gc_build.compileUnit):
+                    pass
+                report('scheduler ('+str(scheduler.workers)+' workers)', time.perf_counter()-start, units, 'unit')
+            waits = sorted(scheduler.started[f]-scheduler.ready[f] for f in files)
+            busy = sum(scheduler.finished[f]-scheduler.started[f] for f in files)
+            print('queue wait median %.1f ms, max %.1f ms, utilization %.0f%%' % (waits[len(waits)//2]*1000, waits[-1]*1000, busy*100/((scheduler.end-scheduler.start)*scheduler.workers)))
+        finally:
+            os.chdir(cwd)
+
+def benchmarkAstCache(units = 200):
+    corpus = generateCorpus(units)
+    parser = gc_parser.getParser()
+    hashes = [gc_ast_cache.sourceDigest(source) for source in corpus]
+    # Every stage starts from the source, the cached version starts from the cache of the stage.
+    def nodes(source):
+        return TokensToNodes(parser.parse(source))
+    def decorated(source):
+        ast = nodes(source)
+        PrepareProcessing().visit_top_down(ast)
+        Decorate(ast).visit(ast)
+        return ast
+    def optimized(source):
+        return PostProcessor().transform(decorated(source))
+    for name, stage, build in (('nodes', gc_ast_cache.NODES, nodes), ('decorated', gc_ast_cache.DECORATED, decorated), ('optimized', gc_ast_cache.OPTIMIZED, optimized)):
+        start = time.perf_counter()
+        asts = [build(source) for source in corpus]
+        built = time.perf_counter()-start
+        start = time.perf_counter()
+        caches = [gc_ast_cache.dumps(ast, stage, h) for ast, h in zip(asts, hashes)]
+        stored = time.perf_counter()-start
+        start = time.perf_counter()
+        loaded = [gc_ast_cache.loads(cache, h)[0] for cache, h in zip(caches, hashes)]
+        load = time.perf_counter()-start
+        if loaded != asts:
+            print('AST cache mismatch in stage '+name)
+            exit(1)
+        report(name+' from source', built, units, 'unit')
+        report(name+' store', stored, units, 'unit')
+        report(name+' load', load, units, 'unit')
+        print('%-32s %10.1fx, %d bytes/unit' % (name+' speedup', built/load, sum(len(c) for c in caches)/units))
+
+def copyNodes(node, classes, parent = None):
+    # Copies the AST into the given classes and attaches _parent and _value like the passes do.
+    if isinstance(node, list):
+        return [copyNodes(e, classes, parent) for e in node]
+    if not isinstance(node, gc_parser_nodes.AstNode):
+        return node
+    cls = classes[node.__class__]
+    result = cls(*[None]*len(dataclasses.fields(cls)))
+    for f in dataclasses.fields(cls):
+        setattr(result, f.name, copyNodes(getattr(node, f.name), classes, result))
+    result._parent = parent
+    result._value = None
+    return result
+
+def measureUnit(source):
+    import resource
+    import gc_parser_decorator
+    gc_parser.getParser()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ast = TokensToNodes(gc_parser.getParser().parse(source))
+    gc_parser_decorator.PrepareProcessing().visit_top_down(ast)
+    PostProcessor().transform(ast)
+    return baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def benchmarkMemory(units = 50):
+    import tracemalloc
+    source = generateUnit(0)+''.join(generateUnit(i).split('\n',2)[2] for i in range(1, units))
+    ast = TokensToNodes(gc_parser.getParser().parse(source))
+    # The classes without __slots__, like the nodes were before.
+    slotted = {}
+    plain = {}
+    for name, cls in inspect.getmembers(gc_parser_nodes, inspect.isclass):
+        if issubclass(cls, gc_parser_nodes.AstNode) and cls != gc_parser_nodes.AstNode:
+            slotted[cls] = cls
+            plain[cls] = dataclasses.dataclass(type(name, (), {'__annotations__': dict(cls.__annotations__)}))
+    nodes = []
+    def collect(node):
+        if isinstance(node, list):
+            for e in node:
+                collect(e)
+        elif isinstance(node, gc_parser_nodes.AstNode):
+            nodes.append(node)
+            for f in dataclasses.fields(node):
+                collect(getattr(node, f.name))
+    collect(ast)
+    for name, classes in (('__dict__ nodes', plain), ('__slots__ nodes', slotted)):
+        tracemalloc.start()
+        copy = copyNodes(ast, classes)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        example = copyNodes(nodes[0], classes)
+        objectSize = sys.getsizeof(example)+(sys.getsizeof(example.__dict__) if hasattr(example, '__dict__') else 0)
+        print('%-32s %10.1f bytes/node (AST), %d bytes/node (object), %d nodes' % (name, size/len(nodes), objectSize, len(nodes)))
+        del copy
+    try:
+        import resource
+    except ImportError:
+        print('peak RSS needs the resource module')
+        return
+    from multiprocessing import Pool
+    for count in (1, units//4, units):
+        unit = generateUnit(0)+''.join(generateUnit(i).split('\n',2)[2] for i in range(1, count))
+        with Pool(1) as pool:
+            baseline, peak = pool.apply(measureUnit, (unit,))
+        print('%-32s %10d KB peak RSS %10d KB above the idle worker' % (str(count)+' unit(s) of source', peak, peak-baseline))
+
+class RecursiveVisitor:
+    # The visitor before the explicit stack, for comparison.
+    def visit(self, node):
+        if issubclass(node.__class__, gc_parser_nodes.AstNode):
+            members = [a for a in dir(node) if not a.startswith('_') and not callable(getattr(node, a))]
+            for m in members:
+                member = getattr(node, m)
+                if isinstance(member, list):
+                    for e in member:
+                        self.visit(e)
+                else:
+                    self.visit(member)
+            getattr(self, node.__class__.__name__, self.__fallback__)(node)
+        return node
+
+    def transform(self, node):
+        result = node
+        if issubclass(node.__class__, gc_parser_nodes.AstNode):
+            members = [a for a in dir(node) if not a.startswith('_') and not callable(getattr(node, a))]
+            for m in members:
+                member = getattr(node, m)
+                if isinstance(member, list):
+                    for e in member:
+                        e = self.transform(e)
+                else:
+                    setattr(node, m, self.transform(member))
+            result = getattr(self, node.__class__.__name__, self.__fallback__)(node)
+        return result
+
+    def visit_top_down(self, node, parent = None):
+        if issubclass(node.__class__, gc_parser_nodes.AstNode):
+            if getattr(self, node.__class__.__name__, self.__fallback__)(node, parent):
+                members = [a for a in dir(node) if not a.startswith('_') and not callable(getattr(node, a))]
+                for m in members:
+                    member = getattr(node, m)
+                    if isinstance(member, list):
+                        for e in member:
+                            self.visit_top_down(e, node)
+                    else:
+                        self.visit_top_down(member, node)
+        return node
+
+def countingVisitor(base):
+    class CountNodes(base):
+        def __init__(self):
+            self.count = 0
+        def __fallback__(self, node, parent = None):
+            self.count += 1
+            return node
+    return CountNodes
+
+def benchmarkVisitor(units = 50, repeat = 5):
+    ast = TokensToNodes(gc_parser.getParser().parse(generateUnit(0)+''.join(generateUnit(i).split('\n',2)[2] for i in range(1, units))))
+    for engine, base in (('recursive', RecursiveVisitor), ('stack', gc_parser_nodes.NodeVisitor)):
+        for walk in ('visit', 'transform', 'visit_top_down'):
+            visitor = countingVisitor(base)()
+            start = time.perf_counter()
+            for i in range(repeat):
+                getattr(visitor, walk)(ast)
+            report(engine+' '+walk, time.perf_counter()-start, visitor.count, 'node')
+    # A deep expression, 1 + 1 + ... + 1
+    deep = gc_parser_nodes.NumericLiteral(1)
+    for i in range(20000):
+        deep = gc_parser_nodes.BinopExpr(deep, '+', gc_parser_nodes.NumericLiteral(1))
+    for engine, base in (('recursive', RecursiveVisitor), ('stack', gc_parser_nodes.NodeVisitor)):
+        try:
+            visitor = countingVisitor(base)()
+            visitor.visit(deep)
+            print('%-32s %d nodes visited' % (engine+' deep expression', visitor.count))
+        except RecursionError:
+            print('%-32s RecursionError' % (engine+' deep expression'))
+
+def benchmarkPasses(units = 200):
+    import gc_parser_passes
+    from gc_parser_decorator import GenerateIR
+    corpus = generateCorpus(units)
+    parser = gc_parser.getParser()
+    trees = [parser.parse(source) for source in corpus]
+    # Every pass walks the AST on its own, like before the pass manager.
+    separate = gc_parser_passes.PassManager()
+    separate.groups = lambda ast, names: [[name] for name in names]
+    fused = gc_parser_passes.PassManager()
+    names = ['PrepareProcessing', 'Decorate', 'PostProcessor', 'GenerateIR']
+    for name, manager in (('separate walks', separate), ('fused walks', fused)):
+        start = time.perf_counter()
+        for tree in trees:
+            manager.run(TokensToNodes(tree), names)
+        report(name, time.perf_counter()-start, units, 'unit')
+        manager.report()
+    # Both pipelines must generate the same code.
+    for tree in trees[:20]:
+        separate.run(TokensToNodes(tree), names)
+        fused.run(TokensToNodes(tree), names)
+        if separate.visitors['GenerateIR'].IR != fused.visitors['GenerateIR'].IR:
+            print('IR mismatch')
+            exit(1)
+
+decoratorUnit = '''module decorators
+
+decorator addExit(__AST__ sender, __AST__ root, __AST__ target) {
+    if (sender.key == "exit") {
+        print(target.name)
+    } else {
+        print(sender.key)
+    }
+    for e in root.statements {
+        print(e)
+    }
+    print(sender.key)
+}
+'''
+
+def benchmarkDecorators(units = 200):
+    import gc_decorator_registry
+    import gc_parser_decorator
+    from gc_parser_decorator import Decorator, PreProcessor
+    ast = TokensToNodes(gc_parser.getParser().parse(decoratorUnit))
+    tree = ast.statements[0]
+    with tempfile.TemporaryDirectory() as directory:
+        # Every unit which defines the decorator translates and compiles it again, like before the registry.
+        start = time.perf_counter()
+        for i in range(units):
+            preProcessor = PreProcessor()
+            preProcessor.visit(tree)
+        report('translate and compile', time.perf_counter()-start, units, 'unit')
+        registry = gc_decorator_registry.DecoratorRegistry(directory)
+        key = registry.key(tree)
+        registry.store(key, preProcessor.parameter, preProcessor.bytecode)
+        # A fresh worker reads the code object of the registry once.
+        start = time.perf_counter()
+        for i in range(units):
+            gc_decorator_registry.DecoratorRegistry(directory).load(key)
+        report('registry load', time.perf_counter()-start, units, 'unit')
+        start = time.perf_counter()
+        for i in range(units):
+            registry.load(registry.key(tree))
+        report('registry hit with key', time.perf_counter()-start, units, 'unit')
+        gc_parser_decorator.registry = registry
+        start = time.perf_counter()
+        for i in range(units):
+            if Decorator(None, ast, key).generatedCode == None:
+                print('Decorator missing in the registry')
+                exit(1)
+        report('imported decorator', time.perf_counter()-start, units, 'unit')
+
+def expansionUnit(declarations, deterministic, work = 1):
+    source = '''module expansions
+
+{0}decorator addExit(__AST__ sender, __AST__ root, __AST__ target) {{
+    for i in range({1}) {{
+        key = sender.key
+    }}
+    target.statements.append(ASTFactory.FunctionCall("ExitProcess", sender.value))
+}}
+
+[[lib:"Kernel32.dll"]]
+ExitProcess(u32 code);
+'''.format('[[deterministic]]\n' if deterministic else '', work)
+    for i in range(declarations):
+        source += '''
+[[addExit: {0}]]
+show{0}(u32 code) {{
+    ExitProcess(code)
+    ExitProcess({0})
+}}
+'''.format(i)
+    return source
+
+def benchmarkExpansions(declarations = 500, repeat = 3):
+    parser = gc_parser.getParser()
+    # The replay costs about as much as a cheap decorator, it pays off for decorators which do some work.
+    for work in (1, 1000, 10000):
+        print('decorator loop of %d' % work)
+        benchmarkExpansion(parser, declarations, repeat, work)
+
+def benchmarkExpansion(parser, declarations, repeat, work):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            results = {}
+            for name, deterministic in (('exec', False), ('exec and record', True), ('replay', True)):
+                tree = parser.parse(expansionUnit(declarations, deterministic, work))
+                elapsed = 0
+                for i in range(repeat):
+                    ast = TokensToNodes(tree)
+                    PrepareProcessing().visit_top_down(ast)
+                    decorate = Decorate(ast)
+                    if name == 'exec and record' and os.path.exists(decorate.expansions.file):
+                        # Every repetition starts without the expansions of the previous one.
+                        os.remove(decorate.expansions.file)
+                    start = time.perf_counter()
+                    decorate.visit(ast)
+                    elapsed += time.perf_counter()-start
+                    if name == 'replay' and decorate.expansions.misses > 0:
+                        print('Expansion cache miss on replay')
+                        exit(1)
+                results[name] = ast
+                report(name, elapsed, declarations*repeat, 'decoration')
+            if results['replay'].statements[3:] != results['exec'].statements[3:]:
+                print('Replayed expansion differs from the executed one')
+                exit(1)
+        finally:
+            os.chdir(cwd)
+
+def queryUnit(declarations, indexed):
+    # Every decorated function looks up its handler function, by a walk of the unit or by the index.
+    if indexed:
+        lookup = '''    for handler in ASTQuery.byName(target.name+"Handler", "FunctionDefinition") {
+        target.statements.append(ASTFactory.FunctionCall(handler.name, ASTFactory.Var("code")))
+    }'''
+    else:
+        lookup = '''    for handler in root.statements {
+        if (getattr(handler, "name", None) == target.name+"Handler") {
+            target.statements.append(ASTFactory.FunctionCall(handler.name, ASTFactory.Var("code")))
+        }
+    }'''
+    source = '''module query
+
+decorator register(__AST__ sender, __AST__ root, __AST__ target) {
+'''+lookup+'''
+}
+
+[[lib:"Kernel32.dll"]]
+ExitProcess(u32 code);
+'''
+    for i in range(declarations):
+        source += '''
+show{0}Handler(u32 code) {{
+    ExitProcess(code)
+}}
+
+[[register]]
+show{0}(u32 code) {{
+    ExitProcess(code)
+}}
+'''.format(i)
+    return source
+
+def benchmarkQuery(repeat = 3):
+    parser = gc_parser.getParser()
+    # The walk of the unit makes the decorators quadratic, the index costs a walk of the unit and an update per decoration.
+    for declarations in (100, 500, 2000):
+        results = {}
+        for name, indexed in (('walk', False), ('index', True)):
+            tree = parser.parse(queryUnit(declarations, indexed))
+            elapsed = 0
+            for i in range(repeat):
+                ast = TokensToNodes(tree)
+                start = time.perf_counter()
+                prepare = PrepareProcessing(AstIndex(ast) if indexed else None)
+                prepare.visit_top_down(ast)
+                Decorate(ast, prepare.index).visit(ast)
+                elapsed += time.perf_counter()-start
+            results[name] = ast
+            report('%-5s %4d declarations' % (name, declarations), elapsed, declarations*repeat, 'decoration')
+        if results['walk'].statements[2:] != results['index'].statements[2:]:
+            print('Indexed lookup differs from the walk')
+            exit(1)
+
+class StringPreProcessor(gc_parser_nodes.NodeVisitor):
+    # The decorator translation into python source before the python ast, for comparison.
+    def __init__(self):
+        self.bytecode = None
+
+    def lines(self, statements):
+        res = ""
+        for e in statements:
+            for l in e._value.split("\n"):
+                res += "  "+l+"\n"
+        return res
+
+    def StringLiteral(self, node):
+        node._value = "\""+node.value+"\""
+
+    def NumericLiteral(self, node):
+        node._value = str(node.value)
+
+    def AstDecorator(self, node):
+        code = ""
+        for e in node.statements:
+            code += e._value+"\n"
+        self.bytecode = compile(code, filename="", mode="exec")
+
+    def FuncCall(self, node):
+        args = ",".join(e._value for e in node.arguments or [])
+        name = node.name._value if isinstance(node.name, gc_parser_nodes.Var) else node.name
+        node._value = name+"("+args+")"
+
+    def Var(self, node):
+        node._value = ".".join(e if isinstance(e, str) else e._value for e in node.members)
+
+    def BinopExpr(self, node):
+        node._value = node.left._value+" "+node.operation+" "+node.right._value
+
+    def ForStmt(self, node):
+        node._value = "for "+node.entry+" in "+node.iterable._value+":\n"+self.lines([node.do])
+
+    def IfStmt(self, node):
+        res = "if "+node.condition._value+":\n"+self.lines(node.then_)
+        if isinstance(node.else_, list):
+            res += "else:\n"+self.lines(node.else_)
+        node._value = res
+
+def decoratorSource(statements, depth):
+    # statements groups of statements, the if statements are nested depth times.
+    body = ''
+    for i in range(statements):
+        body += '''    key = sender.key
+    if (key == "{0}") {{ print(target.name) }} else {{ print(key) }}
+    for e in root.statements {{ print(e) }}
+'''.format(i)
+    for i in range(depth):
+        body = '    if (sender.key == "{0}") {{\n{1}    }}\n'.format(i, body)
+    return 'module m\ndecorator d(__AST__ sender, __AST__ root, __AST__ target) {\n'+body+'}\n'
+
+def benchmarkTranslate(repeat = 5):
+    from gc_parser_decorator import PreProcessor
+    parser = gc_parser.getParser()
+    for statements, depth in ((10, 0), (100, 0), (1000, 0), (10, 10), (10, 50), (100, 50)):
+        tree = TokensToNodes(parser.parse(decoratorSource(statements, depth))).statements[0]
+        for name, translator in (('source', StringPreProcessor), ('python ast', PreProcessor)):
+            start = time.perf_counter()
+            for i in range(repeat):
+                translator().visit(tree)
+            report('%-10s %4d statements depth %2d' % (name, statements*3+depth, depth), time.perf_counter()-start, repeat, 'decorator')
+
+class NumpyIRModule(nilang_ir.IRModule):
+    # The module reader before the struct based one, every field is a numpy array, for comparison.
+    def number(self, data, dtype):
+        value = np.frombuffer(data, dtype, 1, self.offset)[0]
+        self.offset += value.nbytes
+        return value
+
+    def name(self, data):
+        length = self.number(data, np.uint8)
+        text = np.frombuffer(data, np.uint8, length, self.offset)
+        self.offset += length
+        return str(text, 'ascii')
+
+    def read(self, bytes):
+        if np.frombuffer(bytes, np.uint32, 1, 0) != nilang_ir.MAGIC:
+            return
+        self.version = 1
+        offset = 4
+        while offset < len(bytes):
+            id, size = np.frombuffer(bytes, np.uint16, 2, offset)
+            data = np.frombuffer(bytes, np.uint8, size, offset+4)
+            offset += size+4
+            self.offset = 0
+            if id == 1:
+                self.code = data
+            elif id == 0:
+                lib = self.name(data)
+                self.imports.setdefault(lib, [])
+                while self.offset < size:
+                    self.imports[lib].append(self.name(data))
+            elif id == 2:
+                while self.offset < size:
+                    typeID = self.number(data, np.uint8)
+                    name = self.name(data)
+                    value = None
+                    if typeID == 20:
+                        value = self.name(data)
+                    if typeID == 9:
+                        value = self.number(data, np.int32)
+                    if typeID == 2:
+                        value = self.number(data, np.uint32)
+                    if typeID == 22:
+                        self.number(data, np.uint8)
+                        value = self.number(data, np.uint64)
+                    self.constants[name] = {'type':typeID, 'value':value}
+            elif id == 3:
+                while self.offset < size:
+                    name = self.name(data)
+                    typeId = self.number(data, np.uint16)
+                    typeID = self.number(data, np.uint16)
+                    isConst = self.number(data, np.uint8) != 0
+                    tp = []
+                    for i in range(self.number(data, np.uint8)):
+                        isTConst = self.number(data, np.uint8) != 0
+                        tp.append(nilang_ir.TP(isTConst, self.number(data, np.uint16)))
+                    self.types[name] = {'id':typeId, 'isConstant':isConst, 'typeID':typeID, 'templateParameter':tp}
+            elif id in (4, 5, 6, 7):
+                self.number(data, np.uint8)
+                while self.offset < size:
+                    name = self.name(data)
+                    if id == 4:
+                        self.dependencies[name] = {}
+                    elif id == 5:
+                        self.functions[name] = self.number(data, np.uint16)
+                    elif id == 7:
+                        self.unresolvedTypes[name] = {'id':self.number(data, np.uint16)}
+                    else:
+                        typeId, variableCount, composeCount = [self.number(data, np.uint16) for i in range(3)]
+                        self.number(data, np.uint8)
+                        variables = []
+                        compose = []
+                        for i in range(variableCount):
+                            order = self.number(data, np.uint16)
+                            mname = self.name(data)
+                            static = self.number(data, np.uint8) != 0
+                            variables.append({'order':order, 'name':mname, 'static':static, 'typeid':self.number(data, np.uint16), 'decoration':[]})
+                        for i in range(composeCount):
+                            order = self.number(data, np.uint16)
+                            compose.append({'order':order, 'name':self.name(data)})
+                        self.structs[name] = {'id':typeId, 'templateParameter':[], 'variables':variables, 'compose':compose}
+
+class V1IRModule(nilang_ir.IRModule):
+    # The version 1 module writer with the field sizes of windows, the reader still accepts it.
+    def name(self, name):
+        return struct.pack('B', len(name))+name.encode()
+
+    # The jumps of the first compiler have a one byte label, the VM looked it up.
+    def emitLabel(self, label):
+        self.code += struct.pack('BB', nilang_ir.legacyLabel, label)
+
+    def emitJump(self, opcode, label, *parameter):
+        legacy = {target: opcode for opcode, target in nilang_ir.legacyJumps.items()}[int(opcode)]
+        self.code += struct.pack('BB', legacy, label)+bytes(parameter)
+
+    def finishFunction(self):
+        pass
+
+    def generate(self):
+        segments = [(4, self.generateDependencySegment())]
+        segments += [(0, self.generateImportSegment(lib)) for lib in self.imports]
+        segments += [(3, self.generateTypeSegment()), (6, self.generateStructSegment()), (7, self.generateUnresolvedTypes()),
+                     (2, self.generateConstantSegment()), (5, self.generateFunctionSegment()), (1, bytes(self.code))]
+        result = bytearray(struct.pack('=I', nilang_ir.MAGIC))
+        for id, data in segments:
+            result += struct.pack('=HH', id, len(data))+data
+        return result
+
+    def generateStructSegment(self):
+        result = bytearray(struct.pack('B', len(self.structs) & 0xFF))
+        for name, struct_ in self.structs.items():
+            result += self.name(name)+struct.pack('=HHHB', struct_['id'], len(struct_['variables']), len(struct_['compose']), len(struct_['templateParameter']))
+            for m in struct_['variables']:
+                result += struct.pack('=H', m['order'])+self.name(m['name'])+struct.pack('=BH', m['static'], m['typeid'])
+            for m in struct_['compose']:
+                result += struct.pack('=H', m['order'])+self.name(m['name'])
+        return result
+
+    def generateUnresolvedTypes(self):
+        result = bytearray(struct.pack('B', len(self.unresolvedTypes) & 0xFF))
+        for name, entry in self.unresolvedTypes.items():
+            result += self.name(name)+struct.pack('=H', entry['id'])
+        return result
+
+    def generateFunctionSegment(self):
+        result = bytearray(struct.pack('B', len(self.functions) & 0xFF))
+        for name, label in self.functions.items():
+            result += self.name(name)+struct.pack('=H', label)
+        return result
+
+    def generateDependencySegment(self):
+        result = bytearray(struct.pack('B', len(self.dependencies) & 0xFF))
+        for name in self.dependencies:
+            result += self.name(name)
+        return result
+
+    def generateTypeSegment(self):
+        result = bytearray()
+        for name, type_ in self.types.items():
+            if type_['id'] >= nilang_ir.FirstDynamicTypeID:
+                result += self.name(name)+struct.pack('=HHBB', type_['id'], type_['typeID'], type_['isConstant'], len(type_['templateParameter']))
+                for tp in type_['templateParameter']:
+                    result += struct.pack('=BH', tp['isConstant'], tp['typeID'])
+        return result
+
+    def generateConstantSegment(self):
+        result = bytearray()
+        for name, constant in self.constants.items():
+            typeID = self.resolveTypeID(constant['type'])
+            result += struct.pack('B', typeID)+self.name(name)
+            if typeID == 22:
+                result += struct.pack('=BQ', 8, constant['value'])
+            elif typeID in (2, 9):
+                result += struct.pack('=i' if typeID == 9 else '=I', constant['value'])
+            elif typeID == 20:
+                result += self.name(constant['value'])
+        return result
+
+    def generateImportSegment(self, library):
+        return self.name(library)+b''.join(self.name(f) for f in self.imports[library])
+
+def loadModule(count, version = nilang_ir.VERSION):
+    # A module with count imports, types, constants and functions, count/4 structs and 256 labels.
+    module = V1IRModule() if version == 1 else nilang_ir.IRModule()
+    for i in range(count):
+        module.addImport('Kernel32.dll', 'Function%d' % i)
+        module.addType('Type%d' % i, i % 2 == 0, nilang_ir.types['ptr'], [nilang_ir.TP(True, nilang_ir.types['u8'])])
+        if i % 2 == 0:
+            module.addConstant('Const%d' % i, nilang_ir.types['strlit'], 'value%d' % i)
+        else:
+            module.addConstant('Const%d' % i, nilang_ir.types['ptr'], i)
+        module.addFunction('function%d' % i, i % 256)
+        if i % 4 == 0:
+            variables = [{'order':j, 'name':'member%d' % j, 'decoration':[], 'static':False, 'typeid':nilang_ir.types['u32']} for j in range(4)]
+            module.addStruct('Struct%d' % i, [], variables, [{'order':4, 'name':'Type%d' % i}])
+    for i in range(256):
+        module.emitLabel(i)
+        module.emit(nilang_ir.bc['PushOne'])
+        module.emitJump(nilang_ir.bc['JumpIf'], i)
+        module.emitJump(nilang_ir.bc['Invoke'], i, 0)
+        module.emit(nilang_ir.bc['Return'])
+        module.finishFunction()
+    return bytes(module.generate())
+
+def sameModule(a, b):
+    fields = ('imports', 'types', 'constants', 'functions', 'structs', 'dependencies', 'unresolvedTypes')
+    return all(getattr(a, f) == getattr(b, f) for f in fields) and bytes(a.code) == bytes(b.code)
+
+def benchmarkLoad(repeat = 10):
+    import nilang_interpreter
+    # Version 1 has 16 bit segment sizes, 2000 declarations are close to the limit.
+    for count in (500, 1000, 2000):
+        data = {1: loadModule(count, 1), 4: loadModule(count, 4)}
+        print('%d declarations, version 1 %d bytes, version 4 %d bytes' % (count, len(data[1]), len(data[4])))
+        readers = {}
+        times = {}
+        # Best of repeat, a module loads in a few milliseconds.
+        # read decodes all segments, AddMainModule the ones of the main module.
+        for name, reader, version in (('numpy v1', NumpyIRModule, 1), ('struct v1', nilang_ir.IRModule, 1), ('struct v4', nilang_ir.IRModule, 4)):
+            best = None
+            for i in range(repeat):
+                start = time.perf_counter()
+                readers[name] = reader()
+                readers[name].read(data[version])
+                readers[name].decodeAll()
+                elapsed = time.perf_counter()-start
+                best = elapsed if best == None else min(best, elapsed)
+            report('  read %s' % name, best, 1, 'module')
+            nilang_interpreter.IRModule = reader
+            best = None
+            for i in range(repeat):
+                start = time.perf_counter()
+                nilang_interpreter.VM().AddMainModule(data[version])
+                elapsed = time.perf_counter()-start
+                best = elapsed if best == None else min(best, elapsed)
+            times[name] = best
+            report('  AddMainModule %s' % name, best, 1, 'module')
+        nilang_interpreter.IRModule = nilang_ir.IRModule
+        print('  AddMainModule %.1fx faster (v1), %.1fx faster (v4)' % (times['numpy v1']/times['struct v1'], times['numpy v1']/times['struct v4']))
+        if not sameModule(readers['numpy v1'], readers['struct v1']):
+            print('The readers decode different modules')
+            exit(1)
+        # The code of version 1 has the jumps of the first compiler.
+        readers['struct v1'].translateCode()
+        if not sameModule(readers['struct v1'], readers['struct v4']):
+            print('The readers decode different modules')
+            exit(1)
+
+def benchmarkScaling(functions = 100000, megabytes = 8):
+    # Beyond the limits of version 1: more than 255 functions and 64 KiB of code.
+    module = nilang_ir.IRModule()
+    for i in range(functions):
+        module.addFunction('function%d' % i, i)
+    module.addConstant('text', nilang_ir.types['strlit'], 'x'*300)
+    module.addConstant('large', nilang_ir.types['u32'], 0xFFFFFFFF)
+    module.addConstant('negative', nilang_ir.types['i32'], -1)
+    pattern = bytes([nilang_ir.bc['PushOne'], nilang_ir.bc['PushU16'], 1, 2, nilang_ir.bc['Pop'], nilang_ir.bc['PushU32'], 1, 2, 3, 4, nilang_ir.bc['Pop']])
+    module.code = bytearray(pattern*(megabytes*1024*1024//len(pattern)))
+    start = time.perf_counter()
+    data = bytes(module.generate())
+    report('write %d functions, %d bytes of code' % (functions, len(module.code)), time.perf_counter()-start, 1, 'module')
+    start = time.perf_counter()
+    reader = nilang_ir.IRModule()
+    reader.read(data)
+    reader.decodeAll()
+    report('read %d bytes' % len(data), time.perf_counter()-start, 1, 'module')
+    if not sameModule(module, reader):
+        print('The module differs after reading it')
+        exit(1)
+    start = time.perf_counter()
+    nilang_ir.IRModule().readDependencies(data)
+    report('read the dependencies', time.perf_counter()-start, 1, 'module')
+    print('%d functions and %d bytes of code read back' % (len(reader.functions), len(reader.code)))
+
+class EagerIRModule(nilang_ir.IRModule):
+    # Decodes every segment in read, like before the lazy segments.
+    def read(self, bytes):
+        super().read(bytes)
+        self.decodeAll()
+
+def benchmarkStartup(libraries = 24, declarations = 1000, repeat = 5):
+    # A main module which uses libraries large modules, the VM only needs the dependencies of a library to load it.
+    import nilang_interpreter
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            os.makedirs('gc_cache')
+            library = loadModule(declarations)
+            for i in range(libraries):
+                with open('gc_cache/library%d.gc.nimo' % i, 'wb') as f:
+                    f.write(library)
+            main = nilang_ir.IRModule()
+            for i in range(libraries):
+                main.addDependency('library%d' % i)
+            main.addUnresolvedType('Struct0')
+            main.emitLabel(0)
+            main.emit(nilang_ir.bc['Return'])
+            main.addFunction('run', 0)
+            data = bytes(main.generate())
+            for name, reader in (('eager', EagerIRModule), ('lazy', nilang_ir.IRModule)):
+                nilang_interpreter.IRModule = reader
+                best = None
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    vm = nilang_interpreter.VM()
+                    vm.AddMainModule(data)
+                    elapsed = time.perf_counter()-start
+                    best = elapsed if best == None else min(best, elapsed)
+                report('%-5s %d libraries of %d bytes' % (name, libraries, len(library)), best, 1, 'startup')
+                if len(vm.resolvedTypes) != 1:
+                    print('Unresolved type not found in the libraries')
+                    exit(1)
+            nilang_interpreter.IRModule = nilang_ir.IRModule
+        finally:
+            os.chdir(cwd)
+
+def runSharedVM(mode, directory, ready, done):
+    import nilang_interpreter
+    os.chdir(directory)
+    vm = nilang_interpreter.VM()
+    if mode == 'read':
+        vm.AddMainModule(open('gc_cache/main.gc.nimo','rb').read())
+    else:
+        vm.LoadMainModule('gc_cache/main.gc.nimo')
+    ready.set()
+    done.wait()
+
+def processMemory(pid):
+    # Proportional set size in KB, shared pages count divided by the processes which map them.
+    result = {}
+    with open('/proc/%d/smaps_rollup' % pid) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == 'kB':
+                result[fields[0][:-1]] = int(fields[1])
+    return result
+
+def benchmarkShared(processes = 4, libraries = 8, megabytes = 2):
+    # RSS growth for every extra VM process which runs the same modules.
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        print('the shared benchmark needs /proc/<pid>/smaps_rollup')
+        return
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(directory+'/gc_cache')
+        library = loadModule(1000)
+        main = nilang_ir.IRModule()
+        for i in range(libraries):
+            with open(directory+'/gc_cache/library%d.gc.nimo' % i, 'wb') as f:
+                f.write(library)
+            main.addDependency('library%d' % i)
+        main.code = bytearray([nilang_ir.bc['Nop']]*(megabytes*1024*1024))
+        main.emitLabel(0)
+        main.emit(nilang_ir.bc['Return'])
+        main.addFunction('run', 0)
+        with open(directory+'/gc_cache/main.gc.nimo', 'wb') as f:
+            f.write(main.generate())
+        print('main module %d KB, %d libraries of %d KB' % (len(main.code)//1024, libraries, len(library)//1024))
+        growth = {}
+        for mode in ('read', 'mmap'):
+            total = {}
+            for count in (1, processes):
+                done = context.Event()
+                workers = []
+                for i in range(count):
+                    ready = context.Event()
+                    worker = context.Process(target=runSharedVM, args=(mode, directory, ready, done))
+                    worker.start()
+                    ready.wait()
+                    workers.append(worker)
+                memory = [processMemory(worker.pid) for worker in workers]
+                done.set()
+                for worker in workers:
+                    worker.join()
+                total[count] = sum(m['Pss'] for m in memory)
+                print('%-4s %d VM(s) %10d KB PSS %10d KB private %10d KB shared per VM' % (mode, count, total[count],
+                    sum(m['Private_Clean']+m['Private_Dirty'] for m in memory)//count, sum(m['Shared_Clean']+m['Shared_Dirty'] for m in memory)//count))
+            growth[mode] = (total[processes]-total[1])/(processes-1)
+            print('%-4s %10.0f KB per extra VM' % (mode, growth[mode]))
+        if growth['mmap'] >= growth['read']:
+            print('Mapped modules aren\'t shared between the VMs')
+            exit(1)
+
+def rewriteSource(calls):
+    return 'module unit\n[[lib:"Kernel32.dll"]]\nExitProcess(i32 code);\nrun( ) {\n'+'    ExitProcess(%d)\n'*calls % tuple(range(calls))+'}\n'
+
+def runMappedVM(directory, ready, done):
+    # Reads the code of the mapped module after the unit was compiled again.
+    import nilang_interpreter
+    os.chdir(directory)
+    vm = nilang_interpreter.VM()
+    vm.LoadMainModule('gc_cache/unit.gc.nimo')
+    size = len(vm.irCode)
+    ready.set()
+    done.wait()
+    if sum(vm.irCode) == 0 or len(vm.irCode) != size:
+        exit(1)
+
+def benchmarkRewrite(calls = 4000):
+    # A build replaces the module a VM has mapped, a module written in place
+    # would be truncated under the mapping and the VM would die of SIGBUS.
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            os.makedirs('gc_cache')
+            with open('unit.gc', 'w') as f:
+                f.write(rewriteSource(calls))
+            if not gc_parser.parse(open('unit.gc')):
+                exit(1)
+            size = os.path.getsize('gc_cache/unit.gc.nimo')
+            ready = context.Event()
+            done = context.Event()
+            worker = context.Process(target=runMappedVM, args=(directory, ready, done))
+            worker.start()
+            ready.wait()
+            with open('unit.gc', 'w') as f:
+                f.write(rewriteSource(10))
+            start = time.perf_counter()
+            if not gc_parser.parse(open('unit.gc')):
+                exit(1)
+            report('compile while mapped', time.perf_counter()-start, 1, 'unit')
+            rebuilt = os.path.getsize('gc_cache/unit.gc.nimo')
+            done.set()
+            worker.join()
+        finally:
+            os.chdir(cwd)
+    print('module of %d bytes replaced by %d bytes, the VM exited with %d' % (size, rebuilt, worker.exitcode))
+    if worker.exitcode != 0:
+        print('The VM didn\'t survive the rebuild of its module')
+        exit(1)
+
+class LinearIRModule(nilang_ir.IRModule):
+    # The lookups scanned the tables before they were indexed.
+    def addImport(self, library, function):
+        if not library in self.imports.keys():
+            self.imports[library] = []
+        self.imports[library].append(function)
+
+    def addType(self, name, isConst, typeId, templateParameter):
+        id = 0
+        if not name in self.types.keys():
+            id = self.nextDynamicTypeID
+            self.nextDynamicTypeID+=1
+            self.types[name] = {
+                'id': id,
+                'isConstant': isConst,
+                'typeID': typeId,
+                'templateParameter':templateParameter
+            }
+        else:
+            id = self.types[name]['id']
+        return id
+
+    def addConstant(self, name, type, value):
+        if not name in self.constants.keys():
+            self.constants[name] = {'type':type,'value':value}
+        index = list(self.constants.keys()).index(name)
+        return index
+
+    def resolveTypeID(self,id):
+        if id >= nilang_ir.FirstDynamicTypeID:
+            for t in self.types:
+                if self.types[t]['id'] == id:
+                    result = self.resolveTypeID(self.types[t]['typeID'])
+                    break
+        else:
+            result = id
+        return result
+
+    def getTypeName(self,id):
+        for t in self.types:
+            if self.types[t]['id'] == id:
+                return t
+
+    def isImportFunction(self,name):
+        for lib in self.imports.values():
+            if name in lib:
+                return True
+        return False
+
+    def getImportFunctionIndex(self,name):
+        result = 0
+        for lib in self.imports.values():
+            for f in lib:
+                if name == f:
+                    return result
+                result += 1
+        return None
+
+    def getConstIndex(self,value):
+        result = 0
+        for const in self.constants.values():
+            if const['value'] == value:
+                return result
+            result += 1
+        return None
+
+    def getConstnameIndex(self,name):
+        result = 0
+        for const in self.constants.keys():
+            if const == name:
+                return result
+            result += 1
+        return None
+
+def emitSymbols(module, count):
+    # Every symbol is declared and referenced like the code generator does it.
+    u32 = nilang_ir.types['u32']
+    for i in range(count):
+        module.addImport('library%d' % (i//1000), 'function%d' % i)
+        typeID = module.addType('type%d' % i, False, u32, [])
+        module.addConstant('constant%d' % i, typeID, i+1000000)
+        name = 'function%d' % (i//2)
+        if module.isImportFunction(name):
+            module.emit(nilang_ir.bc['PushU8'], module.getImportFunctionIndex(name) & 0xFF)
+        module.emit(nilang_ir.bc['PushU8'], module.getConstnameIndex('constant%d' % (i//2)) & 0xFF)
+        module.emit(nilang_ir.bc['PushU8'], module.getConstIndex(i//2+1000000) & 0xFF)
+        module.emit(nilang_ir.bc['Init'], module.resolveTypeID(typeID))
+        module.getTypeName(typeID)
+    return module
+
+def benchmarkSymbols(largest = 100000):
+    # Emission time per symbol stays flat with the indexes, the scans grow with the module.
+    for count in (1000, 2000, 4000):
+        start = time.perf_counter()
+        linear = emitSymbols(LinearIRModule(), count)
+        report('scans   %6d symbols' % count, time.perf_counter()-start, count, 'symbol')
+        start = time.perf_counter()
+        indexed = emitSymbols(nilang_ir.IRModule(), count)
+        report('indexes %6d symbols' % count, time.perf_counter()-start, count, 'symbol')
+        if linear.generate() != indexed.generate():
+            print('The indexed module differs')
+            exit(1)
+    count = 10000
+    while count <= largest:
+        start = time.perf_counter()
+        emitSymbols(nilang_ir.IRModule(), count)
+        report('indexes %6d symbols' % count, time.perf_counter()-start, count, 'symbol')
+        count *= 10
+
+def literalUnit(index, messages = 20):
+    # A unit which shows messages, some of them are in every unit.
+    calls = ''.join('    show("%s")\n' % ('Error %d' % (i % 5) if i % 2 == 0 else 'unit%d message %d' % (index, i)) for i in range(messages))
+    return '''module literals{0}
+
+alias LPCSTR = ptr<const u8>
+alias HANDLE = ptr<void>
+
+[[lib:"User32.dll"]]
+MessageBoxA(HANDLE hwnd, LPCSTR text, LPCSTR caption, u32 type) -> i32;
+
+const ptr HWND_DESKTOP = 0;
+const ptr NULL = 0;
+const u32 MB_OK = 0;
+const u32 MB_APPLMODAL = 0;
+const u32 MB_DEFBUTTON1 = 0;
+
+show(LPCSTR text) {{
+    MessageBoxA(HWND_DESKTOP, text, "Message", MB_OK)
+}}
+
+run( ) {{
+{1}    show("Done")
+}}
+'''.format(index, calls)
+
+def legacyGenerateIR():
+    from gc_parser_decorator import GenerateIR, StringLiteral, Var, NumericLiteral
+    bc = nilang_ir.bc
+    class LegacyGenerateIR(GenerateIR):
+        # String literals were looked up by value only and sCounter advanced on reuse.
+        def __init__(self):
+            super().__init__()
+            self.sCounter = 0
+
+        def FuncCall(self, node):
+            self.debug(node)
+            if node.arguments != None:
+                for arg in node.arguments:
+                    if isinstance(arg, StringLiteral):
+                        constIndex = self.generator.getConstIndex(arg.value)
+                        if constIndex == None:
+                            self.generator.addConstant('__s'+str(self.sCounter),self.generator.types['strlit']['id'],arg.value)
+                        self.sCounter += 1
+            if isinstance(node.name, Var):
+                name = node.name.members[0]
+            else:
+                name = node.name
+            isAnImportFunction = self.generator.isImportFunction(name)
+            index = self.generator.getImportFunctionIndex(name)
+            if isAnImportFunction:
+                self.generator.emit(bc['PushU8'],index)
+                self.generator.emit(bc['ResolveAddrOfImportIndex'])
+            if node.arguments != None:
+                for arg in node.arguments:
+                    if isinstance(arg, Var):
+                        constIndex = self.generator.getConstnameIndex(arg.members[0])
+                        if constIndex != None:
+                            self.generator.emit(bc['PushU8'], constIndex)
+                            self.generator.emit(bc['ResolveAddrOfConstIndex'])
+                        for i,v in enumerate(self.scopeParameter[-1]):
+                            if v == arg.members[0]:
+                                self.generator.emit(bc['Copy'],28-i)
+                                break
+                    elif isinstance(arg, StringLiteral):
+                        constIndex = self.generator.getConstIndex(arg.value)
+                        self.generator.emit(bc['PushU8'], constIndex)
+                        self.generator.emit(bc['ResolveAddrOfConstIndex'])
+                    elif isinstance(arg, NumericLiteral):
+                        if arg.value == 0:
+                            self.generator.emit(bc['PushZero'])
+                        elif arg.value == 1:
+                            self.generator.emit(bc['PushOne'])
+                        elif arg.value < 256:
+                            self.generator.emit(bc['PushU8'],arg.value)
+                        elif arg.value < pow(2,16):
+                            self.generator.emit(bc['PushU16'],arg.value)
+                        elif arg.value < pow(2,32):
+                            self.generator.emit(bc['PushU32'],arg.value)
+                        else:
+                            constIndex = self.generator.getConstIndex(arg.value)
+                            self.generator.emit(bc['PushU8'], constIndex)
+                            self.generator.emit(bc['ResolveAddrOfConstIndex'])
+            argc = 0
+            if node.arguments != None:
+                argc = len(node.arguments)
+            if isAnImportFunction:
+                self.generator.emit(bc['Call'],argc)
+            else:
+                index = self.generator.labels[name]
+                self.generator.emit(bc['Invoke'], index, argc)
+    return LegacyGenerateIR
+
+def legacyResolveAddrOfConstIndex(vm):
+    index = vm.stack.pop()
+    const = list(vm.constants.values())[index]
+    value = vm.convertValue(const['value'],const['type'])
+    vm.stack.append(value)
+
+def benchmarkConstants(units = 50, repeat = 200000):
+    import gc_parser_passes
+    import nilang_interpreter
+    from gc_parser_decorator import GenerateIR
+    parser = gc_parser.getParser()
+    trees = [parser.parse(literalUnit(i)) for i in range(units)]
+    modules = {}
+    for name, generator in (('legacy', legacyGenerateIR()), ('interned', GenerateIR)):
+        gc_parser_passes.GenerateIR = generator
+        manager = gc_parser_passes.PassManager()
+        modules[name] = []
+        for tree in trees:
+            manager.run(TokensToNodes(tree), ['PrepareProcessing', 'Decorate', 'PostProcessor', 'GenerateIR'])
+            module = nilang_ir.IRModule()
+            module.read(manager.visitors['GenerateIR'].IR)
+            modules[name].append(module)
+    gc_parser_passes.GenerateIR = GenerateIR
+    # Equal constants of a module are written once, the others refer to them. Legacy
+    # modules are written like before, every constant with its value.
+    for name, shared in (('legacy', False), ('interned', False), ('interned', True)):
+        size = sum(len(module.generateConstantSegment(shared)) for module in modules[name])
+        count = sum(len(module.constants) for module in modules[name])
+        print('%-8s %d units %8d bytes of constant segments %6d constants%s' % (name, units, size, count, ', equal ones referenced' if shared else ''))
+    # A VM links the constants of the main module and its dependencies into one pool.
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(directory+'/gc_cache')
+        main = nilang_ir.IRModule()
+        for i, module in enumerate(modules['interned']):
+            main.addDependency('literals%d' % i)
+            with open(directory+'/gc_cache/literals%d.gc.nimo' % i, 'wb') as f:
+                f.write(module.generate())
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            vm = nilang_interpreter.VM()
+            vm.AddMainModule(bytes(main.generate()))
+            for name in vm.loadedDeps:
+                vm.ModuleConstants(name)
+        finally:
+            os.chdir(cwd)
+    print('linked   %d units %8d constants in the pool' % (units, len(vm.linkedConstants)))
+    vm.constants = modules['interned'][0].constants
+    vm.constantValues = vm.LinkConstants(vm.constants)
+    last = len(vm.constants)-1
+    for name, resolve in (('legacy', legacyResolveAddrOfConstIndex), ('pooled', nilang_interpreter.VM.ResolveAddrOfConstIndex)):
+        start = time.perf_counter()
+        for i in range(repeat):
+            vm.stack.append(i % last)
+            resolve(vm)
+            vm.stack.pop()
+        report('ResolveAddrOfConstIndex %s' % name, time.perf_counter()-start, repeat, 'load')
+
+def legacyEmit(module, opcode, *parameter):
+    # IRModule.emit before the precompiled Structs.
+    module.code += struct.pack("B",opcode)
+    if opcode >= nilang_ir.FirstSixByteOperation:
+        module.code += struct.pack("<IB",*parameter)
+    elif opcode >= nilang_ir.FirstFiveByteOperation:
+        if len(parameter) == 1:
+            module.code += nilang_ir.u32le.pack(*parameter)
+        else:
+            module.code += struct.pack("BBBB",*parameter)
+    elif opcode >= nilang_ir.FirstThreeByteOperation:
+        if len(parameter) == 1:
+            module.code += nilang_ir.u16le.pack(*parameter)
+        else:
+            module.code += struct.pack("BB",*parameter)
+    elif opcode >= nilang_ir.FirstTwoByteOperation:
+        module.code += struct.pack("B",*parameter)
+
+def assembleFunction(labels, emit, emitAll, emitLabel, emitJump):
+    # A function like GenerateIR emits it: calls with constants, an if and a return.
+    bc = nilang_ir.bc
+    function, else_, end = labels
+    emitLabel(function)
+    for i in range(8):
+        emitAll(((bc['PushU8'], i), (bc['ResolveAddrOfImportIndex'],), (bc['PushU8'], i), (bc['ResolveAddrOfConstIndex'],),
+            (bc['PushU16'], 1000+i), (bc['PushU32'], 100000+i), (bc['Call'], 3)))
+    emit(bc['PushOne'])
+    emit(bc['PushZero'])
+    emit(bc['Equal'])
+    emitJump(bc['JumpIf'], else_)
+    emitJump(bc['Invoke'], function, 0)
+    emitJump(bc['Goto'], end)
+    emitLabel(else_)
+    emit(bc['Init'], 70)
+    emitLabel(end)
+    emit(bc['Return'])
+
+def benchmarkAssemble(functions = 2000, repeat = 5):
+    # 67 operations per function, every function has its own labels in the first 80 functions.
+    count = functions*67
+    distinct = min(functions, 80)
+    labels = [(f % distinct, distinct+(f % distinct)*2, distinct+1+(f % distinct)*2) for f in range(functions)]
+    results = {}
+    for name in ('struct.pack emit', 'precompiled emit', 'assembler'):
+        best = None
+        for r in range(repeat):
+            module = nilang_ir.IRModule()
+            if name == 'struct.pack emit':
+                emit = lambda opcode, *parameter, module = module: legacyEmit(module, opcode, *parameter)
+            else:
+                emit = module.emit
+            def emitAll(operations, emit = emit):
+                for operation in operations:
+                    emit(*operation)
+            def emitLabel(label, emit = emit):
+                emit(nilang_ir.bc['Label'], label)
+            def emitJump(opcode, label, *parameter, emit = emit):
+                # The target is written after the function like finishFunction() does.
+                emit(opcode, 0, *parameter)
+            if name == 'assembler':
+                api = (module.emit, module.emitAll, module.emitLabel, module.emitJump)
+            else:
+                api = (emit, emitAll, emitLabel, emitJump)
+            start = time.perf_counter()
+            for f in range(functions):
+                assembleFunction(labels[f], *api)
+                if name == 'assembler':
+                    module.finishFunction()
+            elapsed = time.perf_counter()-start
+            best = elapsed if best == None else min(best, elapsed)
+        report(name, best, count, 'instruction')
+        results[name] = module
+    for name in ('struct.pack emit', 'precompiled emit'):
+        for offset, target in results['assembler'].relocations.items():
+            nilang_ir.u32le.pack_into(results[name].code, offset+1, target)
+    if bytes(results['assembler'].code) != bytes(results['struct.pack emit'].code) or bytes(results['precompiled emit'].code) != bytes(results['assembler'].code):
+        print('The assembled code differs')
+        exit(1)
+    # The relocations are the targets a scan finds in the operands of the jumps.
+    module = nilang_ir.IRModule()
+    for f in range(distinct):
+        assembleFunction(labels[f], module.emit, module.emitAll, module.emitLabel, module.emitJump)
+        module.finishFunction()
+    scanned = nilang_ir.IRModule()
+    scanned.code = module.code
+    scanned.scanLabels()
+    if scanned.relocations != module.relocations or scanned.labelOffsets != module.labelOffsets or len(module.fixups) != 0:
+        print('The relocations differ from the scanned code')
+        exit(1)
+
+class ScanningIRModule(nilang_ir.IRModule):
+    # Ignores the relocations like a module of an older compiler.
+    def read(self, bytes):
+        super().read(bytes)
+        self.directory = [(id, segment) for id, segment in self.directory if id != 8 and id != 9]
+        self.pending.pop('relocations', None)
+        self.pending.pop('labelOffsets', None)
+
+def benchmarkRelocations(megabytes = 8, repeat = 3):
+    import nilang_interpreter
+    bc = nilang_ir.bc
+    module = nilang_ir.IRModule()
+    functions = 80
+    blocks = megabytes*1024*1024//16//functions
+    for f in range(functions):
+        module.addFunction('function%d' % f, f)
+        module.emitLabel(f)
+        for i in range(blocks):
+            module.emitAll(((bc['PushU8'], 1), (bc['ResolveAddrOfImportIndex'],), (bc['PushU8'], 2), (bc['ResolveAddrOfConstIndex'],),
+                (bc['PushU16'], 1000), (bc['PushU32'], 100000), (bc['Call'], 3)))
+            if i % 4 == 0:
+                module.emitJump(bc['JumpIf'], 80+f)
+            elif i % 4 == 2:
+                module.emitJump(bc['Invoke'], (f+1) % functions, 0)
+        module.emitLabel(80+f)
+        module.emit(bc['Return'])
+        module.finishFunction()
+    data = bytes(module.generate())
+    print('%d bytes of code, %d jumps, %d bytes of relocations' % (len(module.code), len(module.relocations), len(module.generateRelocationSegment())))
+    vms = {}
+    for name, reader in (('scan', ScanningIRModule), ('relocations', nilang_ir.IRModule)):
+        nilang_interpreter.IRModule = reader
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            vm = nilang_interpreter.VM()
+            vm.AddMainModule(data)
+            elapsed = time.perf_counter()-start
+            best = elapsed if best == None else min(best, elapsed)
+        report('AddMainModule %s' % name, best, 1, 'module')
+        vms[name] = vm
+    nilang_interpreter.IRModule = nilang_ir.IRModule
+    if vms['scan'].functions != vms['relocations'].functions:
+        print('The label segment differs from the scanned labels')
+        exit(1)
+    # Taken jumps, the VM looks the target up by the address of the jump instead of decoding the operand.
+    vm = vms['relocations']
+    labels = [pc for pc in module.relocations if vm.irCode[pc] == bc['JumpIf']]
+    unpackTarget = nilang_ir.u32le.unpack_from
+    def operandJumpIf():
+        condition = vm.stack.pop()
+        if condition:
+            vm.pc = unpackTarget(vm.irCode, vm.pc+1)[0]-5
+    for name, jump in (('JumpIf by operand', operandJumpIf), ('JumpIf by address', vm.JumpIf)):
+        start = time.perf_counter()
+        for pc in labels:
+            vm.pc = pc
+            vm.stack.append(True)
+            jump()
+        report(name, time.perf_counter()-start, len(labels), 'jump')
+
+def legacyCodeText(module):
+    # The code listing of generateText before the disassembler.
+    bc = nilang_ir.bc
+    result = ""
+    pc = 0
+    while pc < len(module.code):
+        opcode = module.code[pc]
+        result += "\t"+list(bc.keys())[list(bc.values()).index(opcode)]
+        if opcode >= nilang_ir.FirstSixByteOperation:
+            pc += 6
+        elif opcode >= nilang_ir.FirstFiveByteOperation:
+            pc += 5
+        elif opcode >= nilang_ir.FirstThreeByteOperation:
+            result += ", "+str(module.code[pc+1])
+            result += ", "+str(module.code[pc+2])
+            pc += 3
+        elif opcode >= nilang_ir.FirstTwoByteOperation:
+            result += ", "+str(module.code[pc+1])
+            pc += 2
+        else:
+            pc += 1
+        result += "\n"
+    return result
+
+def benchmarkDisassemble(kilobytes = 128):
+    import io
+    import nilang_disassembler
+    bc = nilang_ir.bc
+    module = nilang_ir.IRModule()
+    module.addImport('Kernel32.dll', 'ExitProcess')
+    module.addConstant('text', nilang_ir.types['strlit'], 'hello')
+    functions = 64
+    blocks = kilobytes*1024//20//functions
+    for f in range(functions):
+        module.addFunction('function%d' % f, f)
+        module.emitLabel(f)
+        for i in range(blocks):
+            module.emitAll(((bc['PushU8'], 0), (bc['ResolveAddrOfImportIndex'],), (bc['PushU8'], 0), (bc['ResolveAddrOfConstIndex'],),
+                (bc['PushU16'], 1000), (bc['PushU32'], 100000), (bc['Call'], 2)))
+            if i % 4 == 0:
+                module.emitJump(bc['Invoke'], (f+1) % functions, 0)
+        module.emit(bc['Return'])
+        module.finishFunction()
+    reader = nilang_ir.IRModule()
+    reader.read(bytes(module.generate()))
+    operations = blocks*functions*7+blocks*functions//4
+    start = time.perf_counter()
+    legacy = legacyCodeText(reader)
+    report('string concatenation', time.perf_counter()-start, operations, 'instruction')
+    disassembler = nilang_disassembler.Disassembler(reader)
+    stream = io.StringIO()
+    start = time.perf_counter()
+    disassembler.writeCode(stream)
+    report('disassembler', time.perf_counter()-start, operations, 'instruction')
+    # The legacy listing prints the parameters byte by byte, the operations have to match.
+    if [line.split(',')[0] for line in stream.getvalue().splitlines()] != [line.split(',')[0] for line in legacy.splitlines()]:
+        print('The listing differs')
+        exit(1)
+    with tempfile.TemporaryFile('w') as f:
+        start = time.perf_counter()
+        disassembler.writeCode(f, 0, None, True)
+        report('annotated to a file', time.perf_counter()-start, operations, 'instruction')
+    stream = io.StringIO()
+    start = time.perf_counter()
+    disassembler.writeFunction(stream, 'function%d' % (functions//2))
+    report('one function annotated', time.perf_counter()-start, 1, 'function')
+
+def peepholeModule(blocks):
+    # helper is invoked by every block of run, a block compares two constants like IfStmt,
+    # pushes and pops a value, jumps to the next operation and jumps to a jump.
+    bc = nilang_ir.bc
+    module = nilang_ir.IRModule()
+    module.addConstant('ONE', nilang_ir.types['u32'], 1)
+    module.addConstant('TWO', nilang_ir.types['u32'], 2)
+    module.addFunction('helper', 0)
+    module.emitLabel(0)
+    module.emitAll(((bc['PushU8'], 7), (bc['Pop'],), (bc['Return'],)))
+    module.finishFunction()
+    module.addFunction('run', 1)
+    module.emitLabel(1)
+    for i in range(blocks):
+        next, skip, after = 2+3*i, 3+3*i, 4+3*i
+        module.emitAll(((bc['PushU8'], 0), (bc['ResolveAddrOfConstIndex'],), (bc['PushU8'], i % 2), (bc['ResolveAddrOfConstIndex'],),
+            (bc['Equal'],), (bc['Not'],)))
+        module.emitJump(bc['JumpIf'], skip)
+        module.emitAll(((bc['PushU8'], 9), (bc['Pop'],), (bc['PushOne'],)))
+        module.emitJump(bc['Goto'], next)
+        module.emitLabel(next)
+        module.emitLabel(skip)
+        module.emitJump(bc['Goto'], after)
+        module.emitAll(((bc['PushOne'],), (bc['Pop'],)))
+        module.emitLabel(after)
+        module.emitJump(bc['Invoke'], 0, 0)
+    # run is the last function, the VM stops at the end of the code.
+    module.finishFunction()
+    return module
+
+def peepholeUnit(functions):
+    # Every function compares its parameter with both constants, run calls them with both.
+    lines = ['module peephole', '', 'const u32 ONE = 1;', 'const u32 TWO = 2;', '', 'leaf(u32 code) {', '}', '']
+    for f in range(functions):
+        lines += ['check%d(u32 code) {' % f,
+            '    if (code == ONE) {', '        leaf(code)', '    } else {', '        leaf(code)', '        leaf(code)', '    }',
+            '    if (code == TWO) {', '        leaf(code)', '    }', '}', '']
+    lines.append('run( ) {')
+    for f in range(functions):
+        lines += ['    check%d(ONE)' % f, '    check%d(TWO)' % f]
+    lines.append('}')
+    return '\n'.join(lines)+'\n'
+
+def runPeephole(name, data, repeat):
+    import nilang_interpreter
+    class CountingVM(nilang_interpreter.VM):
+        def __init__(self):
+            super().__init__()
+            self.executed = 0
+            self.invoked = 0
+
+        def Run(self):
+            # run returns behind the end of the code.
+            self.stack = [0, 0, 1 << 32]
+            self.fp = len(self.stack)
+            super().Run()
+
+        def DecodeOperation(self):
+            self.executed += 1
+            return super().DecodeOperation()
+
+        def Invoke(self):
+            self.invoked += 1
+            super().Invoke()
+
+    best = None
+    for i in range(repeat):
+        vm = CountingVM()
+        vm.AddMainModule(data)
+        start = time.perf_counter()
+        vm.Run()
+        elapsed = time.perf_counter()-start
+        best = elapsed if best == None else min(best, elapsed)
+    print('%-32s %10d instructions executed' % (name, vm.executed))
+    report('run '+name, best, 1, 'run')
+    return vm.executed, vm.invoked, vm.stack
+
+def comparePeephole(results):
+    generated, optimized = results['generated'], results['peephole']
+    print('%.1f%% fewer instructions executed' % (100-optimized[0]*100/generated[0]))
+    if generated[1:] != optimized[1:]:
+        print('The optimized code behaves differently')
+        exit(1)
+
+def benchmarkPeephole(functions = 40, repeat = 100):
+    import gc_parser_passes
+    import nilang_optimizer
+    # A compiled unit, GenerateIR runs the optimizer unless GC_PEEPHOLE=off.
+    tree = gc_parser.getParser().parse(peepholeUnit(functions))
+    setting = os.environ.get('GC_PEEPHOLE')
+    results = {}
+    for name, peephole in (('generated', 'off'), ('peephole', 'on')):
+        os.environ['GC_PEEPHOLE'] = peephole
+        manager = gc_parser_passes.PassManager()
+        manager.run(TokensToNodes(tree), ['PrepareProcessing', 'Decorate', 'PostProcessor', 'GenerateIR'])
+        unit = manager.visitors['GenerateIR']
+        print('%-32s %10d bytes of code' % (name, len(unit.generator.code)))
+        if unit.removed != None:
+            print('removed %s' % ', '.join('%s %d' % (rule, count) for rule, count in unit.removed.items()))
+        results[name] = runPeephole(name, unit.IR, repeat)
+    if setting == None:
+        os.environ.pop('GC_PEEPHOLE')
+    else:
+        os.environ['GC_PEEPHOLE'] = setting
+    comparePeephole(results)
+    # Push and Pop, jumps to jumps and jumps to the next operation aren't generated
+    # by the compiler yet, the module of the assembler checks these rules.
+    print('assembled module')
+    results = {}
+    for name in ('generated', 'peephole'):
+        module = peepholeModule(80)
+        size = len(module.code)
+        if name == 'peephole':
+            optimizer = nilang_optimizer.PeepholeOptimizer(module)
+            start = time.perf_counter()
+            removed = optimizer.optimize()
+            elapsed = time.perf_counter()-start
+            print('%d of %d bytes removed, %d operations: %s, %d jumps retargeted' % (size-len(module.code), size, removed,
+                ', '.join('%s %d' % (rule, count) for rule, count in optimizer.removed.items()), optimizer.retargeted))
+            report('optimize', elapsed, 1, 'module')
+        results[name] = runPeephole(name, bytes(module.generate()), repeat)
+    comparePeephole(results)
+
+comparisons = {'==': lambda a, b: a == b, '!=': lambda a, b: a != b, '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b}
+
+def branchUnit():
+    # Every comparison of a parameter with a constant and with a literal, run calls them with 1, 2 and 3.
+    lines = ['module branches', '', 'const u32 ONE = 1;', 'const u32 TWO = 2;', 'const u32 THREE = 3;', '',
+        'taken(u32 code) {', '}', 'skipped(u32 code) {', '}', '']
+    tests = []
+    for i, op in enumerate(comparisons):
+        for name, operand in (('constant', 'TWO'), ('literal', '2')):
+            tests.append(('%s%d' % (name, i), op))
+            lines += ['%s%d(u32 code) {' % (name, i), '    if (code %s %s) {' % (op, operand), '        taken(code)',
+                '    } else {', '        skipped(code)', '    }', '}', '']
+    lines.append('run( ) {')
+    for function, op in tests:
+        lines += ['    %s(%s)' % (function, value) for value in ('ONE', 'TWO', 'THREE')]
+    lines.append('}')
+    expected = ['taken' if comparisons[op](value, 2) else 'skipped' for function, op in tests for value in (1, 2, 3)]
+    return '\n'.join(lines)+'\n', expected
+
+def runBranches(data):
+    # The branches the code takes, by the calls of taken and skipped.
+    import nilang_interpreter
+    class BranchVM(nilang_interpreter.VM):
+        def Run(self):
+            self.branches = []
+            self.names = {offset: name for name, offset in self.functions.items()}
+            self.stack = [0, 0, 1 << 32]
+            self.fp = len(self.stack)
+            super().Run()
+
+        def Invoke(self):
+            name = self.names[self.targets[self.pc]]
+            if name in ('taken', 'skipped'):
+                self.branches.append(name)
+            super().Invoke()
+
+    vm = BranchVM()
+    vm.AddMainModule(data)
+    vm.Run()
+    return vm.branches
+
+def benchmarkBranches(repeat = 10):
+    import gc_parser_passes
+    # Both outcomes of every comparison of an if, the code of GenerateIR and the optimized code.
+    source, expected = branchUnit()
+    tree = gc_parser.getParser().parse(source)
+    setting = os.environ.get('GC_PEEPHOLE')
+    for name, peephole in (('generated', 'off'), ('peephole', 'on')):
+        os.environ['GC_PEEPHOLE'] = peephole
+        manager = gc_parser_passes.PassManager()
+        manager.run(TokensToNodes(tree), ['PrepareProcessing', 'Decorate', 'PostProcessor', 'GenerateIR'])
+        data = manager.visitors['GenerateIR'].IR
+        start = time.perf_counter()
+        for i in range(repeat):
+            branches = runBranches(data)
+        report('%s %d branches' % (name, len(expected)), time.perf_counter()-start, repeat, 'run')
+        if branches != expected:
+            print('The %s code takes the wrong branches' % name)
+            exit(1)
+    if setting == None:
+        os.environ.pop('GC_PEEPHOLE')
+    else:
+        os.environ['GC_PEEPHOLE'] = setting
+
+benchmarks = {
+    'peephole': benchmarkPeephole,
+    'branches': benchmarkBranches,
+    'disassemble': benchmarkDisassemble,
+    'relocations': benchmarkRelocations,
+    'assemble': benchmarkAssemble,
+    'constants': benchmarkConstants,
+    'symbols': benchmarkSymbols,
+    'shared': benchmarkShared,
+    'rewrite': benchmarkRewrite,
+    'startup': benchmarkStartup,
+    'scaling': benchmarkScaling,
+    'load': benchmarkLoad,
+    'query': benchmarkQuery,
+    'translate': benchmarkTranslate,
+    'expansions': benchmarkExpansions,
+    'decorators': benchmarkDecorators,
+    'passes': benchmarkPasses,
+    'visitor': benchmarkVisitor,
+    'memory': benchmarkMemory,
+    'astcache': benchmarkAstCache,
+    'build': benchmarkBuild,
+    'schedule': benchmarkSchedule,
+    'grammar': benchmarkGrammar,
+    'parse': benchmarkParse,
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or not sys.argv[1] in benchmarks:
+        print('Usage: python gc_benchmark.py <'+'|'.join(benchmarks.keys())+'> [units]')
+        exit(1)
+    args = [int(a) for a in sys.argv[2:]]
+    benchmarks[sys.argv[1]](*args)
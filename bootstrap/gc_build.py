@@ -0,0 +1,284 @@
+import os
+import re
+import glob
+import json
+import time
+import heapq
+import queue
+import hashlib
+import lark
+from multiprocessing import Pool
+from nilang_ir import IRModule
+from gc_parser import parse
+from gc_decorator_registry import unitModule
+import gc_trace
+
+# Incremental builds, the manifest remembers the state of every unit of the last build.
+# A unit is compiled again if its content, the compiler or one of its dependencies changed.
+
+cacheDirectory = 'gc_cache'
+manifestFile = cacheDirectory+'/manifest.json'
+
+def compilerVersion():
+    # Any change of the compiler sources invalidates all units.
+    h = hashlib.sha256()
+    h.update(lark.__version__.encode('utf-8'))
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(directory,'*.py'))):
+        h.update(os.path.basename(path).encode('utf-8'))
+        with open(path,'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def fileHash(path):
+    with open(path,'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+# use "lib" refers to the unit lib.gc, the decorator registry uses the same name.
+moduleName = unitModule
+
+def outputFile(path):
+    return cacheDirectory+'/'+path+'.nimo'
+
+class Manifest:
+    def __init__(self, path = manifestFile):
+        self.path = path
+        self.version = compilerVersion()
+        self.units = {}
+        self.modified = False
+        if os.path.exists(path):
+            try:
+                with open(path,'r') as f:
+                    data = json.load(f)
+                if data.get('version') == self.version:
+                    self.units = data.get('units',{})
+                else:
+                    self.modified = True
+            except (ValueError, OSError):
+                self.modified = True
+
+    def changed(self, path):
+        entry = self.units.get(path)
+        if entry == None or not os.path.exists(outputFile(path)):
+            return True
+        stat = os.stat(path)
+        if entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return False
+        # Touched but maybe not modified, the content decides.
+        if entry['hash'] != fileHash(path):
+            return True
+        entry['mtime'] = stat.st_mtime_ns
+        entry['size'] = stat.st_size
+        self.modified = True
+        return False
+
+    def outdated(self, files):
+        dirty = set(f for f in files if self.changed(f))
+        # Units which use a dirty unit have to be compiled again as well.
+        modules = {moduleName(f): f for f in files}
+        dependents = {}
+        for f in files:
+            if f in self.units:
+                for dependency in self.units[f]['dependencies']:
+                    if dependency in modules:
+                        dependents.setdefault(modules[dependency],[]).append(f)
+        stack = list(dirty)
+        while len(stack) > 0:
+            for f in dependents.get(stack.pop(),[]):
+                if not f in dirty:
+                    dirty.add(f)
+                    stack.append(f)
+        return [f for f in files if f in dirty]
+
+    def record(self, path):
+        stat = os.stat(path)
+        with open(outputFile(path),'rb') as f:
+            dependencies = IRModule().readDependencies(f.read())
+        self.units[path] = {
+            'hash': fileHash(path),
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'dependencies': dependencies,
+        }
+        self.modified = True
+
+    def forget(self, path):
+        if path in self.units:
+            del self.units[path]
+            self.modified = True
+
+    def save(self):
+        # Drop units whose source is gone.
+        for path in [p for p in self.units if not os.path.exists(p)]:
+            self.forget(path)
+        if not self.modified:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # The daemon and a build of the command line may save at the same time.
+        temp = self.path+'.'+str(os.getpid())+'.tmp'
+        with open(temp,'w') as f:
+            json.dump({'version': self.version, 'units': self.units}, f, indent=1, sort_keys=True)
+        os.replace(temp, self.path)
+        self.modified = False
+
+# The use statement of a unit, the scheduler needs the imports before the unit is compiled.
+usePattern = re.compile(r'\buse\s+((?:"[^"]*"\s*,\s*)*"[^"]*")')
+
+def sourceDependencies(path):
+    with open(path,'r') as f:
+        match = usePattern.search(f.read())
+    if match == None:
+        return []
+    return re.findall(r'"([^"]*)"', match.group(1))
+
+def timedCall(function, arg):
+    start = time.time()
+    result = function(arg)
+    return result, start, time.time()
+
+class Scheduler:
+    # Compiles the units in the order of their imports, a unit is dispatched
+    # when all units it uses are done. Ready units are dispatched largest-first
+    # so the big units don't end up in the tail of the build.
+    def __init__(self, files, workers = None):
+        self.files = files
+        self.workers = max(1, min(workers or os.cpu_count() or 1, len(files)))
+        modules = {moduleName(f): f for f in files}
+        self.dependencies = {}
+        self.dependents = {f: [] for f in files}
+        for f in files:
+            self.dependencies[f] = set()
+            for dependency in sourceDependencies(f):
+                if dependency in modules and modules[dependency] != f:
+                    self.dependencies[f].add(modules[dependency])
+                    self.dependents[modules[dependency]].append(f)
+        self.ready = {}
+        self.started = {}
+        self.finished = {}
+        # Failed units and the units which use them, by the error.
+        self.failed = {}
+
+    def run(self, pool, function):
+        done = queue.Queue()
+        heap = []
+        waiting = {f: len(self.dependencies[f]) for f in self.files}
+        def release(f):
+            self.ready[f] = time.time()
+            heapq.heappush(heap, (-os.path.getsize(f), f))
+        for f in self.files:
+            if waiting[f] == 0:
+                release(f)
+        self.start = time.time()
+        running = 0
+        remaining = len(self.files)
+        while remaining > 0:
+            if len(heap) == 0 and running == 0:
+                # Cyclic imports, release the largest unit of the cycle.
+                f = max((f for f in waiting if waiting[f] > 0), key=os.path.getsize)
+                waiting[f] = 0
+                release(f)
+            while len(heap) > 0 and running < self.workers:
+                f = heapq.heappop(heap)[1]
+                pool.apply_async(timedCall, (function, f),
+                    callback=lambda r, f=f: done.put((f, r, None)),
+                    error_callback=lambda e, f=f: done.put((f, None, e)))
+                running += 1
+            f, r, error = done.get()
+            running -= 1
+            remaining -= 1
+            if error != None:
+                # The units which use f can't be compiled, the independent units go on.
+                print('Build error: '+f+': '+type(error).__name__+': '+str(error))
+                self.failed[f] = error
+                yield f, None
+                for dependent in self.skip(f, waiting):
+                    remaining -= 1
+                    yield dependent, None
+                continue
+            result, self.started[f], self.finished[f] = r
+            for dependent in self.dependents[f]:
+                if waiting[dependent] > 0:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        release(dependent)
+            yield f, result
+        self.end = time.time()
+
+    def skip(self, f, waiting):
+        # Marks the units which wait for f directly or indirectly as failed.
+        skipped = []
+        stack = [f]
+        while len(stack) > 0:
+            for dependent in self.dependents[stack.pop()]:
+                if waiting[dependent] > 0:
+                    waiting[dependent] = -1
+                    self.failed[dependent] = 'uses the failed unit '+f
+                    print('Skipped: '+dependent+', it uses the failed unit '+f)
+                    skipped.append(dependent)
+                    stack.append(dependent)
+        return skipped
+
+    def report(self):
+        wall = self.end-self.start
+        busy = 0
+        for f in self.files:
+            if f in self.failed:
+                print('  %-32s failed' % f)
+                continue
+            wait = self.started[f]-self.ready[f]
+            work = self.finished[f]-self.started[f]
+            busy += work
+            print('  %-32s wait %8.1f ms compile %8.1f ms' % (f, wait*1000, work*1000))
+        utilization = busy/(wall*self.workers) if wall > 0 else 0
+        print('%d units on %d workers in %.1f ms, utilization %.0f%%' % (len(self.files), self.workers, wall*1000, utilization*100))
+
+def compileUnit(path):
+    print('Process:' + path)
+    with open(path,'r') as f:
+        return parse(f), gc_trace.takeEvents()
+
+def collect(r, traceEvents):
+    # A failed unit has no result, the manifest forgets it.
+    if r == None:
+        return False
+    result, events = r
+    traceEvents += events
+    return result
+
+def build(files, pool = None, workers = None, rebuild = False):
+    # Compiles the outdated units of files, returns the result of every compiled unit.
+    manifest = Manifest()
+    if rebuild:
+        manifest.units = {}
+    input = manifest.outdated(files)
+    processed = []
+    traceEvents = []
+    if len(input) > 0:
+        print('Process units')
+        scheduler = Scheduler(input, workers)
+        results = {}
+        with gc_trace.stage('build'):
+            if pool == None:
+                with Pool(scheduler.workers) as pool:
+                    for f, r in scheduler.run(pool, compileUnit):
+                        results[f] = collect(r, traceEvents)
+            else:
+                for f, r in scheduler.run(pool, compileUnit):
+                    results[f] = collect(r, traceEvents)
+        traceEvents += gc_trace.takeEvents()
+        processed = [results[f] for f in input]
+        scheduler.report()
+    else:
+        print('Units are up to date')
+    for f, ok in zip(input, processed):
+        if ok:
+            manifest.record(f)
+        else:
+            manifest.forget(f)
+    manifest.save()
+    if gc_trace.enabled():
+        gc_trace.write(cacheDirectory+'/trace.json', traceEvents)
+        units = [e['args'] for e in traceEvents if e.get('cat') == 'unit' and 'walks' in e.get('args', {})]
+        if len(units) > 0:
+            print('%d passes in %d walks, %d walks saved' % tuple(sum(a[key] for a in units) for key in ('passes', 'walks', 'walks_saved')))
+    return dict(zip(input, processed))
@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import socket
+import threading
+from multiprocessing import Pool
+
+# Compile server, keeps the parser and a pool of warm workers resident and
+# compiles the touched units of the current directory.
+# Usage: python gc_daemon.py serve [workers]
+#        python gc_daemon.py build|status|stop
+# The compiler is only imported by the server, the client starts without lark and numpy.
+
+cacheDirectory = 'gc_cache'
+socketFile = cacheDirectory+'/daemon.sock'
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+def warmWorker():
+    import gc_parser
+    gc_parser.getParser()
+
+def sourceFiles():
+    return sorted(f for f in os.listdir() if f.endswith('.gc'))
+
+def snapshot():
+    result = {}
+    for f in sourceFiles():
+        try:
+            stat = os.stat(f)
+        except FileNotFoundError:
+            # removed since the listing, the next snapshot misses it
+            continue
+        result[f] = (stat.st_mtime_ns, stat.st_size)
+    return result
+
+class Daemon:
+    def __init__(self, workers = None, interval = 0.1):
+        self.workers = workers or os.cpu_count() or 1
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.running = True
+        self.builds = 0
+        self.last = 'no build yet'
+
+    def build(self):
+        from gc_build import build
+        with self.lock:
+            start = time.perf_counter()
+            self.builds += 1
+            # A failing build is reported, the watcher and the listener keep running.
+            try:
+                results = build(sourceFiles(), self.pool, self.workers)
+            except Exception as e:
+                self.last = 'build failed in %.1f ms: %s: %s' % ((time.perf_counter()-start)*1000, type(e).__name__, e)
+                print(self.last)
+                return self.last
+            failed = [f for f in results if not results[f]]
+            self.last = '%d units compiled, %d failed in %.1f ms' % (len(results), len(failed), (time.perf_counter()-start)*1000)
+            if len(failed) > 0:
+                self.last += ': '+', '.join(failed)
+            print(self.last)
+            return self.last
+
+    def watchPolling(self):
+        state = snapshot()
+        while self.running:
+            time.sleep(self.interval)
+            current = snapshot()
+            if current != state:
+                state = current
+                self.build()
+
+    def watchInotify(self):
+        inotify = INotify()
+        inotify.add_watch('.', flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE)
+        while self.running:
+            events = inotify.read(timeout=int(self.interval*1000))
+            if any(event.name.endswith('.gc') for event in events):
+                self.build()
+
+    def handle(self, connection):
+        with connection:
+            command = connection.recv(1024).decode('utf-8').strip()
+            if command == 'build':
+                answer = self.build()
+            elif command == 'status':
+                answer = 'pid %d, %d workers, %d builds, last: %s' % (os.getpid(), self.workers, self.builds, self.last)
+            elif command == 'stop':
+                self.running = False
+                answer = 'stopped'
+            else:
+                answer = 'unknown command: '+command
+            connection.sendall(answer.encode('utf-8'))
+
+    def listen(self, server):
+        while self.running:
+            try:
+                connection, address = server.accept()
+            except socket.timeout:
+                continue
+            try:
+                self.handle(connection)
+            except OSError as e:
+                # the client went away
+                print('request failed: '+str(e))
+
+    def serve(self):
+        os.makedirs(cacheDirectory, exist_ok=True)
+        if os.path.exists(socketFile):
+            os.remove(socketFile)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socketFile)
+        server.listen()
+        server.settimeout(self.interval)
+        with Pool(self.workers, initializer=warmWorker) as self.pool:
+            warmWorker()
+            self.build()
+            listener = threading.Thread(target=self.listen, args=(server,), daemon=True)
+            listener.start()
+            print('Watching '+os.getcwd()+(' with inotify' if INotify != None else ''))
+            try:
+                if INotify != None:
+                    self.watchInotify()
+                else:
+                    self.watchPolling()
+            except KeyboardInterrupt:
+                self.running = False
+            listener.join()
+        server.close()
+        os.remove(socketFile)
+
+def request(command):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socketFile)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print('No compile daemon is running in '+os.getcwd())
+        exit(1)
+    with client:
+        client.sendall(command.encode('utf-8'))
+        client.shutdown(socket.SHUT_WR)
+        answer = b''
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            answer += data
+    return answer.decode('utf-8')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or not sys.argv[1] in ('serve', 'build', 'status', 'stop'):
+        print('Usage: python gc_daemon.py <serve [workers]|build|status|stop>')
+        exit(1)
+    if sys.argv[1] == 'serve':
+        Daemon(int(sys.argv[2]) if len(sys.argv) > 2 else None).serve()
+    else:
+        print(request(sys.argv[1]))
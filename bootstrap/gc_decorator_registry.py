@@ -0,0 +1,133 @@
+import os
+import marshal
+import hashlib
+import importlib.util
+import gc_ast_cache
+
+# Registry of the compiled decorators shared by all units and workers.
+# gc_cache/decorators/<hash>.code holds the marshalled code object, the
+# parameter names and the deterministic flag of a decorator, the hash covers
+# the decorator AST, the compiler and the python version.
+# gc_cache/decorators/<module>/<name> holds
+# the hash of the decorator <name> defined by <module>, a unit which uses the
+# module can apply it. <module> is the unit file without .gc, the name of the
+# use statement, not the module declaration of the unit.
+
+directory = 'gc_cache/decorators'
+
+def unitModule(path):
+    # use "lib" refers to the unit lib.gc
+    return path[:-3] if path.endswith('.gc') else path
+
+class DecoratorRegistry:
+    def __init__(self, path = directory):
+        self.path = path
+        # Code objects of this process, a warm worker doesn't read them again.
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, tree):
+        h = hashlib.sha256()
+        h.update(importlib.util.MAGIC_NUMBER)
+        h.update(gc_ast_cache.compilerDigest())
+        h.update(gc_ast_cache.structuralHash(tree).encode('utf-8'))
+        return h.hexdigest()
+
+    def codeFile(self, key):
+        return self.path+'/'+key+'.code'
+
+    def load(self, key):
+        # Returns the parameter names, the code object and the deterministic flag, None if the decorator isn't compiled yet.
+        if key in self.entries:
+            self.hits += 1
+            return self.entries[key]
+        try:
+            with open(self.codeFile(key),'rb') as f:
+                parameter, code, deterministic = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries[key] = (list(parameter), code, deterministic)
+        return self.entries[key]
+
+    def store(self, key, parameter, code, deterministic = False):
+        self.entries[key] = (list(parameter), code, deterministic)
+        os.makedirs(self.path, exist_ok=True)
+        # Workers store concurrently, every writer uses its own temporary file.
+        temp = self.codeFile(key)+'.'+str(os.getpid())+'.tmp'
+        with open(temp,'wb') as f:
+            f.write(marshal.dumps((tuple(parameter), code, deterministic)))
+        os.replace(temp, self.codeFile(key))
+
+    def publish(self, module, decorators):
+        # decorators maps the names defined by module to their keys, names the module doesn't define anymore are removed.
+        moduleDirectory = self.path+'/'+module
+        os.makedirs(moduleDirectory, exist_ok=True)
+        for name in os.listdir(moduleDirectory):
+            if not name in decorators and not name.endswith('.tmp'):
+                os.remove(moduleDirectory+'/'+name)
+        for name, key in decorators.items():
+            path = moduleDirectory+'/'+name
+            temp = path+'.'+str(os.getpid())+'.tmp'
+            with open(temp,'w') as f:
+                f.write(key)
+            os.replace(temp, path)
+
+    def exported(self, module):
+        moduleDirectory = self.path+'/'+module
+        if not os.path.isdir(moduleDirectory):
+            return []
+        return [name for name in os.listdir(moduleDirectory) if not name.endswith('.tmp')]
+
+    def find(self, modules, name):
+        # Returns the key of the decorator name defined by the first of modules, None if no module defines it.
+        for module in modules:
+            try:
+                with open(self.path+'/'+module+'/'+name,'r') as f:
+                    return f.read().strip()
+            except OSError:
+                continue
+        return None
+
+class ExpansionCache:
+    # Rewrites of the deterministic decorators of a unit, gc_cache/<module>.expansions
+    # maps the hash of the decorator, the decoration and the decorated node to
+    # the changed fields of the decorated node. Only the entries of the last build are kept.
+    def __init__(self, module, path = 'gc_cache'):
+        self.file = path+'/'+module+'.expansions'
+        self.entries = None
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if self.entries == None:
+            try:
+                with open(self.file,'rb') as f:
+                    self.entries = marshal.loads(f.read())
+            except (OSError, EOFError, ValueError, TypeError):
+                self.entries = {}
+        entry = self.entries.get(key)
+        if entry == None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used[key] = entry
+        return entry
+
+    def put(self, key, entry):
+        self.used[key] = entry
+
+    def save(self):
+        if self.entries == None or self.used == self.entries:
+            return
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        temp = self.file+'.'+str(os.getpid())+'.tmp'
+        with open(temp,'wb') as f:
+            f.write(marshal.dumps(self.used))
+        os.replace(temp, self.file)
+        self.entries = dict(self.used)
+
+registry = DecoratorRegistry()
@@ -1,10 +1,18 @@
 import sys
-from lark import Lark, UnexpectedInput
+import os
+import glob
+import hashlib
+import lark
+from lark import Lark, Transformer, Tree, UnexpectedInput
 import pickle
-from gc_parser_decorator import Decorate,PrepareProcessing,GenerateIR
+from gc_parser_passes import PassManager, importsDecorators
 from gc_parser_nodes import TokensToNodes
+from gc_parser_decorator import DecoratorError, CompileError
 from gc_parser_postprocessor import PostProcessor
 from nilang_ir import IRModule
+from nilang_disassembler import Disassembler
+from gc_trace import stage
+import gc_ast_cache
 
 gamecode_grammar = r"""
     _separated{e, sep}: e (sep e)*
@@ -23,7 +31,7 @@ gamecode_grammar = r"""
     import_: "use" (string_literal | match) ("," (string_literal | match))*
 
     // Post processor
-    ast_decorator: "decorator" NAME "(" _AST NAME "," _AST NAME "," _AST NAME ")" "{" small_stmt_list "}"
+    ast_decorator: [decorations] "decorator" NAME "(" _AST NAME "," _AST NAME "," _AST NAME ")" "{" small_stmt_list "}"
     _AST: "__AST__"
 
     interface: "interface" NAME "{" intf_functions "}"
@@ -216,41 +224,405 @@ gamecode_grammar = r"""
     %ignore C_COMMENT
     """
 
+# LALR(1) version of gamecode_grammar for the contextual lexer.
+# ShapeLalrTree turns its parse tree into the tree the Earley parser builds
+# for the same source. The remaining shift/reduce conflicts are resolved as
+# shift on purpose: dangling else, dangling ":" of conditional_expr, C style
+# casts "(" NAME ")" operand and statements which aren't separated.
+gamecode_grammar_lalr = r"""
+    _separated{e, sep}: e (sep e)*
+
+    unit: package [import_] unit_stmt
+    unit_stmt: ( ast_decorator
+               | struct_
+               | enum
+               | alias
+               | function_definition
+               | function_declaration
+               | namespace
+               | variable
+               | interface)*
+    ?package: "module" NAME
+    import_: "use" (string_literal | match) ("," (string_literal | match))*
+
+    // Post processor
+    ast_decorator: [decorations] "decorator" NAME "(" _AST NAME "," _AST NAME "," _AST NAME ")" "{" small_stmt_list "}"
+    _AST: "__AST__"
+
+    interface: "interface" NAME "{" intf_functions "}"
+    ?intf_functions: interface_function*
+    interface_function: [decorations] NAME "(" [paramlist] ")" ["->" type_decl ] ";"
+
+    namespace: [decorations] "namespace" NAME "{" (function_definition
+                                                  |function_declaration
+                                                  |variable
+                                                  |struct_
+                                                  |enum
+                                                  |alias
+                                                  |namespace
+                                                  |interface)* "}"
+    enum: "enum" NAME "{" enum_values "}"
+    enum_values: _separated{NAME, ","}
+    struct_: [decorations] "struct" NAME ["<" typelist ">"] "{" struct_body "}"
+    struct_body:(function_definition|function_declaration|variable|operator|compose)*
+    alias: "alias" NAME "=" type_decl
+
+    // A lone NAME in front of another NAME always starts a declaration.
+    ?type_decl.2: [CONST] (NAME|AUTO) ["<" typelist ">"]
+    typelist: type_decl (","type_decl)*
+    CONST: "const"
+    variable: [decorations] [STATIC] type_decl NAME [init_var] ";"
+    ?init_var: "=" logical_or
+    STATIC: "static"
+    compose: NAME ";"
+
+    function_declaration: [decorations] NAME "(" [paramlist] ")" ["->" type_decl ] ";"
+    function_definition: [decorations] NAME "(" [paramlist] ")" ["->" type_decl ] "{" small_stmt_list "}"
+    lambda_: [decorations] "(" [paramlist] ")" ["->" NAME] "{" small_stmt_list "}"
+    paramlist : param ("," param)*
+    param : type_decl NAME
+    func_call : NAME (func_call_empty | "("[arglist]")")
+    func_call_empty: "()"
+    arglist: logical_or ("," logical_or)*
+
+    operator: "operator" (escape_operator
+                         |index_operator
+                         |newindex_operator
+                         |call_operator
+                         |inheritance_operator) "{" small_stmt_list "}"
+    // runtime
+    index_operator: "[]" "(" param ")" "->" NAME
+    newindex_operator: "[]" "(" param "," param ")"
+    call_operator: "()" "(" [paramlist] ")" ["->" NAME]
+    // parser/compiler time
+    escape_operator: "\'" NAME "'" "()"
+    inheritance_operator: ":" "(" _AST NAME "," _AST NAME ")"
+
+    decorations : "[[" _separated{decoration, ","} "]]"
+    ?decoration: NAME [":" (numeric_literal | string_literal)]
+
+    small_stmt_list : small_stmt*
+    ?small_stmt: variable
+               | arithmetic_expr
+               | conditional_expr
+               | return
+               | for_stmt
+               | match
+               | switch
+               | call_stmt
+               | lambda_
+               | if_stmt
+               | assignment
+
+    return: "return" value_stmt
+
+    // Statement level call chain, the value is dropped.
+    call_stmt.2: chain
+    arithmetic_expr: chain ("+"|"-") (chain | arithmetic_expr | string_literal)
+    block_stmt: "{" small_stmt* "}"
+              | small_stmt
+    if_stmt: "if" "(" logical_or ")" block_stmt ["else" block_stmt]
+    conditional_expr: logical_or "?" (block_value | value_stmt) [":" (block_value | value_stmt)]
+
+    assignment: chain (ASSIGN|ASSIGN_OP) value_stmt
+
+    ?logical_or: logical_and
+               | logical_or LOG_OR_OP logical_and -> binop_expr
+    ?logical_and: inclusive_or
+                | logical_and LOG_AND_OP inclusive_or -> binop_expr
+    ?inclusive_or: exclusive_or
+                 | inclusive_or OR_OP exclusive_or -> binop_expr
+    ?exclusive_or: and_
+                 | exclusive_or XOR_OP and_ -> binop_expr
+    ?and_: equality
+         | and_ AND_OP equality -> binop_expr
+    ?equality: relational
+             | equality EQ relational -> binop_expr
+             | equality NEQ relational -> binop_expr
+    ?relational: shift
+               | relational REL_OP shift -> binop_expr
+    ?shift: add
+          | shift SHIFT_OP add -> binop_expr
+    ?add: mul
+        | add (MINUS|PLUS) mul -> binop_expr
+    ?mul: cast
+        | mul MUL_OP cast -> binop_expr
+    // "(" NAME ")" followed by an operand is always a cast.
+    ?cast: "(" cast_type ")" cast -> cast
+         | "(" NAME ")" cast -> cast_name
+         | unary
+    cast_type: CONST (NAME|AUTO) ["<" typelist ">"]
+             | AUTO ["<" typelist ">"]
+             | NAME "<" typelist ">"
+    ?unary: postfix
+          | (MINUS|PLUS) cast -> unary_expr
+    ?postfix: primary
+            | postfix "[" assignment "]" -> array_subscript
+            | postfix "[" value_stmt "]" -> index_query
+            | postfix "(" [arglist] ")" -> func_call
+    ?primary: chain
+            | numeric_literal
+            | string_literal
+            | "(" NAME ")" -> paren_name
+            | "(" logical_or ")" -> paren
+
+    // Value of return, assignment, match and conditional_expr.
+    value_stmt: logical_or
+              | conditional_expr
+              | match
+
+    block_value: "{" small_stmt* "}"
+    chain: _chain_item ("." _chain_item)*
+    _chain_item: NAME
+               | func_call
+               | scope_var
+    scope_var: NAME ("::" NAME)+
+
+    for_stmt: "for" NAME "in" chain "{" small_stmt "}"
+
+    switch: "switch" "(" chain ")" "{" switch_case ("," switch_case)* [[","] "default" ":" chain] "}"
+    switch_case: (numeric_literal | string_literal | chain) ":" chain [switch_break]
+    switch_break: "break"
+
+    match: "match" "(" value_stmt ["as" NAME] ")" ["->" type_decl] "{" match_cases [[","] "default" ":" (value_stmt | block_value)] "}"
+    match_cases: match_case*
+    match_case: (numeric_literal | string_literal | NAME) ":" (value_stmt | block_value)
+
+    string_literal: ESCAPED_STRING
+    numeric_literal: INT_CONSTANT
+                   | FLOATING_POINT
+
+    AUTO: "auto"
+    MINUS.0: "-"
+    PLUS.0: "+"
+    ASSIGN: "="
+    SHIFT_OP.2: "<<"
+              | ">>"
+    ASSIGN_OP: ASSIGN
+             | "*="
+             | "/="
+             | "%="
+             | "+="
+             | "-="
+             | "<<="
+             | ">>="
+             | "^="
+             | "&="
+             | "|="
+    LOG_OR_OP: "||"
+    LOG_AND_OP: "&&"
+    OR_OP: "|"
+    XOR_OP: "^"
+    AND_OP: "&"
+    EQ.2: "=="
+    NEQ: "!="
+    REL_OP: "<"
+          | ">"
+          | ">="
+          | "<="
+    MUL_OP: "*"
+          | "/"
+          | "%"
+
+    INT_CONSTANT: HEX_NUMBER
+                | DEC_NUMBER
+                | "0"
+
+    HEX_NUMBER: /0x[\da-f]+/i
+    DEC_NUMBER: /[1-9]\d*/
+    FLOATING_POINT.2: /[0-9]*\.[0-9]+/
+
+    %import common.ESCAPED_STRING
+    %import common.CNAME -> NAME
+    %import common.WS
+    %import common.CPP_COMMENT
+    %import common.C_COMMENT
+    %ignore WS
+    %ignore CPP_COMMENT
+    %ignore C_COMMENT
+    """
+
+class _ChainCall(Tree):
+    # func_call built from a call chain, it becomes a var in value position.
+    __slots__ = ()
+
+def _asValue(node):
+    if type(node) is _ChainCall:
+        var, arguments = node.children
+        return Tree('var', var.children[:-1]+[Tree('func_call', [var.children[-1], arguments])])
+    return node
+
+def _asCallChain(node):
+    node = _asValue(node)
+    if isinstance(node, Tree) and node.data == 'var':
+        return Tree('call_chain', node.children)
+    return node
+
+class ShapeLalrTree(Transformer):
+    # Runs inline while the LALR parser reduces, TokensToNodes gets the same
+    # tree as from the Earley parser.
+    def chain(self, s):
+        last = s[-1]
+        if isinstance(last, Tree) and last.data == 'func_call' and not (isinstance(last.children[1], Tree) and last.children[1].data == 'func_call_empty'):
+            return _ChainCall('func_call', [Tree('var', s[:-1]+[last.children[0]]), last.children[1]])
+        return Tree('var', s)
+    def value_stmt(self, s):
+        return _asValue(s[0])
+    def paren(self, s):
+        if type(s[0]) is _ChainCall:
+            return Tree('func_call', s[0].children)
+        return s[0]
+    def paren_name(self, s):
+        return Tree('var', s)
+    def cast_name(self, s):
+        return Tree('cast', [Tree('type_decl', [None, s[0], None]), s[1]])
+    def cast_type(self, s):
+        const = None
+        if s[0].type == 'CONST':
+            const = s.pop(0)
+        templateParameter = None
+        if len(s) > 1:
+            templateParameter = s[1]
+        return Tree('type_decl', [const, s[0], templateParameter])
+    def call_stmt(self, s):
+        return _asCallChain(s[0])
+    def arithmetic_expr(self, s):
+        return Tree('arithmetic_expr', [_asCallChain(e) for e in s])
+    def assignment(self, s):
+        return Tree('binop_expr', [_asValue(s[0]), s[1], s[2]])
+    def index_query(self, s):
+        return Tree('index_query', [_asValue(s[0]), s[1]])
+    def for_stmt(self, s):
+        return Tree('for_stmt', [s[0], _asValue(s[1]), s[2]])
+    def switch(self, s):
+        return Tree('switch', [_asValue(e) for e in s])
+    def switch_case(self, s):
+        return Tree('switch_case', [_asValue(e) for e in s])
+
+earleyParserOptions = {'start':'unit', 'parser':'earley', 'lexer':'standard', 'maybe_placeholders':True}
+parserOptions = {'start':'unit', 'parser':'lalr', 'lexer':'contextual', 'maybe_placeholders':True, 'transformer':ShapeLalrTree()}
+cacheDirectory = 'gc_cache'
+# Process wide parser, built once by getParser().
+_parser = None
+
+def grammarHash(grammar = gamecode_grammar_lalr, options = parserOptions):
+    # The key covers everything which changes the parser tables.
+    key = grammar + lark.__version__ + str(sys.version_info[:2])
+    for name in sorted(options):
+        value = options[name]
+        if name == 'transformer':
+            value = value.__class__.__name__
+        key += name + str(value)
+    return hashlib.sha256(key.encode('utf8')).hexdigest()
+
+def buildParser(grammar = gamecode_grammar_lalr, options = parserOptions, cache = True):
+    # Lark can only cache the tables of the LALR parser.
+    if not cache or options['parser'] != 'lalr':
+        return Lark(grammar, **options)
+    cacheFile = os.path.join(cacheDirectory, 'grammar_'+grammarHash(grammar, options)+'.lark')
+    if not os.path.exists(cacheFile):
+        os.makedirs(cacheDirectory, exist_ok=True)
+        # Remove the tables of outdated grammars.
+        for old in glob.glob(os.path.join(cacheDirectory, 'grammar_*.lark')):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    # Lark rebuilds and rewrites a cache file which it can't load.
+    return Lark(grammar, cache=cacheFile, **options)
+
+def getParser():
+    global _parser
+    if _parser == None:
+        _parser = buildParser()
+    return _parser
+
+def textDump():
+    # GC_TEXT_DUMP=off skips the .nimo.txt listing, nilang_disassembler.py lists a module on demand.
+    return os.environ.get('GC_TEXT_DUMP','on') != 'off'
+
 def parse(f):
-    gamecode_parser = Lark(gamecode_grammar, start='unit', lexer='standard', maybe_placeholders=True)
+    # The pass manager adds the passes and walks of the unit.
+    args = {}
+    with stage(f.name, f.name, 'unit', args = args):
+        return parseStages(f, args)
+
+def parseStages(f, args = None):
+    source = f.read()
+    sourceHash = gc_ast_cache.sourceDigest(source)
+    with stage('AST cache load', f.name):
+        ast, cached = gc_ast_cache.load(f.name, sourceHash)
+    # The decorators of the used modules may have changed since the decorated AST was cached.
+    if cached >= gc_ast_cache.DECORATED and importsDecorators(ast):
+        ast, cached = None, 0
     try:        
-        tree = gamecode_parser.parse(f.read())        
-        #pickle.dump(tree, open('gc_cache/'+f.name+'.ast','wb'))
-        dbg = open('gc_cache/'+f.name+'.ast.txt','w')
-        dbg.write(tree.pretty())
-        dbg.close()
-        ast = TokensToNodes(tree)
+        if ast == None:
+            with stage('getParser', f.name):
+                gamecode_parser = getParser()
+            with stage('Lark parse', f.name):
+                tree = gamecode_parser.parse(source)
+            with stage('AST dump', f.name):
+                dbg = open('gc_cache/'+f.name+'.ast.txt','w')
+                dbg.write(tree.pretty())
+                dbg.close()
+            with stage('TokensToNodes', f.name):
+                ast = TokensToNodes(tree)
+            gc_ast_cache.store(f.name, ast, gc_ast_cache.NODES, sourceHash)
         #print(ast)
-        # Add parent to the nodes.
-        PrepareProcessing().visit_top_down(ast)
-        # Manipulate the AST by decoration.
-        Decorate(ast).visit(ast)
-        # Do simple compile time optimizations.
-        PostProcessor().transform(ast)
+        manager = PassManager(f.name)
+        # Add parent to the nodes and manipulate the AST by decoration.
+        if cached < gc_ast_cache.DECORATED:
+            middle = ['PrepareProcessing', 'Decorate']
+            if gc_ast_cache.cacheStage() == gc_ast_cache.DECORATED:
+                ast = manager.run(ast, middle)
+                gc_ast_cache.store(f.name, ast, gc_ast_cache.DECORATED, sourceHash)
+                middle = []
+        else:
+            # The folding needs the parents, the cache doesn't keep them.
+            middle = ['PrepareProcessing']
+        # Do compile time optimizations.
+        if cached < gc_ast_cache.OPTIMIZED:
+            middle.append('PostProcessor')
+            if gc_ast_cache.cacheStage() == gc_ast_cache.OPTIMIZED:
+                ast = manager.run(ast, middle)
+                gc_ast_cache.store(f.name, ast, gc_ast_cache.OPTIMIZED, sourceHash)
+                middle = []
         # Convert high level abstraction(classes) to low level.
         # Build the interpreter code.
-        unit = GenerateIR()
-        unit.visit_top_down(ast)
-        irFile=open('gc_cache/'+f.name+'.nimo','wb')
-        irFile.write(unit.IR)
-        irFile.close()
+        ast = manager.run(ast, middle+['GenerateIR'])
+        if args != None:
+            args.update(manager.counts())
+        unit = manager.visitors['GenerateIR']
+        # A VM may have mapped the module, it is replaced instead of written in place.
+        moduleFile = 'gc_cache/'+f.name+'.nimo'
+        temp = moduleFile+'.'+str(os.getpid())+'.tmp'
+        with open(temp,'wb') as irFile:
+            irFile.write(unit.IR)
+        os.replace(temp, moduleFile)
         
-        reader = IRModule()
-        #print(unit.IR)
-        reader.read(unit.IR)
-        readableIRFile = open('gc_cache/'+f.name+'.nimo.txt','w')
-        readableIRFile.write(reader.generateText())
-        readableIRFile.close()
+        textFile = 'gc_cache/'+f.name+'.nimo.txt'
+        if textDump():
+            with stage('IR text dump', f.name):
+                reader = IRModule()
+                reader.read(unit.IR)
+                with open(textFile,'w') as readableIRFile:
+                    Disassembler(reader).write(readableIRFile)
+        elif os.path.exists(textFile):
+            # The dump of an older build would describe different code.
+            os.remove(textFile)
         return True
     except UnexpectedInput as u:
         print('Parser error: '+f.name)
         print(u)
         return False
+    except DecoratorError as e:
+        print('Decorator error: '+f.name)
+        print(e)
+        return False
+    except CompileError as e:
+        print('Compile error: '+f.name)
+        print(e)
+        return False
 
 if __name__ == '__main__':
     with open(sys.argv[1]) as f:
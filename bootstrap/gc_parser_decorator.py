@@ -2,8 +2,15 @@ from typing import List
 from numpy.lib.arraysetops import isin
 
 from numpy.lib.type_check import iscomplex
+import ast as pyast
+from lark import Tree
 from gc_parser_nodes import *
 from nilang_ir import *
+from gc_decorator_registry import registry, unitModule, ExpansionCache
+from gc_ast_cache import encodeTree, decodeTree, digest
+from gc_parser_index import AstIndex
+from gc_trace import stage
+import nilang_optimizer
 # Decorator Engine allows to adjust the AST at compile time.
 # This step runs before any AST optimization, right after the AST generation.
 # The decorator related nodes are part of the package output but not binary.
@@ -16,169 +23,449 @@ from nilang_ir import *
 # @ROOT Is the root node of the AST.
 # @DECORATOR_NODE Is the node of the AST which will be decorated e.g. function, class,... .
 # All three parameter are references to the same AST. If you modify one it impacts the other.
-
-class PreProcessor(NodeVisitor):
+# ASTQuery finds nodes without walking ROOT: byType, byName, byDecoration, byParent,
+# parent and find(type, name, decoration key, parent) where None matches everything.
+# ASTFactory creates nodes, ASTQuery finds them once they are inserted.
+# The decorators of a module can be applied by every unit which uses the module.
+# A decorator marked [[deterministic]] may only change the decorated node and
+# its result may only depend on the decoration and the decorated node. Its
+# rewrite is cached and replayed without running the decorator again.
+
+class DecoratorError(Exception):
+    pass
+
+# The unit can't be translated, like a literal which doesn't fit into a type of the VM.
+class CompileError(Exception):
+    pass
+
+binaryOperators = {'+': pyast.Add, '-': pyast.Sub, '*': pyast.Mult, '/': pyast.Div, '%': pyast.Mod,
+    '<<': pyast.LShift, '>>': pyast.RShift, '&': pyast.BitAnd, '|': pyast.BitOr, '^': pyast.BitXor}
+comparisonOperators = {'==': pyast.Eq, '!=': pyast.NotEq, '<': pyast.Lt, '<=': pyast.LtE, '>': pyast.Gt, '>=': pyast.GtE}
+logicalOperators = {'&&': pyast.And, '||': pyast.Or}
+unaryOperators = {'-': pyast.USub, '+': pyast.UAdd}
+
+# The operations of the negated comparison of an if statement, JumpIf skips the
+# then branch if it holds. The right operand is on the top of the stack.
+negatedComparisons = {'==': ('Equal', 'Not'), '!=': ('Equal',), '<': ('Less', 'Not'), '<=': ('LessEqual', 'Not'),
+    '>': ('LessEqual',), '>=': ('Less',)}
+
+# The nodes of a decorator have no source position, compile needs one.
+position = {'lineno': 1, 'col_offset': 0, 'end_lineno': 1, 'end_col_offset': 0}
+
+def kindName(value):
+    # The class of a node or the camel case rule of a lark tree, e.g. conditional_expr is ConditionalExpr.
+    if isinstance(value, Tree):
+        return ''.join(p.capitalize() for p in value.data.split('_'))
+    return value.__class__.__name__
+
+# The names of the python constants, the decorator code can pass None to ASTQuery.find.
+constants = {'None': None, 'True': True, 'False': False}
+
+def name(identifier, store = False):
+    if not store and identifier in constants:
+        return pyast.Constant(constants[identifier], **position)
+    return pyast.Name(identifier, pyast.Store() if store else pyast.Load(), **position)
+
+def function(identifier, body):
+    args = pyast.arguments(posonlyargs=[], args=[], vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[])
+    return pyast.FunctionDef(name=identifier, args=args, body=body, decorator_list=[], returns=None, type_comment=None, **position)
+
+# Handlers of every node class and tree rule.
+statementHandlers = {}
+expressionHandlers = {}
+
+# Translates a decorator into a python module. The body runs in a function,
+# return ends the decorator. Statement handlers return a list of python
+# statements, expression handlers a python expression.
+class PreProcessor():
     def __init__(self):
         self.bytecode = None
+        self.module = None
         self.parameter = []
         self.counter = 0
 
-    def debug(self, node):
-        pass
-        #print("["+str(self.counter)+"]: "+str(node))
-        #self.counter+=1
-
-    def __fallback__(self,node,parent=None):
-        exit("Not implemented:"+str(node))
-
-    def Type(self, node):
-        self.debug(node)
-        node._value = ""
-
-    def StringLiteral(self, node):
-        node._value = "\""+node.value+"\""
-        self.debug(node)
-
-    def AstDecorator(self, node):
-        self.debug(node)
-        code = ""
-        for e in node.statements:
-            code += e._value
-        self.code = code
-        #print(self.code)
-        self.bytecode = compile(self.code, filename="",mode="exec")
-        self.parameter.append(node.sender)
-        self.parameter.append(node.root)
-        self.parameter.append(node.target)
-
-    def FuncCall(self, node):
-        self.debug(node)
-        args = ""
-        if node.arguments != None:
-            if isinstance(node.arguments, List):
-                for e in node.arguments[0:-1]:
-                    args += e._value+","
-                args += node.arguments[-1]._value
-            else:
-                args += node.arguments._value
-        node._value = node.name+"("+args+")"
-
-    def Variable(self, node):        
-        self.debug(node)
-        res = node.name + " = "
-        if isinstance(node.init, List):
-            for e in node.init[0:-1]:
-                if isinstance(e,str):
-                    res += e+"."
-                else:
-                    res += e._value+"."
-            if isinstance(node.init[-1],str):
-                res+= node.init[-1]
-            else:
-                res += node.init[-1]._value
+    def visit(self, node):
+        self.parameter = [node.sender, node.root, node.target]
+        # The parameters stay globals, an assignment changes them like before.
+        body = [pyast.Global(names=self.parameter, **position)]+self.statements(node.statements)
+        call = pyast.Expr(pyast.Call(name('__decorator__'), [], [], **position), **position)
+        self.module = pyast.Module(body=[function('__decorator__', body), call], type_ignores=[])
+        try:
+            self.bytecode = compile(self.module, filename='<decorator '+node.name+'>', mode='exec')
+        except (SyntaxError, ValueError) as e:
+            raise DecoratorError('decorator '+node.name+': '+str(e))
+
+    def temporary(self, prefix):
+        self.counter += 1
+        return prefix+str(self.counter)
+
+    def statements(self, values):
+        if values == None:
+            return []
+        result = []
+        for value in (values if isinstance(values, list) else [values]):
+            result += self.statement(value)
+        return result
+
+    def block(self, values):
+        return self.statements(values) or [pyast.Pass(**position)]
+
+    def branch(self, value):
+        if isinstance(value, Tree) and value.data == 'block_value':
+            return self.block(value.children)
+        return self.block(value)
+
+    def handler(self, table, prefix, value):
+        key = value.data if isinstance(value, Tree) else value.__class__
+        if not key in table:
+            table[key] = getattr(PreProcessor, prefix+kindName(value), None)
+        return table[key]
+
+    def statement(self, value):
+        handler = self.handler(statementHandlers, 'statement', value)
+        if handler != None:
+            return handler(self, value)
+        return [pyast.Expr(self.expression(value), **position)]
+
+    def expression(self, value):
+        handler = self.handler(expressionHandlers, 'expression', value)
+        if handler == None:
+            raise DecoratorError(kindName(value)+' is not supported in a decorator expression')
+        return handler(self, value)
+
+    def target(self, value):
+        result = self.expression(value)
+        if not isinstance(result, (pyast.Name, pyast.Attribute, pyast.Subscript)):
+            raise DecoratorError(kindName(value)+' can\'t be assigned in a decorator')
+        result.ctx = pyast.Store()
+        return result
+
+    def statementVariable(self, node):
+        value = self.expression(node.init) if node.init != None else pyast.Constant(None, **position)
+        return [pyast.Assign([name(node.name, True)], value, **position)]
+
+    def statementReturn(self, node):
+        return [pyast.Return(self.expression(node.value) if node.value != None else None, **position)]
+
+    def statementIfStmt(self, node):
+        return [pyast.If(self.expression(node.condition), self.block(node.then_), self.statements(node.else_), **position)]
+
+    def statementForStmt(self, node):
+        return [pyast.For(name(node.entry, True), self.expression(node.iterable), self.block(node.do), [], **position)]
+
+    def statementBinopExpr(self, node):
+        op = str(node.operation)
+        if op == '=':
+            return [pyast.Assign([self.target(node.left)], self.expression(node.right), **position)]
+        if op[-1] == '=' and op[:-1] in binaryOperators:
+            return [pyast.AugAssign(self.target(node.left), binaryOperators[op[:-1]](), self.expression(node.right), **position)]
+        return [pyast.Expr(self.expression(node), **position)]
+
+    def statementConditionalExpr(self, tree):
+        condition, then_, else_ = tree.children
+        return [pyast.If(self.expression(condition), self.branch(then_), self.branch(else_) if else_ != None else [], **position)]
+
+    def statementArithmeticExpr(self, tree):
+        # The parser drops the operators, the value isn't used, only the operands are evaluated.
+        return self.statements(tree.children)
+
+    def statementLambda(self, tree):
+        # A lambda statement has no effect, the grammar has no lambda values.
+        return []
+
+    def statementMatch(self, node):
+        input_ = node.input_alias or self.temporary('__match')
+        result = self.branch(node.fallbackResult) if node.fallbackResult != None else []
+        for case in reversed(node.cases or []):
+            test = pyast.Compare(name(input_), [pyast.Eq()], [self.caseValue(case.value)], **position)
+            result = [pyast.If(test, self.branch(case.result), result, **position)]
+        return [pyast.Assign([name(input_, True)], self.expression(node.input), **position)]+result
+
+    def statementSwitch(self, tree):
+        # A case falls through to the next one unless it breaks, the default comes last.
+        input_ = self.temporary('__switch')
+        matched = self.temporary('__matched')
+        cases = [c for c in tree.children[1:] if isinstance(c, Tree) and c.data == 'switch_case']
+        default = tree.children[-1] if len(tree.children) > 1 and not tree.children[-1] in cases else None
+        body = []
+        for case in cases:
+            value, result, break_ = case.children
+            test = pyast.BoolOp(pyast.Or(), [name(matched), pyast.Compare(name(input_), [pyast.Eq()], [self.caseValue(value)], **position)], **position)
+            then_ = [pyast.Assign([name(matched, True)], pyast.Constant(True, **position), **position)]+self.statement(result)
+            if break_ != None:
+                then_.append(pyast.Break(**position))
+            body.append(pyast.If(test, then_, [], **position))
+        body += self.statements(default)
+        body.append(pyast.Break(**position))
+        return [pyast.Assign([name(input_, True)], self.expression(tree.children[0]), **position),
+                pyast.Assign([name(matched, True)], pyast.Constant(False, **position), **position),
+                pyast.While(pyast.Constant(True, **position), body, [], **position)]
+
+    def caseValue(self, value):
+        # A name of a match case is compared like a variable.
+        return name(value) if isinstance(value, str) else self.expression(value)
+
+    def member(self, value, member):
+        if isinstance(member, str):
+            return name(member) if value == None else pyast.Attribute(value, member, pyast.Load(), **position)
+        if isinstance(member, ScopeVar):
+            for scope in member.scopes:
+                value = self.member(value, scope)
+            return value
+        if isinstance(member, FuncCall):
+            return self.call(member, value)
+        if value == None:
+            return self.expression(member)
+        raise DecoratorError(kindName(member)+' is not supported in a decorator call chain')
+
+    def call(self, node, value = None):
+        if isinstance(node.name, str) or value != None:
+            function_ = self.member(value, node.name)
         else:
-            res += node.init._value
-        node._value = res
-
-    def Var(self, node):
-        self.debug(node)
-        res = ""
-        for e in node.members[0:-1]:
-            if isinstance(e, FuncCall):
-                res += e._value + "."
-            else:
-                res += e + "."
-        if isinstance(node.members[-1], FuncCall):
-            res += node.members[-1]._value
-        else:
-            res += node.members[-1]
-        node._value = res
-        
-    def BinopExpr(self, node):
-        self.debug(node)
-        node._value = node.left._value + " " + node.operation + " " + node.right._value
-
-    def ForStmt(self, node):
-        self.debug(node)
-        res = "for "+node.entry+" in "+node.iterable._value+":\n"
-        lines = node.do._value.split("\n")
-        for l in lines:
-            res += "  "+l+"\n"
-        node._value = res
-
-    def IfStmt(self, node):
-        self.debug(node)
-        res =  "if "+node.condition._value+":\n"
-        if isinstance(node.then_,List):
-            for e in node.then_:
-                lines = e._value.split("\n")
-                for l in lines:
-                    res += "  "+l+"\n"
-        if isinstance(node.else_, List):
-            res += "else:\n"
-            for e in node.else_:
-                lines = e._value.split("\n")
-                for l in lines:
-                    res += "  "+l+"\n"
-        node._value = res
+            function_ = self.expression(node.name)
+        args = node.arguments if node.arguments != None else []
+        args = args if isinstance(args, list) else [args]
+        return pyast.Call(function_, [self.expression(a) for a in args], [], **position)
+
+    def expressionVar(self, node):
+        value = None
+        for member in node.members:
+            value = self.member(value, member)
+        return value
+
+    def expressionScopeVar(self, node):
+        return self.member(None, node)
+
+    def expressionFuncCall(self, node):
+        return self.call(node)
+
+    def expressionStringLiteral(self, node):
+        # The literal keeps the escape sequences of the source.
+        if not '\\' in node.value:
+            return pyast.Constant(node.value, **position)
+        try:
+            return pyast.Constant(pyast.literal_eval('"'+node.value+'"'), **position)
+        except (SyntaxError, ValueError):
+            return pyast.Constant(node.value, **position)
+
+    def expressionNumericLiteral(self, node):
+        return pyast.Constant(node.value, **position)
+
+    def expressionUnaryExpr(self, node):
+        return pyast.UnaryOp(unaryOperators[str(node.operation)](), self.expression(node.object_), **position)
+
+    def expressionCast(self, node):
+        # The decorator works on python objects, a cast doesn't change them.
+        return self.expression(node.object_)
+
+    def expressionBinopExpr(self, node):
+        op = str(node.operation)
+        left = node.left
+        if op == '=':
+            if not (isinstance(left, Var) and len(left.members) == 1 and isinstance(left.members[0], str)):
+                raise DecoratorError('only a name can be assigned in a decorator expression')
+            return pyast.NamedExpr(name(left.members[0], True), self.expression(node.right), **position)
+        if op in comparisonOperators:
+            return pyast.Compare(self.expression(left), [comparisonOperators[op]()], [self.expression(node.right)], **position)
+        if op in logicalOperators:
+            return pyast.BoolOp(logicalOperators[op](), [self.expression(left), self.expression(node.right)], **position)
+        if op in binaryOperators:
+            return pyast.BinOp(self.expression(left), binaryOperators[op](), self.expression(node.right), **position)
+        raise DecoratorError(op+' is not supported in a decorator expression')
+
+    def expressionPostfixExpr(self, node):
+        return pyast.Subscript(self.expression(node.object_), self.expression(node.parameter), pyast.Load(), **position)
+
+    def expressionArraySubscript(self, tree):
+        return pyast.Subscript(self.expression(tree.children[0]), self.expression(tree.children[1]), pyast.Load(), **position)
+
+    def expressionConditionalExpr(self, tree):
+        condition, then_, else_ = tree.children
+        else_ = self.expression(else_) if else_ != None else pyast.Constant(None, **position)
+        return pyast.IfExp(self.expression(condition), self.expression(then_), else_, **position)
+
+    def expressionMatch(self, node):
+        input_ = node.input_alias or self.temporary('__match')
+        result = self.expression(node.fallbackResult) if node.fallbackResult != None else pyast.Constant(None, **position)
+        for case in reversed(node.cases or []):
+            test = pyast.Compare(name(input_), [pyast.Eq()], [self.caseValue(case.value)], **position)
+            result = pyast.IfExp(test, self.expression(case.result), result, **position)
+        # The input is evaluated once, before the cases.
+        pair = pyast.Tuple([pyast.NamedExpr(name(input_, True), self.expression(node.input), **position), result], pyast.Load(), **position)
+        return pyast.Subscript(pair, pyast.Constant(1, **position), pyast.Load(), **position)
 
 class NodeFactory():
+    def __init__(self, index = None):
+        self.index = index
+    def created(self, node):
+        return self.index.created(node) if self.index != None else node
     def Variable(self, name, type = None, init = None):
-        return Variable(type,name, init)
+        return self.created(Variable([], None, type, name, init))
     def Type(self,name, *decorations):
-        return Type(list(decorations), name)
+        return self.created(Type(list(decorations), name))
     def Decoration(self, key, value = None):
-        return Decoration(key, value)
+        return self.created(Decoration(key, value))
     def FunctionDeclaration(self, name, parameters = [], returnType = None, decorations = []):
-        return FunctionDeclaration(decorations, name, parameters, returnType)
+        return self.created(FunctionDeclaration(decorations, name, parameters, returnType))
     def FunctionDefinition(self, name, parameters = [], returnType = None, decorations = [], statements = []):
-        return FunctionDefinition(decorations, name, parameters, returnType, statements)
+        return self.created(FunctionDefinition(decorations, name, parameters, returnType, statements))
     def FunctionCall(self, name, *parameter):
-        return FuncCall(name, list(parameter))
+        return self.created(FuncCall(name, list(parameter)))
     def StringLiteral(self, value):
-        return StringLiteral(value)
+        return self.created(StringLiteral(value))
     def BinaryOperation(self, left, op, right):
-        return BinopExpr(left, op, right)
+        return self.created(BinopExpr(left, op, right))
     def Var(self, *names):
-        return Var(list(names))
+        return self.created(Var(list(names)))
+
+def encodeFields(value):
+    # The elements of a list are encoded one by one, they can be compared with the elements of another version of the list.
+    if isinstance(value, list):
+        return [encodeTree(e) for e in value]
+    return encodeTree(value)
+
+def decodeFields(value):
+    if isinstance(value, list):
+        return [decodeTree(*e) for e in value]
+    return decodeTree(*value)
+
+def location(node):
+    # Nodes have no source position, the decorated node is named instead.
+    name = getattr(node, 'name', None)
+    return node.__class__.__name__+(' '+name if isinstance(name, str) else '')
 
 class Decorator():
-    def __init__(self,tree,root):
+    def __init__(self,tree,root,key = None,name = None):
         self.tree = tree
         self.root = root
+        self.key = key
+        self.name = tree.name if tree != None else name
         self.generatedCode = None
         self.parameter = {}
+        self.deterministic = False
         self.interpret()
 
-    def evaluate(self, decoratedNode, decoration):
-        if self.generatedCode != None:
-            param = {"ASTFactory":NodeFactory(),self.parameter[0]:decoration,self.parameter[2]:decoratedNode,self.parameter[1]:self.root}
+    def execute(self, decoratedNode, decoration, index = None):
+        param = {"ASTFactory":NodeFactory(index),"ASTQuery":index,self.parameter[0]:decoration,self.parameter[2]:decoratedNode,self.parameter[1]:self.root}
+        try:
             exec(self.generatedCode,param)
+        except DecoratorError:
+            raise
+        except Exception as e:
+            # The code of the decorator fails, only this unit fails.
+            raise DecoratorError('decorator '+str(self.name)+' at '+location(decoratedNode)+': '+type(e).__name__+': '+str(e)) from e
+
+    def evaluate(self, decoratedNode, decoration, expansions = None, index = None):
+        if self.generatedCode == None:
+            return
+        if not self.deterministic or expansions == None:
+            self.execute(decoratedNode, decoration, index)
+            return
+        names = nodeFields(decoratedNode.__class__)
+        before = [encodeFields(getattr(decoratedNode, name)) for name in names]
+        key = digest((self.key, encodeTree(decoration), decoratedNode.__class__.__name__, before))
+        changes = expansions.get(key)
+        if changes != None:
+            self.replay(decoratedNode, changes)
+            return
+        self.execute(decoratedNode, decoration, index)
+        changes = []
+        for name, previous in zip(names, before):
+            current = encodeFields(getattr(decoratedNode, name))
+            if current == previous:
+                continue
+            # Lists keep their unchanged head, only the new tail is stored.
+            if isinstance(previous, list) and isinstance(current, list):
+                prefix = 0
+                while prefix < min(len(previous), len(current)) and previous[prefix] == current[prefix]:
+                    prefix += 1
+                changes.append((name, prefix, current[prefix:]))
+            else:
+                changes.append((name, -1, current))
+        expansions.put(key, tuple(changes))
+
+    def replay(self, decoratedNode, changes):
+        for name, prefix, value in changes:
+            if prefix < 0:
+                value = decodeFields(value)
+                setattr(decoratedNode, name, value)
+                value = value if isinstance(value, list) else [value]
+            else:
+                value = [decodeTree(*e) for e in value]
+                getattr(decoratedNode, name)[prefix:] = value
+            for e in value:
+                if isinstance(e, AstNode):
+                    PrepareProcessing().visit_top_down(e, decoratedNode)
 
     def interpret(self):
-        preProccessor = PreProcessor()
-        preProccessor.visit(self.tree)        
-        self.generatedCode = preProccessor.bytecode
-        self.parameter=preProccessor.parameter
+        # A decorator is only translated and compiled once, an imported decorator only exists in the registry.
+        if self.key == None:
+            self.key = registry.key(self.tree)
+        entry = registry.load(self.key)
+        if entry == None and self.tree != None:
+            preProccessor = PreProcessor()
+            preProccessor.visit(self.tree)
+            deterministic = self.tree.decorations != None and any(e.key == 'deterministic' for e in self.tree.decorations)
+            registry.store(self.key, preProccessor.parameter, preProccessor.bytecode, deterministic)
+            entry = preProccessor.parameter, preProccessor.bytecode, deterministic
+        if entry != None:
+            self.parameter, self.generatedCode, self.deterministic = entry
 
 class Decorate(NodeVisitor):
-    def __init__(self,root):
+    def __init__(self,root,index = None,unit = None):
         self._decorators = dict()
+        self._imported = dict()
         self.root = root
+        # Built by PrepareProcessing, otherwise by the first decorator.
+        self.index = index
+        self.imports = []
+        self.expansions = None
+        self.module = None
+        if isinstance(root, Unit):
+            # The units which use this one find its decorators by the file name.
+            self.module = unitModule(unit) if unit != None else root.package
+            self.expansions = ExpansionCache(self.module)
+            if root.imports != None:
+                self.imports = [e.value for e in root.imports if isinstance(e, StringLiteral)]
+
+    def decorator(self, key):
+        if key in self._decorators:
+            return self._decorators[key]
+        if not key in self._imported:
+            registryKey = registry.find(self.imports, key)
+            self._imported[key] = Decorator(None, self.root, registryKey, key) if registryKey != None else None
+        return self._imported[key]
 
     def AstDecorator(self, node):
         self._decorators[node.name] = Decorator(node, self.root)
 
     def Decoration(self, node):
-        if node.key in self._decorators.keys():
-            self._decorators[node.key].evaluate(node._parent, node)
+        decorator = self.decorator(node.key)
+        if decorator != None:
+            decoratedNode = node._parent
+            decorator.evaluate(decoratedNode, node, self.expansions, self.query())
+            self.index.update(decoratedNode)
+
+    def query(self):
+        if self.index == None:
+            self.index = AstIndex(self.root)
+            self.index.addTree(self.root, getattr(self.root, '_parent', None))
+        return self.index
+
+    def Unit(self, node):
+        # The unit is left last, all of its decorators are known.
+        if len(self._decorators) > 0 or len(registry.exported(self.module)) > 0:
+            registry.publish(self.module, {name: d.key for name, d in self._decorators.items()})
+        self.expansions.save()
+        return True
 
 class GenerateIR(NodeVisitor):
     def __init__(self):
         self.generator = IRModule()
         self.IR = None
+        # Removed operations of the peephole optimizer, None with GC_PEEPHOLE=off.
+        self.removed = None
         self.counter = 0
-        self.sCounter = 0
         self.scopeParameter = []
 
     def debug(self, node):
@@ -196,6 +483,13 @@ class GenerateIR(NodeVisitor):
         if node.statements != None:
             for e in node.statements:
                 e.accept(self)
+        if nilang_optimizer.enabled():
+            optimizer = nilang_optimizer.PeepholeOptimizer(self.generator)
+            args = {}
+            with stage('Peephole', args = args):
+                args['removed'] = optimizer.optimize()
+                args.update(optimizer.removed)
+            self.removed = optimizer.removed
         self.IR = self.generator.generate()
         return False
 
@@ -223,10 +517,11 @@ class GenerateIR(NodeVisitor):
             for arg in node.parameters:
                 parameter.append(arg.name)
         self.scopeParameter.append(parameter)
-        self.generator.emit(bc['Label'],labelIndex)
+        self.generator.emitLabel(labelIndex)
         for e in node.statements:
             e.accept(self)
         self.generator.emit(bc['Return'])
+        self.generator.finishFunction()
         self.scopeParameter.pop()
 
     def TypeDecl(self, node):
@@ -243,6 +538,34 @@ class GenerateIR(NodeVisitor):
 
     def NumericLiteral(self, node):
         self.debug(node)
+        self.pushLiteral(node.value)
+
+    def pushLiteral(self, value):
+        # Small unsigned integers are operands, other values are typed literal constants.
+        if isinstance(value, int) and 0 <= value < pow(2,32):
+            if value == 0:
+                self.generator.emit(bc['PushZero'])
+            elif value == 1:
+                self.generator.emit(bc['PushOne'])
+            elif value < 256:
+                self.generator.emit(bc['PushU8'],value)
+            elif value < pow(2,16):
+                self.generator.emit(bc['PushU16'],value)
+            else:
+                self.generator.emit(bc['PushU32'],value)
+            return
+        if isinstance(value, float):
+            type_ = self.generator.types['f64']['id']
+        elif -pow(2,31) <= value < 0:
+            type_ = self.generator.types['i32']['id']
+        elif -pow(2,63) <= value < pow(2,63):
+            type_ = self.generator.types['i64']['id']
+        elif 0 <= value < pow(2,64):
+            type_ = self.generator.types['u64']['id']
+        else:
+            raise CompileError('The literal '+str(value)+' doesn\'t fit into 64 bits')
+        constIndex = self.generator.addLiteral(type_, value)
+        self.generator.emitAll(((bc['PushU8'], constIndex), (bc['ResolveAddrOfConstIndex'],)))
 
     def Param(self, node):
         self.debug(node)
@@ -274,13 +597,11 @@ class GenerateIR(NodeVisitor):
         self.debug(node)
         #print(node)
         # Register all string literals as global constants and use the addr instead of the value.
+        strlit = self.generator.types['strlit']['id']
         if node.arguments != None:
             for arg in node.arguments:
                 if isinstance(arg, StringLiteral):
-                    constIndex = self.generator.getConstIndex(arg.value)
-                    if constIndex == None:
-                        self.generator.addConstant('__s'+str(self.sCounter),self.generator.types['strlit']['id'],arg.value)
-                    self.sCounter += 1
+                    self.generator.addLiteral(strlit, arg.value)
 
         isAnImportFunction = False
         index = None
@@ -293,8 +614,7 @@ class GenerateIR(NodeVisitor):
 
         # If the function is an import then get the function addr.
         if isAnImportFunction:
-            self.generator.emit(bc['PushU8'],index)
-            self.generator.emit(bc['ResolveAddrOfImportIndex'])            
+            self.generator.emitAll(((bc['PushU8'], index), (bc['ResolveAddrOfImportIndex'],)))
         # Else get the label of the function.
         else:
             pass
@@ -305,31 +625,16 @@ class GenerateIR(NodeVisitor):
                 if isinstance(arg, Var):
                     constIndex = self.generator.getConstnameIndex(arg.members[0])
                     if constIndex != None:
-                        self.generator.emit(bc['PushU8'], constIndex)
-                        self.generator.emit(bc['ResolveAddrOfConstIndex'])
+                        self.generator.emitAll(((bc['PushU8'], constIndex), (bc['ResolveAddrOfConstIndex'],)))
                     for i,v in enumerate(self.scopeParameter[-1]): 
                         if v == arg.members[0]:
                             self.generator.emit(bc['Copy'],28-i)
                             break
                 elif isinstance(arg, StringLiteral):                
-                    constIndex = self.generator.getConstIndex(arg.value)
-                    self.generator.emit(bc['PushU8'], constIndex)
-                    self.generator.emit(bc['ResolveAddrOfConstIndex'])
+                    constIndex = self.generator.addLiteral(strlit, arg.value)
+                    self.generator.emitAll(((bc['PushU8'], constIndex), (bc['ResolveAddrOfConstIndex'],)))
                 elif isinstance(arg, NumericLiteral):
-                    if arg.value == 0:
-                        self.generator.emit(bc['PushZero'])
-                    elif arg.value == 1:
-                        self.generator.emit(bc['PushOne'])
-                    elif arg.value < 256:
-                        self.generator.emit(bc['PushU8'],arg.value)
-                    elif arg.value < pow(2,16):
-                        self.generator.emit(bc['PushU16'],arg.value)
-                    elif arg.value < pow(2,32):
-                        self.generator.emit(bc['PushU32'],arg.value)
-                    else:
-                        constIndex = self.generator.getConstIndex(arg.value)
-                        self.generator.emit(bc['PushU8'], constIndex)
-                        self.generator.emit(bc['ResolveAddrOfConstIndex'])
+                    self.pushLiteral(arg.value)
 
         argc = 0
         if node.arguments != None:
@@ -339,7 +644,7 @@ class GenerateIR(NodeVisitor):
             self.generator.emit(bc['Call'],argc)
         else:# Else invoke the internal function.
             index = self.generator.labels[name]
-            self.generator.emit(bc['Invoke'], index, argc)
+            self.generator.emitJump(bc['Invoke'], index, argc)
 
     def Variable(self, node):    
         self.debug(node)
@@ -368,8 +673,9 @@ class GenerateIR(NodeVisitor):
             if isinstance(e, str):
                 index = self.generator.getConstnameIndex(e)
                 if index != None:
-                    self.generator.emit(bc['PushU8'],index)
-                    self.generator.emit(bc['ResolveAddrOfConstIndex'])
+                    self.generator.emitAll(((bc['PushU8'], index), (bc['ResolveAddrOfConstIndex'],)))
+                elif len(self.scopeParameter) > 0 and e in self.scopeParameter[-1]:
+                    self.generator.emit(bc['Copy'],28-self.scopeParameter[-1].index(e))
 
                 #index = self.generator.getVariableIndex(e)
                 #if index != None:
@@ -388,25 +694,26 @@ class GenerateIR(NodeVisitor):
         
     def IfStmt(self, node):
         self.debug(node)
+        if not isinstance(node.condition, BinopExpr) or not str(node.condition.operation) in negatedComparisons:
+            raise CompileError('the condition of an if has to be a comparison: '+str(node.condition))
         node.condition.left.accept(self)
         node.condition.right.accept(self)
-        op = node.condition.operation
-        if op == '==':
-            self.generator.emit(bc['Equal'])
-        else_ = 'else_'+str(self.generator.code.count)
+        # JumpIf goes to the else branch, it jumps if the condition is false.
+        self.generator.emitAll(tuple((bc[name],) for name in negatedComparisons[str(node.condition.operation)]))
+        else_ = 'else_'+str(len(self.generator.code))
         elseLabelIndex = self.generator.addLabel(else_)
-        self.generator.emit(bc['JumpIf'],elseLabelIndex)
-        ifEnd_ = 'ifEnd_'+str(self.generator.code.count)
+        self.generator.emitJump(bc['JumpIf'],elseLabelIndex)
+        ifEnd_ = 'ifEnd_'+str(len(self.generator.code))
         ifEndLabelIndex = self.generator.addLabel(ifEnd_)
         if node.then_ != None:
             for e in node.then_:
                 e.accept(self)       
-            self.generator.emit(bc['Goto'],ifEndLabelIndex)
-        self.generator.emit(bc['Label'],elseLabelIndex)
+            self.generator.emitJump(bc['Goto'],ifEndLabelIndex)
+        self.generator.emitLabel(elseLabelIndex)
         if node.else_ != None:            
             for e in node.else_:
                 e.accept(self)     
-        self.generator.emit(bc['Label'],ifEndLabelIndex)
+        self.generator.emitLabel(ifEndLabelIndex)
 
     def Interface(self, node):
         self.debug(node)
@@ -456,5 +763,11 @@ class GenerateIR(NodeVisitor):
         self.generator.addStruct(node.name,[],vars, comp)
 
 class PrepareProcessing(NodeVisitor):
+    def __init__(self, index = None):
+        self.index = index
+
     def __fallback__(self, node, parent):
-        node._parent = parent
\ No newline at end of file
+        node._parent = parent
+        if self.index != None:
+            self.index.add(node, parent)
+        return True
\ No newline at end of file
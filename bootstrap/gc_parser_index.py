@@ -0,0 +1,140 @@
+from gc_parser_nodes import Decoration, pushChildren
+
+# Index of the AST for the decorators, ASTQuery in the decorator code.
+# Lookup by node type, name, decoration key and parent without walking the tree.
+# PrepareProcessing builds it together with the parents. After every decorator
+# Decorate refreshes the decorated node, nodes of the NodeFactory which were
+# inserted somewhere else are found at the unit level or by a rebuild.
+# Results are in the order the nodes were indexed.
+
+class AstIndex:
+    def __init__(self, root = None):
+        self.root = root
+        # id of a node: node, indexed parent, name and decoration key.
+        self.nodes = {}
+        self.types = {}
+        self.names = {}
+        self.decorations = {}
+        self.children = {}
+        # Nodes of the NodeFactory which aren't indexed yet.
+        self.pending = []
+        self.rebuilds = 0
+
+    def add(self, node, parent):
+        key = id(node)
+        # A node a decorator moved or shared keeps only its last parent.
+        if key in self.nodes:
+            self.remove(node)
+        name = getattr(node, 'name', None)
+        name = name if isinstance(name, str) else None
+        decoration = node.key if isinstance(node, Decoration) else None
+        self.nodes[key] = (node, parent, name, decoration)
+        self.types.setdefault(node.__class__.__name__, {})[key] = node
+        if name != None:
+            self.names.setdefault(name, {})[key] = node
+        if decoration != None:
+            self.decorations.setdefault(decoration, {})[key] = node
+        if parent != None:
+            self.children.setdefault(id(parent), {})[key] = node
+
+    def addTree(self, node, parent):
+        stack = [(node, parent)]
+        while len(stack) > 0:
+            current, currentParent = stack.pop()
+            current._parent = currentParent
+            self.add(current, currentParent)
+            pushChildren(stack, current, current)
+
+    def remove(self, node):
+        # Removes the node and everything indexed below it.
+        stack = [node]
+        while len(stack) > 0:
+            current = stack.pop()
+            key = id(current)
+            entry = self.nodes.pop(key, None)
+            if entry == None:
+                continue
+            current, parent, name, decoration = entry
+            self.types[current.__class__.__name__].pop(key, None)
+            if name != None:
+                self.names[name].pop(key, None)
+            if decoration != None:
+                self.decorations[decoration].pop(key, None)
+            if parent != None:
+                self.children.get(id(parent), {}).pop(key, None)
+            stack += self.children.pop(key, {}).values()
+
+    def refresh(self, node):
+        entry = self.nodes.get(id(node))
+        parent = entry[1] if entry != None else getattr(node, '_parent', None)
+        self.remove(node)
+        self.addTree(node, parent)
+
+    def refreshChildren(self, node):
+        current = []
+        pushChildren(current, node, node)
+        for child, parent in current:
+            entry = self.nodes.get(id(child))
+            if entry == None or entry[1] is not node:
+                self.refresh(child) if entry != None else self.addTree(child, node)
+        keys = set(id(child) for child, parent in current)
+        for child in [c for k, c in self.children.get(id(node), {}).items() if not k in keys]:
+            self.remove(child)
+
+    def created(self, node):
+        self.pending.append(node)
+        return node
+
+    def update(self, node):
+        # The decorator changed node, the nodes it created may be anywhere.
+        self.refresh(node)
+        self.pending = [n for n in self.pending if not id(n) in self.nodes]
+        if len(self.pending) == 0 or self.root == None:
+            self.pending = []
+            return
+        self.refreshChildren(self.root)
+        self.pending = [n for n in self.pending if not id(n) in self.nodes]
+        if len(self.pending) > 0:
+            self.rebuilds += 1
+            self.refresh(self.root)
+            # The remaining nodes were never inserted.
+            self.pending = []
+
+    def decorated(self, key):
+        result = {}
+        for decoration in self.decorations.get(key, {}).values():
+            parent = self.nodes[id(decoration)][1]
+            if parent != None:
+                result[id(parent)] = parent
+        return result
+
+    def find(self, typeName = None, name = None, decoration = None, parent = None):
+        candidates = []
+        if typeName != None:
+            candidates.append(self.types.get(typeName, {}))
+        if name != None:
+            candidates.append(self.names.get(name, {}))
+        if decoration != None:
+            candidates.append(self.decorated(decoration))
+        if parent != None:
+            candidates.append(self.children.get(id(parent), {}))
+        if len(candidates) == 0:
+            return [entry[0] for entry in self.nodes.values()]
+        candidates.sort(key=len)
+        return [node for key, node in candidates[0].items() if all(key in c for c in candidates[1:])]
+
+    def byType(self, typeName):
+        return self.find(typeName)
+
+    def byName(self, name, typeName = None):
+        return self.find(typeName, name)
+
+    def byDecoration(self, key, typeName = None):
+        return self.find(typeName, None, key)
+
+    def byParent(self, node, typeName = None):
+        return self.find(typeName, None, None, node)
+
+    def parent(self, node):
+        entry = self.nodes.get(id(node))
+        return entry[1] if entry != None else None
@@ -1,68 +1,122 @@
 import sys
+import inspect
+from types import SimpleNamespace
 from typing import Iterable, List
 from lark import Transformer, ast_utils, v_args, Tree
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 
 from lark.lexer import Token
 from lark.visitors import Interpreter
 
 this_module = sys.modules[__name__]
 
+# Child fields of every node class, in declaration order.
+childFields = {}
+# Handler of every node class for every visitor class.
+dispatchTables = {}
+
+def nodeFields(cls):
+    result = childFields.get(cls)
+    if result == None:
+        result = childFields[cls] = tuple(f.name for f in fields(cls))
+    return result
+
+def pushChildren(stack, node, tag):
+    # Pushes the children in reverse order, they are popped in declaration order.
+    for name in reversed(nodeFields(node.__class__)):
+        member = getattr(node, name)
+        if isinstance(member, list):
+            for e in reversed(member):
+                if isinstance(e, AstNode):
+                    stack.append((e, tag))
+        elif isinstance(member, AstNode):
+            stack.append((member, tag))
+
+# The walks use an explicit stack, deep expressions don't hit the recursion limit.
+# Nodes which a handler inserts into an already expanded node are not visited by the same walk.
 class NodeVisitor:
+    def dispatch(self, node):
+        table = dispatchTables.get(self.__class__)
+        if table == None:
+            table = dispatchTables[self.__class__] = {}
+        handler = table.get(node.__class__)
+        if handler == None:
+            handler = table[node.__class__] = getattr(self.__class__, node.__class__.__name__, self.__class__.__fallback__)
+        return handler
+
+    # Children first, then the node.
     def visit(self, node):
-        if issubclass(node.__class__,AstNode):
-            members = [a for a in dir(node) if not a.startswith('_') and not callable(getattr(node, a))]
-            for m in members:
-                member = getattr(node,m)
-                if isinstance(member,List):
-                    for e in member:
-                        self.visit(e)
-                else:
-                    self.visit(member)
-            node.accept(self)
+        if not isinstance(node, AstNode):
+            return node
+        stack = [(node, False)]
+        while len(stack) > 0:
+            current, expanded = stack.pop()
+            if expanded:
+                self.dispatch(current)(self, current)
+            else:
+                stack.append((current, True))
+                pushChildren(stack, current, False)
         return node
 
+    # Like visit, the result of the handler replaces the node.
     def transform(self, node):
+        if not isinstance(node, AstNode):
+            return node
+        # Pre-order with the children from right to left, reversed it's the post-order.
+        order = []
+        stack = [(node, None, None)]
+        while len(stack) > 0:
+            entry = stack.pop()
+            order.append(entry)
+            for name in nodeFields(entry[0].__class__):
+                member = getattr(entry[0], name)
+                if isinstance(member, list):
+                    for i, e in enumerate(member):
+                        if isinstance(e, AstNode):
+                            stack.append((e, member, i))
+                elif isinstance(member, AstNode):
+                    stack.append((member, entry[0], name))
         result = node
-        if issubclass(node.__class__,AstNode):
-            members = [a for a in dir(node) if not a.startswith('_') and not callable(getattr(node, a))]
-            for m in members:
-                member = getattr(node,m)
-                if isinstance(member,List):
-                    for e in member:
-                        e = self.transform(e)
-                else:
-                    setattr(node,m, self.transform(member))
-            result = node.transform(self)
+        for current, container, key in reversed(order):
+            result = self.dispatch(current)(self, current)
+            if result is not current:
+                if isinstance(container, list):
+                    container[key] = result
+                elif container != None:
+                    setattr(container, key, result)
         return result
 
-    
+    # The node first, its children are visited if the handler returns True.
     def visit_top_down(self, node, parent = None):
-        if issubclass(node.__class__,AstNode):
-            if node.accept_top_down(self,parent):
-                members = [a for a in dir(node) if not a.startswith('_') and not callable(getattr(node, a))]
-                for m in members:
-                    member = getattr(node,m)
-                    if isinstance(member,List):
-                        for e in member:
-                            self.visit_top_down(e,node)
-                    else:
-                        self.visit_top_down(member,node)            
+        if not isinstance(node, AstNode):
+            return node
+        stack = [(node, parent)]
+        while len(stack) > 0:
+            current, currentParent = stack.pop()
+            if self.dispatch(current)(self, current, currentParent):
+                pushChildren(stack, current, current)
         return node
 
     def __fallback__(self, node, parent = None):
         return True
 
+# The nodes are slotted dataclasses, they don't have an instance __dict__.
+# The passes can only attach the parent and the value of the pre-processor.
 @dataclass
-class AstNode(ast_utils.Ast):
+class AstNode:
+    __slots__ = ('_parent', '_value')
     def accept_top_down(self, NodeVisitor, Parent = None):
-        return getattr(NodeVisitor,self.__class__.__name__, NodeVisitor.__fallback__)(self, Parent)
+        return NodeVisitor.dispatch(self)(NodeVisitor, self, Parent)
     def accept(self, NodeVisitor):
-        getattr(NodeVisitor,self.__class__.__name__, NodeVisitor.__fallback__)(self)
+        NodeVisitor.dispatch(self)(NodeVisitor, self)
     def transform(self, NodeVisitor):
-        return getattr(NodeVisitor,self.__class__.__name__, NodeVisitor.__fallback__)(self)
+        return NodeVisitor.dispatch(self)(NodeVisitor, self)
 
-@dataclass
+# Marks nodes which get the children as a single list, like ast_utils.AsList.
+class AsList:
+    __slots__ = ()
+
+@dataclass(slots=True)
 class Variable(AstNode):
     decorations: object #List(Decoration)
     static: object
@@ -70,42 +124,42 @@ class Variable(AstNode):
     name: str
     init: object # None or value_stmt
 
-@dataclass
+@dataclass(slots=True)
 class Decoration(AstNode):
     key: str
     value: object #StringLiteral, NumericLiteral or None
 
-@dataclass
+@dataclass(slots=True)
 class Return(AstNode):
     value: object
 
-@dataclass
+@dataclass(slots=True)
 class StringLiteral(AstNode):
     value: str
     def __str__(self) -> str:
         return "\""+self.value+"\""
 
-@dataclass
+@dataclass(slots=True)
 class NumericLiteral(AstNode):
     value: str
     def __str__(self) -> str:
         return self.value
 
-@dataclass
+@dataclass(slots=True)
 class FunctionDeclaration(AstNode):
     decorations: object #List(Decoration)
     name: str
     parameters: object #Tree
     returnType: str
 
-@dataclass
+@dataclass(slots=True)
 class InterfaceFunction(AstNode):
     decorations: object #List(Decoration)
     name: str
     parameters: object #Tree
     returnType: str
 
-@dataclass
+@dataclass(slots=True)
 class FunctionDefinition(AstNode):
     decorations: object #List(Decoration)
     name: str
@@ -113,98 +167,99 @@ class FunctionDefinition(AstNode):
     returnType: str
     statements: object # List
 
-@dataclass
-class Var(AstNode, ast_utils.AsList):
+@dataclass(slots=True)
+class Var(AstNode, AsList):
     members: object # List
 
-@dataclass
-class ScopeVar(AstNode, ast_utils.AsList):
+@dataclass(slots=True)
+class ScopeVar(AstNode, AsList):
     scopes: object # List
 
-@dataclass
+@dataclass(slots=True)
 class Interface(AstNode):
     name: str
     functions: object # List
 
-@dataclass
+@dataclass(slots=True)
 class TypeDecl(AstNode):
     const: object # None or CONST-Token
     name: str
     template_parameter: object # List(TypeDecl)
 
-@dataclass
+@dataclass(slots=True)
 class FuncCall(AstNode):
     name: str
     arguments: object # List or var
 
-@dataclass
+@dataclass(slots=True)
 class IfStmt(AstNode):
     condition: object
     then_: object # block_stmt
     else_: object # block_stmt
 
-@dataclass
+@dataclass(slots=True)
 class ForStmt(AstNode):
     entry: str
     iterable: object
     do: object
 
-@dataclass
+@dataclass(slots=True)
 class AstDecorator(AstNode):
+    decorations: object #List(Decoration)
     name: str
     sender: str
     root: str
     target: str
     statements: object # List(small_stmt)
 
-@dataclass
+@dataclass(slots=True)
 class Unit(AstNode):
     package: str
     imports: object # List(StringLiteral or Match) or None
     statements: object #List(unit_stmt)
 
-@dataclass
+@dataclass(slots=True)
 class Include(AstNode):
     file: str
 
-@dataclass
+@dataclass(slots=True)
 class Param(AstNode):
     type_: object
     name: str
 
-@dataclass
+@dataclass(slots=True)
 class BinopExpr(AstNode):
     left: object
     operation: object
     right: object
 
-@dataclass
+@dataclass(slots=True)
 class Alias(AstNode):
     alias: str
     type_: object
 
-@dataclass
+@dataclass(slots=True)
 class UnaryExpr(AstNode):
     operation: object
     object_: object
 
-@dataclass
+@dataclass(slots=True)
 class PostfixExpr(AstNode):
     object_: object
     operation: object
     parameter: object # value_stmt
 
-@dataclass
+@dataclass(slots=True)
 class Cast(AstNode):
     toType:object
     object_:object
 
-@dataclass
+@dataclass(slots=True)
 class MatchCase(AstNode):
     value: object # value_stmt
     result: object # value_stmt or block_value
 
-@dataclass
+@dataclass(slots=True)
 class Match(AstNode):
     input: object # value_stmt
     input_alias: str
@@ -212,19 +267,19 @@ class Match(AstNode):
     cases: object # List(MatchCase)
     fallbackResult: object # None, value_stmt or block_value
 
-@dataclass
+@dataclass(slots=True)
 class Enum(AstNode):
     name: str
     values: object # List(str)
 
-@dataclass
+@dataclass(slots=True)
 class Struct_(AstNode):
     decoration: object # List(decoation)
     name: str
     template_parameter: object
     body: object
 
-@dataclass
+@dataclass(slots=True)
 class Compose(AstNode):
     typename: str
 
@@ -274,6 +329,15 @@ class TranformToNodes(Transformer):
     def AUTO(self, s):
         return str(s)
 
+def nodeFactory(node):
+    # ast_utils.create_transformer only collects subclasses of ast_utils.Ast, which
+    # has no __slots__ and would give every node a __dict__. The rule is a subclass
+    # of Ast which creates the slotted node instead of an instance of itself.
+    bases = (ast_utils.Ast, ast_utils.AsList) if issubclass(node, AsList) else (ast_utils.Ast,)
+    return type(node.__name__, bases, {'__new__': lambda cls, *children: node(*children)})
+
+nodeFactories = SimpleNamespace(**{name: nodeFactory(obj) for name, obj in inspect.getmembers(this_module) if inspect.isclass(obj) and issubclass(obj, AstNode)})
+transformer = ast_utils.create_transformer(nodeFactories, TranformToNodes())
+
 def TokensToNodes(tree):
-    transformer = ast_utils.create_transformer(this_module, TranformToNodes())
     return transformer.transform(tree)
\ No newline at end of file
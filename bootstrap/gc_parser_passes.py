@@ -0,0 +1,159 @@
+import time
+from gc_parser_nodes import AstNode, AstDecorator, StringLiteral, Unit, nodeFields
+from gc_parser_decorator import PrepareProcessing, Decorate, GenerateIR
+from gc_parser_postprocessor import PostProcessor
+from gc_decorator_registry import registry
+from gc_parser_index import AstIndex
+from gc_trace import stage
+
+# Pass manager of the middle-end, consecutive passes share one walk of the AST
+# unless a pass needs a walk of its own.
+# top_down passes run when a node is entered and always descend, visit and
+# transform passes run when the node is left. The result of a transform pass
+# replaces the node, the top_down passes of the same walk see the replacement.
+
+class Pass:
+    def __init__(self, name, create, walk, alone = False):
+        self.name = name
+        self.create = create
+        self.walk = walk
+        # True or a function of the AST, the pass needs the complete result of
+        # the previous passes and the next passes need its complete result.
+        self.alone = alone
+
+    def isAlone(self, ast):
+        return self.alone(ast) if callable(self.alone) else self.alone
+
+def definesDecorators(ast):
+    # Decorators can read and change any part of the AST.
+    return isinstance(ast, Unit) and ast.statements != None and any(isinstance(e, AstDecorator) for e in ast.statements)
+
+def importsDecorators(ast):
+    return isinstance(ast, Unit) and ast.imports != None and any(len(registry.exported(e.value)) > 0 for e in ast.imports if isinstance(e, StringLiteral))
+
+def usesDecorators(ast):
+    return definesDecorators(ast) or importsDecorators(ast)
+
+def indexed(visitors, ast):
+    # The index of the PrepareProcessing which ran on ast, None if it didn't build one.
+    prepare = visitors.get('PrepareProcessing')
+    if prepare == None or prepare.index == None or prepare.index.root is not ast:
+        return None
+    return prepare.index
+
+# create gets the AST, the visitors of the passes which already ran and the unit file.
+passes = [
+    # Only the decorators query the index.
+    Pass('PrepareProcessing', lambda ast, visitors, unit: PrepareProcessing(AstIndex(ast) if usesDecorators(ast) else None), 'top_down'),
+    Pass('Decorate', lambda ast, visitors, unit: Decorate(ast, indexed(visitors, ast), unit), 'visit', usesDecorators),
+    Pass('PostProcessor', lambda ast, visitors, unit: PostProcessor(), 'transform'),
+    # GenerateIR walks the unit itself.
+    Pass('GenerateIR', lambda ast, visitors, unit: GenerateIR(), 'top_down', True),
+]
+
+class PassManager:
+    def __init__(self, unit = None):
+        self.unit = unit
+        self.passes = {p.name: p for p in passes}
+        self.visitors = {}
+        self.times = {}
+        self.walks = 0
+        self.runs = 0
+
+    def groups(self, ast, names):
+        result = []
+        for name in names:
+            p = self.passes[name]
+            if p.isAlone(ast) or len(result) == 0 or self.passes[result[-1][-1]].isAlone(ast):
+                result.append([name])
+            else:
+                result[-1].append(name)
+        return result
+
+    def run(self, ast, names):
+        for group in self.groups(ast, names):
+            args = {}
+            with stage('+'.join(group), self.unit, args = args):
+                for name in group:
+                    self.visitors[name] = self.passes[name].create(ast, self.visitors, self.unit)
+                    self.times.setdefault(name, 0)
+                if len(group) == 1:
+                    ast = self.walk(ast, group[0])
+                else:
+                    ast = self.fusedWalk(ast, group)
+                for name in group:
+                    args[name+'_ms'] = self.times[name]*1000
+                args['passes'] = len(group)
+                args['walks_saved'] = len(group)-1
+            self.walks += 1
+            self.runs += len(group)
+        return ast
+
+    def saved(self):
+        return self.runs-self.walks
+
+    def counts(self):
+        return {'passes': self.runs, 'walks': self.walks, 'walks_saved': self.saved()}
+
+    def walk(self, ast, name):
+        visitor = self.visitors[name]
+        start = time.perf_counter()
+        walk = self.passes[name].walk
+        if walk == 'top_down':
+            visitor.visit_top_down(ast)
+        elif walk == 'visit':
+            visitor.visit(ast)
+        else:
+            ast = visitor.transform(ast)
+        self.times[name] += time.perf_counter()-start
+        return ast
+
+    def fusedWalk(self, ast, group):
+        pre = [(name, self.visitors[name]) for name in group if self.passes[name].walk == 'top_down']
+        post = [(name, self.visitors[name], self.passes[name].walk == 'transform') for name in group if self.passes[name].walk != 'top_down']
+        times = self.times
+        clock = time.perf_counter
+        result = ast
+        stack = [(ast, None, None, None, False)]
+        while len(stack) > 0:
+            node, container, key, parent, expanded = stack.pop()
+            if not expanded:
+                for name, visitor in pre:
+                    start = clock()
+                    visitor.dispatch(node)(visitor, node, parent)
+                    times[name] += clock()-start
+                stack.append((node, container, key, parent, True))
+                for field in reversed(nodeFields(node.__class__)):
+                    member = getattr(node, field)
+                    if isinstance(member, list):
+                        for i in range(len(member)-1, -1, -1):
+                            if isinstance(member[i], AstNode):
+                                stack.append((member[i], member, i, node, False))
+                    elif isinstance(member, AstNode):
+                        stack.append((member, node, field, node, False))
+            else:
+                current = node
+                for name, visitor, transform in post:
+                    if not isinstance(current, AstNode):
+                        break
+                    start = clock()
+                    replacement = visitor.dispatch(current)(visitor, current)
+                    if transform and replacement is not current:
+                        if isinstance(replacement, AstNode):
+                            for preName, preVisitor in pre:
+                                preVisitor.dispatch(replacement)(preVisitor, replacement, parent)
+                        current = replacement
+                    times[name] += clock()-start
+                if current is not node:
+                    if isinstance(container, list):
+                        container[key] = current
+                    elif container != None:
+                        setattr(container, key, current)
+                    else:
+                        result = current
+        return result
+
+    def report(self):
+        for name in self.times:
+            print('  %-32s %8.2f ms' % (name, self.times[name]*1000))
+        print('%d passes in %d walks, %d walks saved' % (self.runs, self.walks, self.saved()))
@@ -1,35 +1,243 @@
+import math
+import struct
 from ast import Num
 from gc_parser_decorator import PreProcessor
 from gc_parser_nodes import *
+from nilang_ir import types
+
+# Constant expressions are folded exactly, like untyped constants, and get the
+# fixed-width semantic of a type when they are cast or assigned to a typed const.
+# Integer division truncates toward zero, the remainder has the sign of the dividend.
+# The count of a shift is taken modulo the bits of the type of the const or cast
+# the expression is part of, 64 bits otherwise like the widest literal the code
+# generator pushes.
+
+integerTypes = {}
+floatTypes = []
+for name in types:
+    if name[0] in 'ui' and name[1:].isdigit():
+        integerTypes[name] = (int(name[1:]), name[0] == 'i')
+    elif name[0] == 'f' and name[1:].isdigit():
+        floatTypes.append(name)
+integerTypes['uintptr'] = (64, False)
+# Floats with less precision than a python float are rounded by packing them.
+floatFormats = {'f16': struct.Struct('<e'), 'f32': struct.Struct('<f')}
+
+def convert(value, typeName):
+    # Returns the value in the representation of the type, None if the type isn't numeric.
+    if typeName == 'bool':
+        return 1 if value else 0
+    if typeName in floatFormats:
+        format = floatFormats[typeName]
+        try:
+            return format.unpack(format.pack(float(value)))[0]
+        except OverflowError:
+            return math.copysign(math.inf, value)
+    if typeName in floatTypes:
+        return float(value)
+    if typeName in integerTypes:
+        bits, signed = integerTypes[typeName]
+        value = int(value) & ((1 << bits)-1)
+        if signed and value >= 1 << (bits-1):
+            value -= 1 << bits
+        return value
+    return None
+
+def divide(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        result = abs(left)//abs(right)
+        return -result if (left < 0) != (right < 0) else result
+    return left/right
+
+def remainder(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        return left-divide(left, right)*right
+    return math.fmod(left, right)
+
+arithmetic = {
+    '+': lambda a, b: a+b,
+    '-': lambda a, b: a-b,
+    '*': lambda a, b: a*b,
+    '/': divide,
+    '%': remainder,
+}
+integerOnly = {
+    '<<': lambda a, b, bits: a << (b & (bits-1)),
+    '>>': lambda a, b, bits: a >> (b & (bits-1)),
+    '|': lambda a, b, bits: a | b,
+    '&': lambda a, b, bits: a & b,
+    '^': lambda a, b, bits: a ^ b,
+}
+comparison = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '&&': lambda a, b: bool(a) and bool(b),
+    '||': lambda a, b: bool(a) or bool(b),
+}
+
+def constantCondition(node):
+    return isinstance(node, IfStmt) and isinstance(node.condition, NumericLiteral)
+
+def removeDeadBranches(statements):
+    # Replaces the if statements with a constant condition by the taken branch, True if it did.
+    if not isinstance(statements, List) or not any(constantCondition(e) for e in statements):
+        return False
+    result = []
+    for e in statements:
+        if constantCondition(e):
+            branch = e.then_ if e.condition.value else e.else_
+            if branch != None:
+                result += branch
+        else:
+            result.append(e)
+    statements[:] = result
+    return True
 
 class PostProcessor(NodeVisitor):
+    def __init__(self):
+        # Constants of the unit and of every block of a function, a value and a type name.
+        self.constants = {}
+        self.locals = {}
+        # The ids of the nodes of every statement list of a function, see contains().
+        self.members = {}
+
     def __fallback__(self,node,parent=None):
         return node
+
+    def blocks(self, node):
+        # The statement lists around node from the innermost to the function, a
+        # function ends the search with its parameters.
+        child = node
+        parent = getattr(node, '_parent', None)
+        while parent != None and not isinstance(parent, Unit):
+            for field in nodeFields(parent.__class__):
+                member = getattr(parent, field)
+                if isinstance(member, list) and self.contains(member, child):
+                    yield member
+            if isinstance(parent, FunctionDefinition):
+                yield parent
+                return
+            child = parent
+            parent = getattr(parent, '_parent', None)
+
+    def contains(self, block, node):
+        # A list is only scanned once, the entry keeps it and its id alive.
+        entry = self.members.get(id(block))
+        if entry == None:
+            entry = (block, set(map(id, block)))
+            self.members[id(block)] = entry
+        return id(node) in entry[1]
+
+    def removeDeadBranches(self, statements):
+        if removeDeadBranches(statements):
+            self.members.pop(id(statements), None)
+
+    def lookup(self, node, name):
+        # The value and the type name of a const, None if it is unknown.
+        for block in self.blocks(node):
+            if isinstance(block, FunctionDefinition):
+                if block.parameters != None and any(p.name == name for p in block.parameters):
+                    return None
+            else:
+                scope = self.locals.get(id(block), {})
+                if name in scope:
+                    return scope[name]
+        return self.constants.get(name)
+
+    def const(self, node):
+        if isinstance(node, Var) and len(node.members) == 1 and isinstance(node.members[0], str):
+            return self.lookup(node, node.members[0])
+        return None
+
+    def value(self, node):
+        # The value of a literal or of a const with a known value, None otherwise.
+        if isinstance(node, NumericLiteral):
+            return node.value
+        const = self.const(node)
+        return const[0] if const != None else None
+
+    def bits(self, node):
+        # The bits of the integer type the value of the expression gets.
+        parent = getattr(node, '_parent', None)
+        while isinstance(parent, (BinopExpr, UnaryExpr)):
+            parent = getattr(parent, '_parent', None)
+        typeName = None
+        if isinstance(parent, Cast) and isinstance(parent.toType, TypeDecl):
+            typeName = parent.toType.name
+        elif isinstance(parent, Variable) and parent.type_ != None:
+            typeName = parent.type_.name
+        if typeName in integerTypes:
+            return integerTypes[typeName][0]
+        return 64
+
+    def Variable(self, node):
+        if node.init != None and node.type_ != None:
+            value = self.value(node.init)
+            if value != None:
+                # The initializer of a const is stored as a value of its type.
+                value = convert(value, node.type_.name)
+                if value != None:
+                    node.init = NumericLiteral(value)
+            parent = getattr(node, '_parent', None)
+            # Only a const with a known value can be propagated, other variables hide a constant.
+            const = (value, node.type_.name) if value != None and node.type_.const != None else None
+            block = next(self.blocks(node), None)
+            if isinstance(block, list):
+                self.locals.setdefault(id(block), {})[node.name] = const
+            elif isinstance(parent, Unit) and const != None:
+                self.constants[node.name] = const
+        return node
+
+    # A const stays a Var, the code generator pushes the typed constant. Its
+    # value is only used to fold the expressions it is part of.
+
+    def Cast(self, node):
+        value = self.value(node.object_)
+        if value != None and isinstance(node.toType, TypeDecl) and node.toType.template_parameter == None:
+            value = convert(value, node.toType.name)
+            if value != None:
+                return NumericLiteral(value)
+        return node
+
     def UnaryExpr(self, node):
         result = node
-        if node.operation == "-" and isinstance(node.object_, NumericLiteral):
-            result = NumericLiteral(-node.object_.value)
+        value = self.value(node.object_)
+        if value != None:
+            if node.operation == "-":
+                result = NumericLiteral(-value)
+            if node.operation == "+":
+                result = node.object_
         return result
+
     def BinopExpr(self, node):
         result = node
-        if isinstance(node.left, NumericLiteral) and isinstance(node.right,NumericLiteral):
-            if node.operation == '<<':
-                result = NumericLiteral(node.left.value << node.right.value)
-            if node.operation == '>>':
-                result = NumericLiteral(node.left.value >> node.right.value)
-            if node.operation == '-':
-                result = NumericLiteral(node.left.value - node.right.value)
-            if node.operation == '+':
-                result = NumericLiteral(node.left.value + node.right.value)
-            if node.operation == '*':
-                result = NumericLiteral(node.left.value * node.right.value)
-            if node.operation == '/':
-                result = NumericLiteral(node.left.value / node.right.value)
-            if node.operation == '%':
-                result = NumericLiteral(node.left.value % node.right.value)
-            if node.operation == '|':
-                result = NumericLiteral(node.left.value | node.right.value)
-            if node.operation == '&':
-                result = NumericLiteral(node.left.value & node.right.value)
-            #print(str(node.left.value)+node.operation+str(node.right.value)+" = "+str(result.value))
-        return result
\ No newline at end of file
+        left = self.value(node.left)
+        right = self.value(node.right)
+        if left != None and right != None:
+            op = str(node.operation)
+            if op in arithmetic:
+                if not (op in ('/','%') and right == 0):
+                    result = NumericLiteral(arithmetic[op](left, right))
+            elif op in integerOnly:
+                if isinstance(left, int) and isinstance(right, int):
+                    result = NumericLiteral(integerOnly[op](left, right, self.bits(node)))
+            elif op in comparison:
+                result = NumericLiteral(1 if comparison[op](left, right) else 0)
+            #print(str(left)+node.operation+str(right)+" = "+str(result.value))
+        return result
+
+    def IfStmt(self, node):
+        self.removeDeadBranches(node.then_)
+        self.removeDeadBranches(node.else_)
+        return node
+
+    def FunctionDefinition(self, node):
+        removeDeadBranches(node.statements)
+        # Functions don't nest, the scopes of its blocks are done.
+        self.locals = {}
+        self.members = {}
+        return node
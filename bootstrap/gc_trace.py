@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Opt-in tracing of the compiler stages, enabled by GC_TRACE=1 or "gc.py trace".
+# Allocation tracking slows the compiler down, GC_TRACE=time or "gc.py trace-time"
+# only records wall and cpu time.
+# Every process collects its events, gc.py merges them into a Chrome trace
+# which can be opened in chrome://tracing or ui.perfetto.dev.
+
+events = []
+stack = []
+
+def enabled():
+    return not os.environ.get('GC_TRACE','') in ('','0')
+
+def tracingMemory():
+    return os.environ.get('GC_TRACE','') != 'time'
+
+def enable(mode = '1'):
+    # Set in the environment so spawned workers trace as well.
+    os.environ['GC_TRACE'] = mode
+
+def timestamp():
+    return time.time_ns()/1000
+
+@contextmanager
+def stage(name, unit = None, category = 'stage', args = None):
+    # args can be filled by the caller until the stage ends.
+    if not enabled():
+        yield
+        return
+    memory = tracingMemory()
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    current, peak = tracemalloc.get_traced_memory()
+    # The peak of the enclosing stage would get lost by the reset.
+    if len(stack) > 0:
+        stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+    tracemalloc.reset_peak()
+    frame = {'memory': current, 'peak': current}
+    stack.append(frame)
+    start = timestamp()
+    wall = time.perf_counter_ns()
+    cpu = time.thread_time_ns()
+    try:
+        yield
+    finally:
+        cpu = time.thread_time_ns()-cpu
+        wall = time.perf_counter_ns()-wall
+        current, peak = tracemalloc.get_traced_memory()
+        stack.pop()
+        frame['peak'] = max(frame['peak'], peak)
+        if len(stack) > 0:
+            stack[-1]['peak'] = max(stack[-1]['peak'], frame['peak'])
+        result = {'cpu_ms': cpu/1000000}
+        if memory:
+            result['alloc_kb'] = (current-frame['memory'])/1024
+            result['peak_kb'] = (frame['peak']-frame['memory'])/1024
+        if unit != None:
+            result['unit'] = unit
+        if args != None:
+            result.update(args)
+        events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start,
+            'dur': wall/1000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': result,
+        })
+
+def takeEvents():
+    global events
+    result = events
+    events = []
+    return result
+
+def write(path, traceEvents):
+    # Name the processes, the main process is the one which writes the trace.
+    names = {os.getpid(): 'gc.py'}
+    for event in traceEvents:
+        if not event['pid'] in names:
+            names[event['pid']] = 'worker '+str(len(names))
+    metadata = []
+    for pid in names:
+        metadata.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': names[pid]}})
+    with open(path,'w') as f:
+        json.dump({'traceEvents': metadata+traceEvents, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,178 @@
+import io
+import sys
+import struct
+from nilang_ir import *
+
+# Disassembler of an IRModule, writes the listing line by line to a stream.
+# write() produces the text of IRModule.generateText(), writeCode() lists a
+# range of addresses and writeFunction() one function. With annotate every line
+# starts with its address and names the constant, import, type or jump target
+# of the operation.
+
+pushU8Operation = int(bc['PushU8'])
+initOperation = int(bc['Init'])
+invokeOperation = int(bc['Invoke'])
+jumpOperations = (int(bc['JumpIf']), int(bc['Goto']), invokeOperation)
+constantOperation = int(bc['ResolveAddrOfConstIndex'])
+importOperation = int(bc['ResolveAddrOfImportIndex'])
+# Parameters by the size of the operation, a jump starts with its target.
+parameterFormats = {2: struct.Struct('<B'), 3: struct.Struct('<H'), 5: struct.Struct('<I'), 6: struct.Struct('<IB')}
+
+class Disassembler:
+    def __init__(self, module):
+        if module.version < VERSION:
+            # The code of an older compiler is listed with the jumps of this one.
+            module.translateCode()
+        self.module = module
+        # Built on the first annotated listing.
+        self.functionLabels = None
+        self.importNames = None
+        self.constantNames = None
+
+    def write(self, stream, annotate = False):
+        self.writeTables(stream)
+        stream.write("Code:\n")
+        stream.write(str(len(self.module.code))+"bytes\n")
+        self.writeCode(stream, 0, None, annotate)
+
+    def writeTables(self, stream):
+        module = self.module
+        stream.write("Dependencies:\n")
+        for dep in module.dependencies:
+            stream.write("\t"+dep+"\n")
+        stream.write("Imports:\n")
+        for lib in module.imports:
+            stream.write("\tLibrary: "+lib+"\n")
+            for func in module.imports[lib]:
+                stream.write("\t\tFunction: "+func+"\n")
+        stream.write("Types:\n")
+        for type in module.types:
+            t = module.types[type]
+            if t['id'] >= FirstDynamicTypeID:
+                stream.write("\t"+type+":"+module.getTypeString(t['id'])+"\n")
+        stream.write("Constants:\n")
+        for const in module.constants:
+            constant = module.constants[const]
+            stream.write("\t"+module.getTypeName(constant['type'])+" "+const+" = "+str(constant['value'])+"\n")
+        stream.write("Functions:\n")
+        for name in module.functions:
+            stream.write("\t"+name+" = "+str(module.functions[name])+"\n")
+        stream.write("Unresolved types:\n")
+        for name in module.unresolvedTypes:
+            stream.write("\t"+name+": "+str(module.unresolvedTypes[name]['id'])+"\n")
+        stream.write("Structs:\n")
+        for name in module.structs:
+            struct_ = module.structs[name]
+            stream.write("\t"+name+": "+str(struct_['id'])+"\n")
+            lastIndex = len(struct_['variables'])+len(struct_['compose'])
+            for i in range(lastIndex):
+                for v in struct_['variables']:
+                    if v['order'] == i:
+                        isStatic = "static " if v['static'] else ""
+                        stream.write("\t\t"+isStatic+module.getTypeString(v['typeid'])+" "+v['name']+"\n")
+                for c in struct_['compose']:
+                    if c['order'] == i:
+                        stream.write("\t\t"+c['name']+"\n")
+
+    def writeCode(self, stream, start = 0, end = None, annotate = False):
+        # start has to be the address of an operation.
+        code = self.module.code
+        end = len(code) if end == None else min(end, len(code))
+        names = operationNames
+        pc = start
+        pushed = None
+        while pc < end:
+            opcode = code[pc]
+            size = operationSize[opcode]
+            line = "\t"+names[opcode]
+            if size > 1:
+                for parameter in parameterFormats[size].unpack_from(code, pc+1):
+                    line += ", "+str(parameter)
+            if annotate:
+                comment = self.annotation(pc, opcode, pushed)
+                line = "%8d" % pc+line+("  ; "+comment if comment != None else "")
+                pushed = code[pc+1] if opcode == pushU8Operation else None
+            stream.write(line+"\n")
+            pc += size
+
+    def functionRange(self, name):
+        # Start and end address of a function, it ends where the next one starts.
+        labels = self.labelOffsets()
+        start = labels[self.module.functions[name]]
+        end = len(self.module.code)
+        for label in self.module.functions.values():
+            offset = labels.get(label)
+            if offset != None and start < offset < end:
+                end = offset
+        return start, end
+
+    def writeFunction(self, stream, name, annotate = True):
+        start, end = self.functionRange(name)
+        stream.write(name+":\n")
+        self.writeCode(stream, start, end, annotate)
+
+    def labelOffsets(self):
+        if len(self.module.labelOffsets) == 0:
+            # A module of an older compiler has no label segment.
+            self.module.scanLabels()
+        return self.module.labelOffsets
+
+    def annotation(self, pc, opcode, pushed):
+        if self.functionLabels == None:
+            # Function names by the address of their start, the optimized code has no Label operations.
+            labels = self.labelOffsets()
+            self.functionLabels = {labels[label]: name for name, label in self.module.functions.items() if label in labels}
+            self.importNames = [lib+"."+f for lib in self.module.imports for f in self.module.imports[lib]]
+            self.constantNames = list(self.module.constants)
+        comment = self.operationAnnotation(pc, opcode, pushed)
+        name = self.functionLabels.get(pc)
+        if name == None:
+            return comment
+        return "function "+name+(", "+comment if comment != None else "")
+
+    def operationAnnotation(self, pc, opcode, pushed):
+        module = self.module
+        if opcode in jumpOperations:
+            target = module.relocations.get(pc)
+            if target == None:
+                return "unresolved label"
+            name = self.functionLabels.get(target)
+            return "-> "+str(target)+(" "+name if name != None and opcode == invokeOperation else "")
+        if opcode == constantOperation and pushed != None and pushed < len(self.constantNames):
+            name = self.constantNames[pushed]
+            return "constant "+name+" = "+str(module.constants[name]['value'])
+        if opcode == importOperation and pushed != None and pushed < len(self.importNames):
+            return "import "+self.importNames[pushed]
+        if opcode == initOperation:
+            typeID = module.code[pc+1] | module.code[pc+2] << 8
+            return "type "+self.typeName(typeID)
+        return None
+
+    def typeName(self, id):
+        module = self.module
+        name = module.getTypeName(id)
+        if name != None:
+            return name
+        for table in (module.structs, module.unresolvedTypes):
+            for name in table:
+                if table[name]['id'] == id:
+                    return name
+        return str(id)
+
+def disassemble(module, annotate = False):
+    stream = io.StringIO()
+    Disassembler(module).write(stream, annotate)
+    return stream.getvalue()
+
+if __name__ == '__main__':
+    # nilang_disassembler.py <module.nimo> [function], an annotated listing of the module or of one function.
+    if len(sys.argv) < 2:
+        print('Usage: python nilang_disassembler.py <module.nimo> [function]')
+        exit(1)
+    module = IRModule()
+    module.load(sys.argv[1])
+    disassembler = Disassembler(module)
+    if len(sys.argv) > 2:
+        disassembler.writeFunction(sys.stdout, sys.argv[2])
+    else:
+        disassembler.write(sys.stdout, True)
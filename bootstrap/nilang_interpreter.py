@@ -3,6 +3,10 @@ from numpy.lib.function_base import kaiser
 from nilang_ir import *
 from ctypes import *
 
+def operandValue(value):
+    # Constants are ctypes values, the code pushes ints and bools.
+    return getattr(value, 'value', value)
+
 class VM:
     def __init__(self) -> None:
         self.functionTable = []
@@ -16,21 +20,40 @@ class VM:
         self.loadedLibs = {}
         self.loadedFunctions = {} 
         self.stack = []
-        self.labels = {}
         self.functions = {}
+        # Offset of the target of every jump by the offset of the jump.
+        self.targets = {}
         self.structs = {}
         self.types = {}
         self.loadedDeps = {}
+        self.unresolvedTypes = {}
+        self.resolvedTypes = {}
+        # Values of the constants of the main module by index, of the linked
+        # dependencies by module, see ModuleConstants(), and the values of all
+        # linked modules by type and value, equal constants share one value.
+        self.constantValues = []
+        self.moduleConstants = {}
+        self.linkedConstants = {}
 
     def AddMainModule(self,irModule):
         reader = IRModule()        
        # print(irModule)
         reader.read(irModule)  
+        self.UseMainModule(reader)
+
+    def LoadMainModule(self,path):
+        reader = IRModule()
+        reader.load(path)
+        self.UseMainModule(reader)
+
+    def UseMainModule(self,reader):
+        # The code is executed in place, a view of the module.
         self.functions = reader.functions
-        self.LoadLabels(reader.code)
         self.irCode = reader.code
+        self.LoadFunctions(reader)
         self.imports = reader.imports
         self.constants = reader.constants
+        self.constantValues = self.LinkConstants(reader.constants)
         self.structs = reader.structs
         self.types = reader.types
         self.unresolvedTypes = reader.unresolvedTypes
@@ -41,16 +64,29 @@ class VM:
 
     def AddModule(self,name):
         reader = IRModule()        
-        bytes = open('gc_cache/'+name+'.gc.nimo','rb').read()        
-        reader.read(bytes)
+        reader.load('gc_cache/'+name+'.gc.nimo')
         self.loadedDeps[name] = reader
         for dep in reader.dependencies:
             if not dep in self.loadedDeps.keys(): 
                 self.AddModule(dep)
 
+    def solveUnresolvedTypes(self):
+        # The main module only knows the types of its dependencies by name.
+        self.resolvedTypes = {}
+        for name, entry in self.unresolvedTypes.items():
+            for dep in self.loadedDeps.values():
+                if name in dep.structs:
+                    self.resolvedTypes[entry['id']] = dep.structs[name]
+                    break
+                if name in dep.types:
+                    self.resolvedTypes[entry['id']] = dep.types[name]
+                    break
+
     def DecodeOperation(self):
         operation = self.irCode[self.pc]
-        if operation >= FirstFiveByteOperation:
+        if operation >= FirstSixByteOperation:
+            consumedBytes = 6
+        elif operation >= FirstFiveByteOperation:
             consumedBytes = 5
         elif operation >= FirstThreeByteOperation:
             consumedBytes = 3
@@ -82,69 +118,39 @@ class VM:
                 function = self.loadedLibs[lib][f]
                 self.loadedFunctions[f]=function
 
-    def LoadLabels(self, irCode):
-        pc = 0
-        end = len(irCode)
-        labels = {}
-        codeOffset = len(self.irCode)
-        # load relative labels
-        while pc < end:
-            operation = irCode[pc]
-            if operation >= FirstFiveByteOperation:
-                consumedBytes = 5
-            elif operation >= FirstThreeByteOperation:
-                consumedBytes = 3
-            elif operation >= FirstTwoByteOperation:
-                consumedBytes = 2
-            else:
-                consumedBytes = 1
-            if operation == bc['Label']:
-                id = irCode[pc+1]
-                labels[id]=pc
-            pc += consumedBytes
-        # add absolute jump address
-        pc = 0
-        while pc < end:
-            operation = irCode[pc]
-            if operation >= FirstFiveByteOperation:
-                consumedBytes = 5
-            elif operation >= FirstThreeByteOperation:
-                consumedBytes = 3
-            elif operation >= FirstTwoByteOperation:
-                consumedBytes = 2
-            else:
-                consumedBytes = 1
-            if operation == bc['JumpIf']:
-                id = irCode[pc+1]
-                self.labels[pc+codeOffset] = labels[id]+codeOffset
-            if operation == bc['Invoke']:
-                id = irCode[pc+1]
-                self.labels[pc+codeOffset] = labels[id]+codeOffset
-            if operation == bc['Goto']:
-                id = irCode[pc+1]
-                self.labels[pc+codeOffset] = labels[id]+codeOffset 
-            pc += consumedBytes
+    def LoadFunctions(self, reader):
+        # The relocations of the module are the jump targets, only the functions
+        # are found by their labels.
+        if reader.version < VERSION:
+            # The code of an older compiler has other jumps.
+            reader.translateCode()
+            self.irCode = reader.code
+        elif not reader.hasRelocations():
+            reader.scanLabels()
+        self.targets = reader.relocations
+        labelOffsets = reader.labelOffsets
         for f in self.functions:
-            self.functions[f] = labels[self.functions[f]]+codeOffset
+            self.functions[f] = labelOffsets[self.functions[f]]
 
     def Nop(self):
         pass
 
+    # Run adds the size of the jump, the next operation is the target.
     def JumpIf(self):
         condition = self.stack.pop()
         if condition:
-            self.pc = self.labels[self.pc]-2
+            self.pc = self.targets[self.pc]-5
 
     def Goto(self):
-        self.pc = self.labels[self.pc]-2
+        self.pc = self.targets[self.pc]-5
 
     def Invoke(self):
-        argc = self.irCode[self.pc+2]
+        argc = self.irCode[self.pc+5]
         self.stack.append(argc)# add how many
         self.stack.append(self.fp)# save the current fp 
-        self.stack.append(self.pc+2)# save the pc after this operation
+        self.stack.append(self.pc+5)# save the pc after this operation
         self.fp = len(self.stack)
-        self.pc = self.labels[self.pc]-2
+        self.pc = self.targets[self.pc]-6
         #print(self.stack)
         #print(self.pc)
 
@@ -178,7 +184,22 @@ class VM:
     def Equal(self):
         left = self.stack.pop()
         right = self.stack.pop()
-        self.stack.append(left.value == right.value)
+        self.stack.append(operandValue(left) == operandValue(right))
+
+    def NotEqual(self):
+        left = self.stack.pop()
+        right = self.stack.pop()
+        self.stack.append(operandValue(left) != operandValue(right))
+
+    def Less(self):
+        right = self.stack.pop()
+        left = self.stack.pop()
+        self.stack.append(operandValue(left) < operandValue(right))
+
+    def LessEqual(self):
+        right = self.stack.pop()
+        left = self.stack.pop()
+        self.stack.append(operandValue(left) <= operandValue(right))
 
     def Not(self):
         value = self.stack.pop()
@@ -204,11 +225,28 @@ class VM:
             res = func.restype(res)
         self.stack.append(res)
 
+    def LinkConstants(self, constants):
+        result = []
+        for const in constants.values():
+            key = (const['type'], const['value'])
+            value = self.linkedConstants.get(key)
+            if value == None:
+                value = self.convertValue(const['value'],const['type'])
+                self.linkedConstants[key] = value
+            result.append(value)
+        return result
+
+    def ModuleConstants(self, name):
+        # A dependency is linked on the first use, loading it doesn't decode its constants.
+        values = self.moduleConstants.get(name)
+        if values == None:
+            values = self.LinkConstants(self.loadedDeps[name].constants)
+            self.moduleConstants[name] = values
+        return values
+
     def PushConst(self):
         index = self.stack.pop()
-        const = list(self.constants.values())[index]
-        value = self.convertValue(const['value'],const['type'])
-        self.stack.append(value)
+        self.stack.append(self.constantValues[index])
 
     def convertValue(self,val,type):
         result = val
@@ -220,16 +258,19 @@ class VM:
             result = c_uint32(val)
         elif type==9:
             result = c_int32(val)
+        elif type==3:
+            result = c_uint64(val)
+        elif type==10:
+            result = c_int64(val)
+        elif type==16:
+            result = c_double(val)
         else:
             print('Implement type')
         return result
 
     def ResolveAddrOfConstIndex(self):
         index = self.stack.pop()
-        #print(self.constants)
-        const = list(self.constants.values())[index]
-        value = self.convertValue(const['value'],const['type'])
-        self.stack.append(value)
+        self.stack.append(self.constantValues[index])
 
     def PushU8(self):
         value = self.irCode[self.pc+1]
@@ -1,4 +1,5 @@
 import numpy as np
+import mmap
 import struct
 from ctypes import *
 from numpy.core.fromnumeric import var
@@ -20,12 +21,187 @@ def VARIABLE(variable, order, typeid):
 def COMPOSE(compose, order):
     return {'order': order, 'name': compose.typename}
 
+# Module format version 4: "NIMO", a version field, the segment directory
+# (count and "<HII" id, offset and size of every segment) and the segments.
+# Counts, lengths, ids and labels are LEB128, the values are little endian,
+# names are a length and utf-8.
+# The compiler resolves the jumps: JumpIf, Goto and Invoke have the offset of
+# their target as "<I" operand, Label has a "<H" label. Segment 8 has the
+# relocations ("<II" offset of a jump and of its label) and segment 9 the labels
+# ("<II" label and offset), both are unpacked without a loop. The VM finds the
+# functions by the labels. A constant with the type and value of an earlier one
+# has the type sameConstant and the index of the earlier constant as value.
+# Version 3 has the same container, the code of versions 1 to 3 has the jumps
+# of the first compiler, see translateCode(). Version 2 has no directory, every
+# segment has a "<HI" header (id, size). Version 1 starts with MAGIC and has
+# "HH" segment headers, one byte counts and lengths and 16 bit ids. They are
+# only read.
+MAGIC2 = b'NIMO'
+VERSION = 4
+moduleHeader = struct.Struct('<4sH')
+segmentHeader2 = struct.Struct('<HI')
+directoryHeader = struct.Struct('<I')
+directoryEntry = struct.Struct('<HII')
+u16le = struct.Struct('<H')
+u32le = struct.Struct('<I')
+i32le = struct.Struct('<i')
+u64le = struct.Struct('<Q')
+i64le = struct.Struct('<q')
+f64le = struct.Struct('<d')
+offsetPair = struct.Struct('<II')
+# Type of a constant which refers to the value of an earlier constant.
+sameConstant = 255
+
+def varint(value):
+    # LEB128, 7 bits per byte from the lowest, the high bit marks a following byte.
+    value = int(value)
+    if value < 0x80:
+        return bytes((value,))
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7F) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+def encodeName(name):
+    data = name.encode()
+    return varint(len(data))+data
+
+def readVarint(data, offset):
+    # Returns the value and the offset after it.
+    result = data[offset]
+    if result < 0x80:
+        return result, offset+1
+    result &= 0x7F
+    shift = 7
+    offset += 1
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+def readName(data, text, offset):
+    # Returns the name at offset and the offset after it, text is the data decoded as latin-1.
+    length = data[offset]
+    if length < 0x80:
+        start = offset+1
+    else:
+        length, start = readVarint(data, offset)
+    end = start+length
+    name = text[start:end]
+    return (name if name.isascii() else str(data[start:end], 'utf-8')), end
+
+def moduleVersion(data):
+    # The format version, 0 if data isn't a module.
+    if len(data) >= moduleHeader.size and data[:4] == MAGIC2:
+        return moduleHeader.unpack_from(data, 0)[1]
+    if len(data) >= 4 and u32.unpack_from(data, 0)[0] == MAGIC:
+        return 1
+    return 0
+
+# Fields of the version 1 format, native byte order and standard sizes like its writer.
+u16 = struct.Struct('=H')
+u32 = struct.Struct('=I')
+i32 = struct.Struct('=i')
+segmentHeader = struct.Struct('=HH')
+typeHeader = struct.Struct('=HHBB')
+templateParameterEntry = struct.Struct('=BH')
+structHeader = struct.Struct('=HHHB')
+structVariable = struct.Struct('=BH')
+pointerValue = struct.Struct('=BQ')
+
+# The tables of the segments, by segment id. The code is segment 1.
+segmentTables = {0: 'imports', 2: 'constants', 3: 'types', 4: 'dependencies', 5: 'functions', 6: 'structs', 7: 'unresolvedTypes',
+                 8: 'relocations', 9: 'labelOffsets'}
+segmentIds = {name: id for id, name in segmentTables.items()}
+
+class SegmentTable:
+    # A table of the module, the segments which read found are decoded on the first access.
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.field = '_'+name
+
+    def __get__(self, module, owner = None):
+        if module == None:
+            return self
+        if self.name in module.pending:
+            module.decode(self.name)
+        return module.__dict__[self.field]
+
+    def __set__(self, module, value):
+        module.pending.pop(self.name, None)
+        module.__dict__[self.field] = value
+
+def indexValue(values, value, index):
+    # The first constant of a value.
+    try:
+        values.setdefault(value, index)
+    except TypeError:
+        pass
+
+def indexConstants(module, constants):
+    # Names, the first constant of a value and of a serialized type and value.
+    names = {}
+    values = {}
+    pool = {}
+    for index, name in enumerate(constants):
+        const = constants[name]
+        names[name] = index
+        indexValue(values, const['value'], index)
+        indexValue(pool, (module.resolveTypeID(const['type']), const['value']), index)
+    return names, values, pool
+
+def indexTypes(module, types):
+    ids = {}
+    for name in types:
+        ids.setdefault(types[name]['id'], name)
+    return ids
+
+def indexImports(module, imports):
+    functions = {}
+    index = 0
+    for lib in imports.values():
+        for f in lib:
+            functions.setdefault(f, index)
+            index += 1
+    return functions
+
+indexBuilders = {'constants': indexConstants, 'types': indexTypes, 'imports': indexImports}
+
 class IRModule:
+    imports = SegmentTable()
+    types = SegmentTable()
+    constants = SegmentTable()
+    structs = SegmentTable()
+    functions = SegmentTable()
+    dependencies = SegmentTable()
+    unresolvedTypes = SegmentTable()
+    relocations = SegmentTable()
+    labelOffsets = SegmentTable()
+
     def __init__(self) -> None:
+        # Table name: version and segments which aren't decoded yet.
+        self.pending = {}
+        self.version = VERSION
+        self.directory = []
+        self.mapping = None
+        # Index name: table, size and index, see index().
+        self.indexes = {}
+        # Number of the next literal, see addLiteral().
+        self.literals = 0
         self.code = bytearray()        
         self.imports = {}
         self.types = {}
         self.labels = {}
+        # Label: code offset, jumps which aren't resolved and the resolved jumps, see emitJump().
+        self.labelOffsets = {}
+        self.fixups = []
+        self.relocations = {}
+        self.sequences = {}
         self.constants = {}
         self.structs = {}
         self.functions = {}
@@ -35,9 +211,15 @@ class IRModule:
         self.nextDynamicTypeID = FirstDynamicTypeID
 
     def addImport(self, library, function):
+        functions = self.index('imports')
+        # Functions of an earlier library move the ones after them, it is indexed again.
+        last = not library in self.imports.keys() or library == next(reversed(self.imports))
         if not library in self.imports.keys():
             self.imports[library] = []
         self.imports[library].append(function)
+        if last:
+            functions.setdefault(function, self.indexes['imports'][1])
+            self.indexed('imports')
 
     def addDependency(self, name):
         if not name in self.dependencies.keys():
@@ -46,6 +228,7 @@ class IRModule:
     def addType(self, name, isConst, typeId, templateParameter):
         id = 0
         if not name in self.types.keys():
+            ids = self.index('types')
             id = self.nextDynamicTypeID
             self.nextDynamicTypeID+=1
             self.types[name] = {
@@ -54,6 +237,8 @@ class IRModule:
                 'typeID': typeId,
                 'templateParameter':templateParameter
             }
+            ids.setdefault(id, name)
+            self.indexed('types')
         else:
             id = self.types[name]['id']
         return id
@@ -78,14 +263,35 @@ class IRModule:
         self.alias[alias].append(type)
 
     def addConstant(self, name, type, value):
-        if not name in self.constants.keys():
+        names, values, pool = self.index('constants')
+        index = names.get(name)
+        if index == None:
+            index = len(self.constants)
             self.constants[name] = {'type':type,'value':value}
-        index = list(self.constants.keys()).index(name)
+            names[name] = index
+            indexValue(values, value, index)
+            indexValue(pool, (self.resolveTypeID(type), value), index)
+            self.indexed('constants')
+        return index
+
+    # A literal of the code is a constant named __s<n>. Equal literals share a
+    # constant, a named constant of the same type and value is used as well.
+    def addLiteral(self, type, value):
+        names, values, pool = self.index('constants')
+        index = pool.get((self.resolveTypeID(type), value))
+        if index == None:
+            while '__s'+str(self.literals) in names:
+                self.literals += 1
+            index = self.addConstant('__s'+str(self.literals), type, value)
+            self.literals += 1
         return index
 
     def addLabel(self, name):
         if not name in self.labels.keys():
             index = len(self.labels.keys())
+            if index > 0xFFFF:
+                # The operand of Label has 16 bits, functions and ifs share the labels.
+                raise ValueError('more than 65536 labels in one module, '+name+' needs another unit')
             self.labels[name] = index
         else:
             index = self.labels[name]
@@ -110,237 +316,193 @@ class IRModule:
             id = self.unresolvedTypes[name]['id']
         return id
 
+    # The assembler appends to the code, the bytearray grows with spare capacity.
+    # Every operation is packed by a precompiled Struct for its opcode.
     def emit(self,opcode, *parameter):
-        # 1 Byte opcode
-        self.code += struct.pack("B",opcode)
-        if opcode >= FirstFiveByteOperation:# 4Byte parameter
-            if len(parameter) == 1:
-                self.code += struct.pack("L",*parameter)
-            else:
-                self.code += struct.pack("BBBB",*parameter)
-        elif opcode >= FirstThreeByteOperation:# 2Byte parameter
-            if len(parameter) == 1:
-                self.code += struct.pack("H",*parameter)
+        self.code += operationPackers[opcode][len(parameter)](opcode, *parameter)
+
+    def emitAll(self, operations):
+        # operations are tuples of an opcode and its parameters, equal sequences share one Struct.
+        shape = tuple([(operation[0], len(operation)) for operation in operations])
+        pack = self.sequences.get(shape)
+        if pack == None:
+            format = ''.join(operationFormats[operationSize[opcode]][count-1] for opcode, count in shape)
+            pack = struct.Struct('<'+format).pack
+            self.sequences[shape] = pack
+        self.code += pack(*[value for operation in operations for value in operation])
+
+    def emitLabel(self, label):
+        self.labelOffsets[label] = len(self.code)
+        self.emit(bc['Label'], label)
+
+    def emitJump(self, opcode, label, *parameter):
+        # JumpIf, Goto and Invoke, finishFunction() writes the target into the operand.
+        self.fixups.append((len(self.code), label))
+        self.emit(opcode, 0, *parameter)
+
+    def finishFunction(self):
+        # Relocations map the offset of a jump to the offset of its label, jumps to
+        # labels which aren't emitted yet wait for the next function.
+        pending = []
+        for offset, label in self.fixups:
+            target = self.labelOffsets.get(label)
+            if target != None:
+                self.relocations[offset] = target
+                u32le.pack_into(self.code, offset+1, target)
             else:
-                self.code += struct.pack("BB",*parameter)
-        elif opcode >= FirstTwoByteOperation:# 1Byte parameter
-            self.code += struct.pack("B",*parameter)
+                pending.append((offset, label))
+        self.fixups = pending
 
     def generate(self):
-        result = bytearray()
-        # magic number NIMO
-        result += struct.pack("I",MAGIC)
-        # add dependencies
-        binaryData = self.generateDependencySegment()
-        result += struct.pack("HH",np.uint16(4),np.uint16(len(binaryData)))
-        result += binaryData
-
-        # add import segments
+        self.finishFunction()
+        if len(self.labelOffsets) == 0:
+            # The code wasn't emitted by emitLabel() and emitJump().
+            self.scanLabels()
+        segments = [(4, self.generateDependencySegment())]
         for lib in self.imports:
-            binaryData = self.generateImportSegment(lib)
-            # segment id
-            # segment size in bytes
-            # segment data
-            result += struct.pack("HH",np.uint16(0),np.uint16(len(binaryData)))
-            result += binaryData
-        
-        binaryData = self.generateTypeSegment()
-        result += struct.pack("HH",np.uint16(3),np.uint16(len(binaryData)))
-        result += binaryData
-
-        binaryData = self.generateStructSegment()
-        result += struct.pack("HH",np.uint16(6),np.uint16(len(binaryData)))
-        result += binaryData
-
-        binaryData = self.generateUnresolvedTypes()
-        result += struct.pack("HH",np.uint16(7),np.uint16(len(binaryData)))
-        result += binaryData
-
-        binaryData = self.generateConstantSegment()
-        result += struct.pack("HH",np.uint16(2),np.uint16(len(binaryData)))
-        result += binaryData
-
-        binaryData = self.generateFunctionSegment()
-        result += struct.pack("HH",np.uint16(5),np.uint16(len(binaryData)))
-        result += binaryData
-
-        # code segment
-        result += struct.pack("HH",np.uint16(1),np.uint16(len(self.code)))
-        result += self.code
+            segments.append((0, self.generateImportSegment(lib)))
+        segments.append((3, self.generateTypeSegment()))
+        segments.append((6, self.generateStructSegment()))
+        segments.append((7, self.generateUnresolvedTypes()))
+        segments.append((2, self.generateConstantSegment()))
+        segments.append((5, self.generateFunctionSegment()))
+        segments.append((8, self.generateRelocationSegment()))
+        segments.append((9, self.generateLabelSegment()))
+        segments.append((1, self.code))
+        result = bytearray(moduleHeader.pack(MAGIC2, VERSION))
+        result += directoryHeader.pack(len(segments))
+        # segment id, offset and size in bytes, then the data of the segments
+        offset = len(result)+len(segments)*directoryEntry.size
+        for id, data in segments:
+            result += directoryEntry.pack(id, offset, len(data))
+            offset += len(data)
+        for id, data in segments:
+            result += data
         return result
 
     def generateText(self):
-        result = "Dependencies:\n"
-        for dep in self.dependencies:
-            result += "\t"+dep+"\n"
-        result += "Imports:\n"
-        for lib in self.imports:
-            result += "\tLibrary: "+lib+"\n"
-            for func in self.imports[lib]:
-                result+= "\t\tFunction: "+func+"\n"
-        result+="Types:\n"
-        for type in self.types:
-            t = self.types[type]
-            if t['id'] >= FirstDynamicTypeID:
-                const = ''
-                if t['isConstant']:
-                    const = 'const '
-                id = const + self.getTypeName(t['typeID'])
-                if len(t['templateParameter']) > 0:
-                    id += "<"
-                    for tt in t['templateParameter'][:-1]:
-                        if tt['isConstant']:
-                            id+= "const "
-                        id += self.getTypeName(tt['typeID'])+","
-                    tt = t['templateParameter'][-1]
-                    if tt['isConstant']:
-                        id+= "const "
-                    id += self.getTypeName(tt['typeID'])
-                    id += ">"
-                result+= "\t"+type+":"+id+"\n"
-        result+="Constants:\n"
-        for const in self.constants:
-            constant = self.constants[const]
-            result += "\t"+self.getTypeName(constant['type'])+" "+const+" = "+str(constant['value'])+"\n"
-        result+="Functions:\n"
-        for name in self.functions:
-            function = self.functions[name]
-            result += "\t"+name+" = "+str(function)+"\n"
-        result+="Unresolved types:\n"
-        for name in self.unresolvedTypes:
-            id = self.unresolvedTypes[name]['id']
-            result += "\t"+name+": "+str(id)+"\n"
-        result+="Structs:\n"
-        #print(self.structs)
-        for name in self.structs:
-            struct_ = self.structs[name]
-            result += "\t"+name+": "+str(struct_['id'])+"\n"
-            lastIndex = len(struct_['variables'])+len(struct_['compose'])
-            for i in range(lastIndex):
-                for v in struct_['variables']:
-                    if v['order'] == i:
-                        isStatic = ""
-                        if v['static']:
-                            isStatic = "static "
-                        result += "\t\t"+isStatic+self.getTypeString(v['typeid'])+" "+v['name']+"\n"
-                for c in struct_['compose']:
-                    if c['order'] == i:
-                        result += "\t\t"+c['name']+"\n"
-        result+="Code:\n"
-        result+=str(len(self.code))+"bytes\n"
-        pc = 0
-        while pc < len(self.code):
-            opcode = self.code[pc]
-            result += "\t"+list(bc.keys())[list(bc.values()).index(opcode)]
-            if opcode >= FirstFiveByteOperation:
-                pc += 5
-            elif opcode >= FirstThreeByteOperation:
-                result += ", "+str(self.code[pc+1])
-                result += ", "+str(self.code[pc+2])
-                pc += 3
-            elif opcode >= FirstTwoByteOperation:
-                result += ", "+str(self.code[pc+1])
-                pc += 2
-            else:
-                pc += 1
-            result += "\n"
-        return result
+        import nilang_disassembler
+        return nilang_disassembler.disassemble(self)
 
     def generateStructSegment(self):
-        result = bytearray()
-        result += struct.pack("B", np.uint8(len(self.structs.keys())))
+        result = bytearray(varint(len(self.structs)))
         for name in self.structs:
             struct_ = self.structs[name]
-            result += struct.pack("B"+str(len(name))+"s",len(name),name.encode())
-            result += struct.pack("=HHHB",np.uint16(struct_['id']),np.uint16(len(struct_['variables'])),np.uint16(len(struct_['compose'])),np.uint8(len(struct_['templateParameter'])))
+            result += encodeName(name)
+            result += varint(struct_['id'])+varint(len(struct_['variables']))+varint(len(struct_['compose']))+varint(len(struct_['templateParameter']))
             for m in struct_['variables']:
-                result += struct.pack("=HB"+str(len(m['name']))+"s",np.uint16(m['order']),len(m['name']),m['name'].encode())
-                result += struct.pack("=BH",np.uint8(m['static']),np.uint16(m['typeid']))
+                result += varint(m['order'])+encodeName(m['name'])
+                result += bytes((1 if m['static'] else 0,))+varint(m['typeid'])
             for m in struct_['compose']:
-                result += struct.pack("=HB"+str(len(m['name']))+"s",np.uint16(m['order']),len(m['name']),m['name'].encode())
-            #for tp in struct_['templateParameter']:
-            #    result += struct.pack("=BH",np.uint8(tp['isConstant']),np.uint16(tp['typeID']))                
+                result += varint(m['order'])+encodeName(m['name'])
         return result
 
     def generateUnresolvedTypes(self):
-        result = bytearray()
-        result += struct.pack("B",np.uint8(len(self.unresolvedTypes.keys())))
+        result = bytearray(varint(len(self.unresolvedTypes)))
         for name in self.unresolvedTypes:
-            result += struct.pack("B"+str(len(name))+"s",len(name),name.encode())
-            result += struct.pack("=H",np.uint16(self.unresolvedTypes[name]['id']))
+            result += encodeName(name)+varint(self.unresolvedTypes[name]['id'])
         return result
 
     def generateFunctionSegment(self):
-        result = bytearray()
-        result += struct.pack("B",np.uint8(len(self.functions.keys())))
+        result = bytearray(varint(len(self.functions)))
         for name in self.functions:
-            result += struct.pack("B"+str(len(name))+"s",len(name),name.encode())
-            result += struct.pack("=H",np.uint16(self.functions[name]))
+            result += encodeName(name)+varint(self.functions[name])
         return result
 
+    def generateRelocationSegment(self):
+        relocations = self.relocations
+        return struct.pack('<%dI' % (len(relocations)*2), *[value for offset in sorted(relocations) for value in (offset, relocations[offset])])
+
+    def generateLabelSegment(self):
+        labels = self.labelOffsets
+        return struct.pack('<%dI' % (len(labels)*2), *[value for label in labels for value in (label, labels[label])])
+
     def generateDependencySegment(self):
-        result = bytearray()
-        result += struct.pack("B",np.uint8(len(self.dependencies.keys())))
+        result = bytearray(varint(len(self.dependencies)))
         for dep in self.dependencies:
-            result += struct.pack("B"+str(len(dep))+"s",len(dep),dep.encode())
+            result += encodeName(dep)
         return result
 
     def generateTypeSegment(self):
-        result = bytearray()
-        for t in self.types:
+        dynamic = [t for t in self.types if self.types[t]['id'] >= FirstDynamicTypeID]
+        result = bytearray(varint(len(dynamic)))
+        for t in dynamic:
             type_ = self.types[t]
-            if type_['id'] >= FirstDynamicTypeID:
-                result += struct.pack("B"+str(len(t))+"s",len(t),t.encode())
-                result += struct.pack("=HHBB",np.uint16(type_['id']),np.uint16(type_['typeID']),np.uint8(type_['isConstant']),np.uint8(len(type_['templateParameter'])))
-                for tp in type_['templateParameter']:
-                    result += struct.pack("=BH",np.uint8(tp['isConstant']),np.uint16(tp['typeID']))
+            result += encodeName(t)
+            result += varint(type_['id'])+varint(type_['typeID'])+bytes((1 if type_['isConstant'] else 0,))+varint(len(type_['templateParameter']))
+            for tp in type_['templateParameter']:
+                result += bytes((1 if tp['isConstant'] else 0,))+varint(tp['typeID'])
         return result
 
-    def generateConstantSegment(self):
-        result = bytearray()
-        for const in self.constants:
+    def generateConstantSegment(self, shared = True):
+        # Without shared every constant has its value.
+        names, values, pool = self.index('constants') if shared else ({}, {}, {})
+        result = bytearray(varint(len(self.constants)))
+        for index, const in enumerate(self.constants):
             typeID = self.resolveTypeID(self.constants[const]['type'])
-            # store type, namelen, name
-            result += struct.pack("BB"+str(len(const))+"s",typeID,len(const),const.encode())
+            value = self.constants[const]['value']
+            try:
+                first = pool.get((typeID, value), index)
+            except TypeError:
+                first = index
+            if first < index:
+                # the value is stored once
+                result += bytes((sameConstant,))+encodeName(const)+varint(first)
+                continue
+            # store type, name
+            result += bytes((typeID,))+encodeName(const)
             # store value
             if typeID == 22:#ptr
-                result += struct.pack("=BQ",8,self.constants[const]['value'])
-            if typeID == 2:#u32
-                result += struct.pack("L",self.constants[const]['value'])
-            if typeID == 9:#i32
-                result += struct.pack("L",self.constants[const]['value'])
-            if typeID == 20:#strlit
-                string = self.constants[const]['value']
-                result += struct.pack("B"+str(len(string))+"s",len(string),string.encode())
+                result += u64le.pack(value)
+            elif typeID == 2:#u32
+                result += u32le.pack(value)
+            elif typeID == 9:#i32
+                result += i32le.pack(value)
+            elif typeID == 3:#u64
+                result += u64le.pack(value)
+            elif typeID == 10:#i64
+                result += i64le.pack(value)
+            elif typeID == 16:#f64
+                result += f64le.pack(value)
+            elif typeID == 20:#strlit
+                result += encodeName(value)
         return result
 
     def generateImportSegment(self, library):
-        result = bytearray()
-        # library name
-        result += struct.pack("B"+str(len(library))+"s",len(library),library.encode())
-        # functions of the library
+        # library name and its functions
+        result = bytearray(encodeName(library))
+        result += varint(len(self.imports[library]))
         for func in self.imports[library]:
-            result += struct.pack("B"+str(len(func))+"s",len(func),func.encode())
+            result += encodeName(func)
         return result
 
+    # The tables stay the ordered dictionaries which are serialized, the indexes
+    # map names, ids and values to them. The add methods extend an index, a table
+    # which was replaced or changed otherwise is indexed again on the next lookup.
+    def index(self, name):
+        table = getattr(self, name)
+        size = sum(map(len, table.values())) if name == 'imports' else len(table)
+        entry = self.indexes.get(name)
+        if entry == None or entry[0] is not table or entry[1] != size:
+            entry = [table, size, indexBuilders[name](self, table)]
+            self.indexes[name] = entry
+        return entry[2]
+
+    def indexed(self, name):
+        # The table grew by the entry the caller added to the index.
+        self.indexes[name][1] += 1
+
     def resolveTypeID(self,id):
-        if id >= FirstDynamicTypeID:
-            for t in self.types:
-                if self.types[t]['id'] == id:
-                    result = self.resolveTypeID(self.types[t]['typeID'])
-                    break
-        else:
-            result = id
-        return result
+        ids = self.index('types')
+        while id >= FirstDynamicTypeID:
+            id = self.types[ids.get(id)]['typeID']
+        return id
 
     def getTypeString(self,id):
         result = ""
-        type_ = None
-        for t in self.types:
-            if self.types[t]['id'] == id:
-                type_ = self.types[t]
-                break
-        if type_ != None:
+        name = self.index('types').get(id)
+        if name != None:
+            type_ = self.types[name]
             if type_['isConstant']:
                 result = 'const '
             id = self.getTypeName(type_['typeID'])
@@ -359,131 +521,322 @@ class IRModule:
         return result
 
     def getTypeName(self,id):
-        for t in self.types:
-            if self.types[t]['id'] == id:
-                return t
+        return self.index('types').get(id)
 
     def isImportFunction(self,name):
-        for lib in self.imports.values():
-            if name in lib:
-                return True
-        return False
+        return name in self.index('imports')
 
     def getImportFunctionIndex(self,name):
-        result = 0
-        for lib in self.imports.values():
-            for f in lib:
-                if name == f:
-                    return result
-                result += 1
-        return None
+        return self.index('imports').get(name)
 
     def getConstIndex(self,value):
-        result = 0
-        for const in self.constants.values():
-            if const['value'] == value:
-                return result
-            result += 1
-        return None
+        names, values, pool = self.index('constants')
+        try:
+            return values.get(value)
+        except TypeError:
+            # unhashable values aren't indexed
+            for index, const in enumerate(self.constants.values()):
+                if const['value'] == value:
+                    return index
+            return None
 
     def getConstnameIndex(self,name):
-        result = 0
-        for const in self.constants.keys():
-            if const == name:
-                return result
-            result += 1
-        return None
+        names, values, pool = self.index('constants')
+        return names.get(name)
 
+    # The reader only locates the segments, a table decodes its segments on the
+    # first access. The segments and the code are views of the module, the
+    # module stays referenced until they are decoded.
     def read(self, bytes):
-        offset = 0
-        magic = np.frombuffer(bytes,np.uint32,1,offset)
-        offset+=4
-        if magic == MAGIC:
-            while offset < len(bytes):
-                segment = self.readSegment(bytes,offset)
-                offset+=segment['size']+4
-                if segment['id'] == 1:
-                    self.code = segment['data']
-                if segment['id'] == 0:
-                    importSegment = self.parseImportSegment(segment)
-                    if importSegment['lib'] != None and importSegment['functions'] != None:
-                        if not importSegment['lib'] in self.imports.keys():
-                            self.imports[importSegment['lib']] = []
-                        self.imports[importSegment['lib']] += importSegment['functions']
-                if segment['id'] == 2:
-                    constSegment = self.parseConstSegment(segment)
-                    for k in constSegment:
-                        self.constants[k] = constSegment[k]
-                if segment['id'] == 3:
-                    typeSegment = self.parseTypeSegment(segment)
-                    for t in typeSegment:
-                        self.types[t] = typeSegment[t]
-                if segment['id'] == 4:
-                    dependencySegment = self.parseDependencySegment(segment)
-                    for d in dependencySegment:
-                        self.dependencies[d] = dependencySegment[d]
-                if segment['id'] == 5:
-                    functionSegment = self.parseFunctionSegment(segment)
-                    for name in functionSegment:
-                        self.functions[name] = functionSegment[name]
-                if segment['id'] == 6:
-                    structSegment = self.parseStructSegment(segment)
-                    for name in structSegment:
-                        self.structs[name] = structSegment[name]
-                if segment['id'] == 7:
-                    unresolvedTypeSegment = self.parseUnresolvedTypeSegment(segment)
-                    for name in unresolvedTypeSegment:
-                        self.unresolvedTypes[name] = unresolvedTypeSegment[name]
-
-    def parseStructSegment(self, segment):
-        data = segment['data']
-        size = segment['size']
+        data = memoryview(bytes)
+        version = moduleVersion(data)
+        if version == 0:
+            return
+        if version > VERSION:
+            raise ValueError('module version '+str(version)+' is newer than the compiler, version '+str(VERSION)+' is supported')
+        self.version = version
+        self.directory = list(self.segments(data, version))
+        for id, segment in self.directory:
+            if id == 1:
+                self.code = segment
+            elif id in segmentTables:
+                self.pending.setdefault(segmentTables[id], (version, []))[1].append(segment)
+
+    # Maps the module file read-only, the segments and the code are views of the
+    # mapping. Processes which load the same module share its pages.
+    def load(self, path):
+        with open(path,'rb') as f:
+            try:
+                self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file can't be mapped
+                return
+        self.read(self.mapping)
+
+    def decode(self, name):
+        version, segments = self.pending.pop(name)
+        table = self.__dict__['_'+name]
+        for segment in segments:
+            if name == 'imports':
+                lib, functions = self.parsers(version)[0](segment)
+                if not lib in table:
+                    table[lib] = []
+                table[lib] += functions
+            else:
+                table.update(self.parsers(version)[segmentIds[name]](segment))
+
+    def decodeAll(self):
+        for name in list(self.pending):
+            self.decode(name)
+
+    # Only decodes the dependency segment, the build reads it for every unit.
+    def readDependencies(self, bytes):
+        self.read(bytes)
+        return list(self.dependencies.keys())
+
+    def parsers(self, version):
+        # The segment parsers by segment id.
+        if version == 1:
+            return {0: self.parseImportSegmentV1, 2: self.parseConstSegmentV1, 3: self.parseTypeSegmentV1, 4: self.parseDependencySegmentV1,
+                    5: self.parseFunctionSegmentV1, 6: self.parseStructSegmentV1, 7: self.parseUnresolvedTypeSegmentV1}
+        return {0: self.parseImportSegment, 2: self.parseConstSegment, 3: self.parseTypeSegment, 4: self.parseDependencySegment,
+                5: self.parseFunctionSegment, 6: self.parseStructSegment, 7: self.parseUnresolvedTypeSegment,
+                8: self.parseRelocationSegment, 9: self.parseLabelSegment}
+
+    def segments(self, data, version = VERSION):
+        # Yields the id and a view of the data of every segment.
+        if version >= 3:
+            count = directoryHeader.unpack_from(data, moduleHeader.size)[0]
+            start = moduleHeader.size+directoryHeader.size
+            for id, offset, size in directoryEntry.iter_unpack(data[start:start+count*directoryEntry.size]):
+                yield id, data[offset:offset+size]
+            return
+        header = segmentHeader2 if version == 2 else segmentHeader
+        offset = moduleHeader.size if version == 2 else 4
+        end = len(data)
+        while offset < end:
+            id, size = header.unpack_from(data, offset)
+            offset += header.size
+            yield id, data[offset:offset+size]
+            offset += size
+
+    # Version 2, the names are slices of the segment decoded as latin-1 which
+    # keeps the offsets of the bytes. A length below 0x80 is a single byte.
+    def parseStructSegment(self, data):
         result = {}
-        offset = 0
-        amount = np.frombuffer(data,np.uint8,1,offset)[0]
-        offset += 1
-        while offset < size:
-            len = np.frombuffer(data,np.uint8,1,offset)[0]
-            offset += 1
-            text = np.frombuffer(data,np.uint8,len,offset)
-            offset += len
-            name = str(text,'ascii')
-            id = np.frombuffer(data,np.uint16,1,offset)[0]
-            offset += 2
-            variableCount = np.frombuffer(data,np.uint16,1,offset)[0]
-            offset += 2
-            composeCount = np.frombuffer(data,np.uint16,1,offset)[0]
-            offset += 2
-            template_parameters = np.frombuffer(data,np.uint8,1,offset)[0]
+        text = str(data, 'latin-1')
+        count, offset = readVarint(data, 0)
+        for i in range(count):
+            name, end = readName(data, text, offset)
+            id, offset = readVarint(data, end)
+            variableCount, offset = readVarint(data, offset)
+            composeCount, offset = readVarint(data, offset)
+            templateParameter, offset = readVarint(data, offset)
+            variables = []
+            compose = []
+            for j in range(variableCount):
+                order, offset = readVarint(data, offset)
+                mname, end = readName(data, text, offset)
+                typeid, offset = readVarint(data, end+1)
+                variables.append({'order':order, 'name':mname, 'static':data[end] != 0, 'typeid':typeid, 'decoration':[]})
+            for j in range(composeCount):
+                order, offset = readVarint(data, offset)
+                mname, offset = readName(data, text, offset)
+                compose.append({'order':order, 'name':mname})
+            result[name] = {
+                'id': id,
+                'templateParameter':[],
+                'variables':variables,
+                'compose':compose
+            }
+        return result
+
+    def parseFunctionSegment(self, data):
+        result = {}
+        text = str(data, 'latin-1')
+        count, offset = readVarint(data, 0)
+        for i in range(count):
+            name, end = readName(data, text, offset)
+            label = data[end]
+            if label < 0x80:
+                offset = end+1
+            else:
+                label, offset = readVarint(data, end)
+            result[name] = label
+        return result
+
+    def parseTypeSegment(self, data):
+        result = {}
+        text = str(data, 'latin-1')
+        count, offset = readVarint(data, 0)
+        for i in range(count):
+            name, end = readName(data, text, offset)
+            id, offset = readVarint(data, end)
+            typeID, offset = readVarint(data, offset)
+            isConst = data[offset] != 0
+            templateParameter, offset = readVarint(data, offset+1)
+            tp = []
+            for j in range(templateParameter):
+                tpTypeID, end = readVarint(data, offset+1)
+                tp.append({'isConstant':data[offset] != 0,'typeID':tpTypeID})
+                offset = end
+            result[name] = {
+                'id': id,
+                'isConstant': isConst,
+                'typeID': typeID,
+                'templateParameter':tp
+            }
+        return result
+
+    def parseUnresolvedTypeSegment(self, data):
+        result = {}
+        text = str(data, 'latin-1')
+        count, offset = readVarint(data, 0)
+        for i in range(count):
+            name, end = readName(data, text, offset)
+            typeId, offset = readVarint(data, end)
+            result[name] = {'id':typeId}
+        return result
+
+    def parseRelocationSegment(self, data):
+        return dict(offsetPair.iter_unpack(data))
+
+    def parseLabelSegment(self, data):
+        return dict(offsetPair.iter_unpack(data))
+
+    def hasRelocations(self):
+        # Modules of older compilers have no relocations, the VM scans their code.
+        return self.version >= 4 and any(id == 8 for id, segment in self.directory)
+
+    # The code of versions 1 to 3 is assembled again: JumpIf, Label and Goto had a
+    # one byte label, Invoke a label and the argument count. The other operations
+    # kept their opcodes.
+    def translateCode(self):
+        code = bytes(self.code)
+        self.code = bytearray()
+        self.labelOffsets = {}
+        self.relocations = {}
+        self.fixups = []
+        pc = 0
+        end = len(code)
+        while pc < end:
+            operation = code[pc]
+            size = legacyOperationSize[operation]
+            if operation == legacyLabel:
+                self.emitLabel(code[pc+1])
+            elif operation in legacyJumps:
+                self.emitJump(legacyJumps[operation], code[pc+1], *code[pc+2:pc+size])
+            else:
+                self.code += code[pc:pc+size]
+            pc += size
+        self.finishFunction()
+        self.version = VERSION
+
+    def scanLabels(self):
+        labels = {}
+        relocations = {}
+        code = self.code
+        label = int(bc['Label'])
+        jumpOperations = (int(bc['JumpIf']), int(bc['Invoke']), int(bc['Goto']))
+        pc = 0
+        end = len(code)
+        while pc < end:
+            operation = code[pc]
+            if operation == label:
+                labels[u16le.unpack_from(code, pc+1)[0]] = pc
+            elif operation in jumpOperations:
+                relocations[pc] = u32le.unpack_from(code, pc+1)[0]
+            pc += operationSize[operation]
+        self.labelOffsets = labels
+        self.relocations = relocations
+        self.fixups = []
+
+    def parseDependencySegment(self, data):
+        result = {}
+        text = str(data, 'latin-1')
+        count, offset = readVarint(data, 0)
+        for i in range(count):
+            name, offset = readName(data, text, offset)
+            result[name] = {}
+        return result
+
+    def parseConstSegment(self, data):
+        result = {}
+        entries = []
+        text = str(data, 'latin-1')
+        count, offset = readVarint(data, 0)
+        for i in range(count):
+            typeID = data[offset]
             offset += 1
+            name, offset = readName(data, text, offset)
+            value = None
+            if typeID == sameConstant:
+                first, offset = readVarint(data, offset)
+                typeID, value = entries[first]['type'], entries[first]['value']
+            elif typeID == 20:# strlit
+                value, offset = readName(data, text, offset)
+            elif typeID == 9:# i32
+                value = i32le.unpack_from(data, offset)[0]
+                offset += 4
+            elif typeID == 2:# u32
+                value = u32le.unpack_from(data, offset)[0]
+                offset += 4
+            elif typeID == 22:# ptr
+                value = u64le.unpack_from(data, offset)[0]
+                offset += 8
+            elif typeID == 3:# u64
+                value = u64le.unpack_from(data, offset)[0]
+                offset += 8
+            elif typeID == 10:# i64
+                value = i64le.unpack_from(data, offset)[0]
+                offset += 8
+            elif typeID == 16:# f64
+                value = f64le.unpack_from(data, offset)[0]
+                offset += 8
+            result[name] = {'type':typeID, 'value': value}
+            entries.append(result[name])
+        return result
+
+    def parseImportSegment(self, data):
+        # Returns the library and its functions.
+        text = str(data, 'latin-1')
+        lib, offset = readName(data, text, 0)
+        count, offset = readVarint(data, offset)
+        functions = []
+        for i in range(count):
+            name, offset = readName(data, text, offset)
+            functions.append(name)
+        return lib, functions
+
+    # Version 1, a segment is decoded into one string, the names are slices of it.
+    # Latin-1 keeps the offsets of the bytes, the names are ascii.
+    def parseStructSegmentV1(self, data):
+        result = {}
+        offset = 1
+        size = len(data)
+        text = str(data, 'latin-1')
+        unpackHeader = structHeader.unpack_from
+        unpackVariable = structVariable.unpack_from
+        unpackOrder = u16.unpack_from
+        while offset < size:
+            end = offset+1+data[offset]
+            name = text[offset+1:end]
+            id, variableCount, composeCount, templateParameter = unpackHeader(data, end)
+            offset = end+7
             variables = []
             compose = []
             for i in range(variableCount):
-                order = np.frombuffer(data,np.uint16,1,offset)[0]
-                offset+=2
-                len = np.frombuffer(data,np.uint8,1,offset)[0]
-                offset += 1
-                text = np.frombuffer(data,np.uint8,len,offset)
-                offset += len
-                mname = str(text,'ascii')
-                static = np.frombuffer(data,np.uint8, 1, offset)[0]
-                offset += 1
-                typeid = np.frombuffer(data,np.uint16,1,offset)[0]
-                offset += 2
-                if static != 0:
-                    isStatic = True
-                else:
-                    isStatic = False
-                variables.append({'order':order, 'name':mname, 'static':isStatic, 'typeid':typeid, 'decoration':[]})
+                order = unpackOrder(data, offset)[0]
+                end = offset+3+data[offset+2]
+                mname = text[offset+3:end]
+                static, typeid = unpackVariable(data, end)
+                offset = end+3
+                variables.append({'order':order, 'name':mname, 'static':static != 0, 'typeid':typeid, 'decoration':[]})
             for i in range(composeCount):
-                order = np.frombuffer(data,np.uint16,1,offset)[0]
-                offset+=2
-                len = np.frombuffer(data,np.uint8,1,offset)[0]
-                offset += 1
-                text = np.frombuffer(data,np.uint8,len,offset)
-                offset += len
-                mname = str(text,'ascii')
-                compose.append({'order':order, 'name':mname})
+                order = unpackOrder(data, offset)[0]
+                end = offset+3+data[offset+2]
+                compose.append({'order':order, 'name':text[offset+3:end]})
+                offset = end
             result[name] = {
                 'id': id,
                 'templateParameter':[],
@@ -492,150 +845,105 @@ class IRModule:
             }
         return result
 
-    def parseFunctionSegment(self, segment):
-        data = segment['data']
-        size = segment['size']
+    def parseFunctionSegmentV1(self, data):
         result = {}
-        offset = 0
-        amount = np.frombuffer(data,np.uint8,1,offset)[0]
-        offset += 1
+        offset = 1
+        size = len(data)
+        text = str(data, 'latin-1')
+        unpackLabel = u16.unpack_from
         while offset < size:
-            len = np.frombuffer(data,np.uint8,1,offset)[0]
-            offset += 1
-            text = np.frombuffer(data,np.uint8,len,offset)
-            offset += len
-            name = str(text,'ascii')
-            label = np.frombuffer(data,np.uint16,1,offset)[0]
-            offset += 2
-            result[name] = label
+            end = offset+1+data[offset]
+            result[text[offset+1:end]] = unpackLabel(data, end)[0]
+            offset = end+2
         return result
 
-    def parseTypeSegment(self, segment):
-        data = segment['data']
-        size = segment['size']
+    def parseTypeSegmentV1(self, data):
         result = {}
         offset = 0
+        size = len(data)
+        text = str(data, 'latin-1')
+        unpackHeader = typeHeader.unpack_from
+        unpackParameter = templateParameterEntry.unpack_from
         while offset < size:
-            len = np.frombuffer(data,np.uint8,1,offset)[0]
-            offset += 1
-            text = np.frombuffer(data,np.uint8,len,offset)
-            offset += len
-            name = str(text,'ascii')
-            id = np.frombuffer(data,np.uint16,1,offset)[0]
-            offset += 2
-            typeID = np.frombuffer(data,np.uint16,1,offset)[0]
-            offset += 2
-            isConst = np.frombuffer(data,np.uint8,1,offset)[0] != 0
-            offset += 1
-            templateParameter = np.frombuffer(data,np.uint8,1,offset)[0]
-            offset += 1            
+            end = offset+1+data[offset]
+            name = text[offset+1:end]
+            id, typeID, isConst, templateParameter = unpackHeader(data, end)
+            offset = end+6
             tp = []
             for i in range(templateParameter):
-                isTConst = np.frombuffer(data, np.uint8, 1, offset)[0] != 0
-                offset+=1
-                tpTypeID = np.frombuffer(data,np.uint16,1,offset)[0]
-                offset+=2
-                tp.append(TP(isTConst,tpTypeID))
+                isTConst, tpTypeID = unpackParameter(data, offset)
+                offset += 3
+                tp.append({'isConstant':isTConst != 0,'typeID':tpTypeID})
             result[name] = {
                 'id': id,
-                'isConstant': isConst,
+                'isConstant': isConst != 0,
                 'typeID': typeID,
                 'templateParameter':tp
             }
         return result
 
-    def parseUnresolvedTypeSegment(self, segment):
-        data = segment['data']
-        size = segment['size']
+    def parseUnresolvedTypeSegmentV1(self, data):
         result = {}
-        offset = 0
-        amount = np.frombuffer(data,np.uint8,1,offset)[0]
-        offset += 1
+        offset = 1
+        size = len(data)
+        text = str(data, 'latin-1')
+        unpackId = u16.unpack_from
         while offset < size:
-            len = np.frombuffer(data,np.uint8,1,offset)[0]
-            offset += 1
-            text = np.frombuffer(data,np.uint8,len,offset)
-            offset += len
-            name = str(text,'ascii')
-            typeId = np.frombuffer(data,np.uint16,1,offset)[0]
-            offset += 2
-            result[name] = {'id':typeId}
+            end = offset+1+data[offset]
+            result[text[offset+1:end]] = {'id':unpackId(data, end)[0]}
+            offset = end+2
         return result
 
-    def parseDependencySegment(self, segment):
-        data = segment['data']
-        size = segment['size']
+    def parseDependencySegmentV1(self, data):
         result = {}
-        offset = 0
-        amount = np.frombuffer(data,np.uint8,1,offset)[0]
-        offset+=1
+        offset = 1
+        size = len(data)
+        text = str(data, 'latin-1')
         while offset < size:
-            len = np.frombuffer(data,np.uint8,1,offset)[0]
-            offset += 1
-            text = np.frombuffer(data,np.uint8,len,offset)
-            offset += len
-            name = str(text,'ascii')
-            result[name] = {}
+            end = offset+1+data[offset]
+            result[text[offset+1:end]] = {}
+            offset = end
         return result
 
-    def parseConstSegment(self, segment):
-        data = segment['data']
-        size = segment['size']
+    def parseConstSegmentV1(self, data):
         result = {}
         offset = 0
+        size = len(data)
+        text = str(data, 'latin-1')
         while offset < size:
-            typeID = np.frombuffer(data, np.uint8,1,offset)[0]
-            offset += 1
-            len = np.frombuffer(data,np.uint8,1,offset)[0]
-            offset += 1
-            text = np.frombuffer(data,np.uint8,len,offset)
-            offset += len
-            name = str(text,'ascii')
+            typeID = data[offset]
+            end = offset+2+data[offset+1]
+            name = text[offset+2:end]
+            offset = end
             value = None
             if typeID == 20:# strlit
-                strlen = np.frombuffer(data,np.uint8,1,offset)[0]
-                offset += 1
-                text = np.frombuffer(data,np.uint8,strlen,offset)
-                offset += strlen
-                value = str(text,'ascii')
-            if typeID == 9:# i32
-                value = np.frombuffer(data,np.int32,1,offset)[0]
+                end = offset+1+data[offset]
+                value = text[offset+1:end]
+                offset = end
+            elif typeID == 9:# i32
+                value = i32.unpack_from(data, offset)[0]
                 offset += 4
-            if typeID == 2:# u32
-                value = np.frombuffer(data,np.uint32,1,offset)[0]
+            elif typeID == 2:# u32
+                value = u32.unpack_from(data, offset)[0]
                 offset += 4
-            if typeID == 22:# ptr
-                arrlen = np.frombuffer(data,np.uint8,1,offset)[0]
-                offset += 1
-                value = np.frombuffer(data,np.uint64,1,offset)[0]
-                offset += 8
+            elif typeID == 22:# ptr
+                value = pointerValue.unpack_from(data, offset)[1]
+                offset += 9
             result[name] = {'type':typeID, 'value': value}
         return result
 
-    def parseImportSegment(self, segment):
-        data = segment['data']
-        size = segment['size']
-        result = {}
-        offset = 0
-        len = np.frombuffer(data, np.uint8,1, offset)
-        offset+=1
-        text = np.frombuffer(data, np.uint8,len[0], offset)  
-        offset+=len[0]
-        result['lib'] = str(text,'ascii')
-        result['functions'] = []
+    def parseImportSegmentV1(self, data):
+        # Returns the library and its functions.
+        size = len(data)
+        text = str(data, 'latin-1')
+        offset = 1+data[0]
+        lib = text[1:offset]
+        functions = []
         while offset < size:
-            len = np.frombuffer(data, np.uint8,1, offset)
-            offset+=1
-            text = np.frombuffer(data, np.uint8,len[0], offset)
-            offset+=len[0]
-            result['functions'].append(str(text, 'ascii'))
-        return result
-
-    def readSegment(self, bytes, offset):
-        segmentHeader = np.frombuffer(bytes, np.uint16, 2,offset)
-        offset+=4
-        segmentData = np.frombuffer(bytes, np.uint8, segmentHeader[1],offset)
-        return {'id' : segmentHeader[0], 'size': segmentHeader[1], 'data': segmentData}
+            end = offset+1+data[offset]
+            functions.append(text[offset+1:end])
+            offset = end
+        return lib, functions
 
     def setDefaultTypes(self):
         for type in types:
@@ -674,28 +982,46 @@ bc = {
     "PushConst":np.uint8(18),
     "ResolveAddrOfConstIndex":np.uint8(19),
     "Pop":np.uint8(20),
+    "NotEqual":np.uint8(21),
 # 2byte ops
     "CallIntrinsic" : np.uint8(127),
     "PushU8": np.uint8(128),
-    "JumpIf": np.uint8(129),
-    "Label": np.uint8(130),
-    "Goto": np.uint8(131),
     "Call" : np.uint8(132),
     "Copy": np.uint8(133),
 # 3byte ops
     "PushU16": np.uint8(200),
-    "Invoke": np.uint8(201),
     "Init": np.uint8(202),
-#    "Copy": np.uint8(203),
+    "Label": np.uint8(203),
 #    "SizeOf": np.uint8(204),
 #    "Store": np.uint8(205),
 #    "Load": np.uint8(206),
 # 5byte ops
     "PushU32": np.uint8(210),    
+    "JumpIf": np.uint8(211),
+    "Goto": np.uint8(212),
+# 6byte ops
+    "Invoke": np.uint8(220),
 }
-FirstTwoByteOperation = bc["CallIntrinsic"]
-FirstThreeByteOperation = bc["PushU16"]
-FirstFiveByteOperation = bc["PushU32"]
+# Plain ints, comparing an int with a numpy scalar is slow.
+FirstTwoByteOperation = int(bc["CallIntrinsic"])
+FirstThreeByteOperation = int(bc["PushU16"])
+FirstFiveByteOperation = int(bc["PushU32"])
+FirstSixByteOperation = int(bc["Invoke"])
+# Size of every operation with its parameter, indexed by the opcode.
+operationSize = bytes(6 if op >= FirstSixByteOperation else 5 if op >= FirstFiveByteOperation else 3 if op >= FirstThreeByteOperation else 2 if op >= FirstTwoByteOperation else 1 for op in range(256))
+# Name of every opcode, the first name of an opcode in bc.
+operationNames = ['Unknown'+str(op) for op in range(256)]
+for name, opcode in reversed(bc.items()):
+    operationNames[opcode] = name
+# Jumps of the module versions 1 to 3 by their opcode and the sizes of their operations.
+legacyLabel = 130
+legacyJumps = {129: int(bc['JumpIf']), 131: int(bc['Goto']), 201: int(bc['Invoke'])}
+legacyOperationSize = bytes(5 if op >= 210 else 3 if op >= 200 else 2 if op >= 127 else 1 for op in range(256))
+# Formats of the opcode and its parameters by the size of the operation and the
+# number of parameters, a parameter fills the operation or is one byte.
+operationFormats = {1: {0: 'B'}, 2: {1: 'BB'}, 3: {1: 'BH', 2: 'BBB'}, 5: {1: 'BI', 4: 'BBBBB'}, 6: {2: 'BIB'}}
+# pack of the precompiled Struct by opcode and number of parameters.
+operationPackers = [{count: struct.Struct('<'+format).pack for count, format in operationFormats[size].items()} for size in operationSize]
 
 types = {
     "u8" : np.uint8(0),
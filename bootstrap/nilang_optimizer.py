@@ -0,0 +1,182 @@
+import os
+from nilang_ir import *
+
+# Peephole optimizer of the code of an IRModule, runs after the code generation
+# and before IRModule.generate(). The code is decoded into a list of operations,
+# the jumps point at operations. Every rule removes or rewrites a few operations,
+# the rules run until nothing changes anymore. The relocations and label offsets
+# are written for the new code, the VM doesn't need the Label operations then.
+# GC_PEEPHOLE=off disables it.
+
+labelOperation = int(bc['Label'])
+gotoOperation = int(bc['Goto'])
+jumpIfOperation = int(bc['JumpIf'])
+equalOperation = int(bc['Equal'])
+notOperation = int(bc['Not'])
+notEqualOperation = int(bc['NotEqual'])
+popOperation = int(bc['Pop'])
+# Operations which only push a value.
+pushOperations = (int(bc['PushOne']), int(bc['PushZero']), int(bc['PushU8']), int(bc['PushU16']), int(bc['PushU32']), int(bc['Copy']))
+
+def enabled():
+    return os.environ.get('GC_PEEPHOLE','on') != 'off'
+
+class Operation:
+    __slots__ = ('opcode', 'parameter', 'target')
+
+    def __init__(self, opcode, parameter, target = None):
+        self.opcode = opcode
+        # The parameter bytes, encode() writes the target of a jump into them.
+        self.parameter = parameter
+        # Index of the operation a jump goes to, None if it isn't resolved.
+        self.target = target
+
+class PeepholeOptimizer:
+    def __init__(self, module):
+        self.module = module
+        # Removed operations by rule.
+        self.removed = {'labels': 0, 'not': 0, 'goto next': 0, 'push pop': 0}
+        self.retargeted = 0
+
+    def optimize(self):
+        # Returns the number of removed operations.
+        self.decode()
+        changed = True
+        while changed:
+            changed = self.removeLabels()
+            changed = self.fuseNotEqual() or changed
+            changed = self.shortenJumps() or changed
+            changed = self.removeGotoNext() or changed
+            changed = self.removePushPop() or changed
+        self.encode()
+        return sum(self.removed.values())
+
+    def decode(self):
+        module = self.module
+        module.finishFunction()
+        if len(module.labelOffsets) == 0:
+            module.scanLabels()
+        code = module.code
+        self.operations = []
+        indexes = {}
+        pc = 0
+        end = len(code)
+        while pc < end:
+            opcode = code[pc]
+            size = operationSize[opcode]
+            indexes[pc] = len(self.operations)
+            self.operations.append(Operation(opcode, bytes(code[pc+1:pc+size])))
+            pc += size
+        indexes[end] = len(self.operations)
+        for offset, target in module.relocations.items():
+            self.operations[indexes[offset]].target = indexes[target]
+        # Labels and jumps which wait for a label stay attached to their operation.
+        self.labels = {label: indexes[offset] for label, offset in module.labelOffsets.items()}
+        self.fixups = [(indexes[offset], label) for offset, label in module.fixups]
+
+    def leaders(self):
+        # Operations which are entered by a jump or a call, a rule doesn't remove them behind another operation.
+        result = set(self.labels.values())
+        for operation in self.operations:
+            if operation.target != None:
+                result.add(operation.target)
+        return result
+
+    def rewrite(self, keep):
+        # Keeps the operations with keep[i], references to a removed operation move to the next one.
+        moved = []
+        operations = []
+        for i, operation in enumerate(self.operations):
+            moved.append(len(operations))
+            if keep[i]:
+                operations.append(operation)
+        moved.append(len(operations))
+        for operation in operations:
+            if operation.target != None:
+                operation.target = moved[operation.target]
+        self.labels = {label: moved[index] for label, index in self.labels.items()}
+        self.fixups = [(moved[index], label) for index, label in self.fixups if keep[index]]
+        self.operations = operations
+
+    def removeLabels(self):
+        keep = [operation.opcode != labelOperation for operation in self.operations]
+        if all(keep):
+            return False
+        self.removed['labels'] += len(keep)-sum(keep)
+        self.rewrite(keep)
+        return True
+
+    def fuseNotEqual(self):
+        # Equal, Not: NotEqual
+        operations = self.operations
+        leaders = self.leaders()
+        keep = [True]*len(operations)
+        for i in range(len(operations)-1):
+            if operations[i].opcode == equalOperation and operations[i+1].opcode == notOperation and keep[i] and not i+1 in leaders:
+                operations[i].opcode = notEqualOperation
+                keep[i+1] = False
+        if all(keep):
+            return False
+        self.removed['not'] += len(keep)-sum(keep)
+        self.rewrite(keep)
+        return True
+
+    def shortenJumps(self):
+        # A jump to a Goto goes to the target of the Goto.
+        changed = False
+        operations = self.operations
+        for operation in operations:
+            if operation.target == None or not operation.opcode in (gotoOperation, jumpIfOperation):
+                continue
+            target = operation.target
+            visited = set()
+            while target < len(operations) and operations[target].opcode == gotoOperation and operations[target].target != None and not target in visited:
+                visited.add(target)
+                target = operations[target].target
+            if target != operation.target:
+                operation.target = target
+                self.retargeted += 1
+                changed = True
+        return changed
+
+    def removeGotoNext(self):
+        keep = [not (operation.opcode == gotoOperation and operation.target == i+1) for i, operation in enumerate(self.operations)]
+        if all(keep):
+            return False
+        self.removed['goto next'] += len(keep)-sum(keep)
+        self.rewrite(keep)
+        return True
+
+    def removePushPop(self):
+        operations = self.operations
+        leaders = self.leaders()
+        keep = [True]*len(operations)
+        for i in range(len(operations)-1):
+            if operations[i].opcode in pushOperations and operations[i+1].opcode == popOperation and keep[i] and not i+1 in leaders:
+                keep[i] = False
+                keep[i+1] = False
+        if all(keep):
+            return False
+        self.removed['push pop'] += len(keep)-sum(keep)
+        self.rewrite(keep)
+        return True
+
+    def encode(self):
+        module = self.module
+        offsets = []
+        size = 0
+        for operation in self.operations:
+            offsets.append(size)
+            size += 1+len(operation.parameter)
+        offsets.append(size)
+        code = bytearray()
+        for operation in self.operations:
+            code.append(operation.opcode)
+            if operation.target != None:
+                code += u32le.pack(offsets[operation.target])+operation.parameter[4:]
+            else:
+                code += operation.parameter
+        module.code = code
+        module.relocations = {offsets[i]: offsets[operation.target] for i, operation in enumerate(self.operations) if operation.target != None}
+        module.labelOffsets = {label: offsets[index] for label, index in self.labels.items()}
+        module.fixups = [(offsets[index], label) for index, label in self.fixups]